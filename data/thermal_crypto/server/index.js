@@ -70,7 +70,7 @@ class SocketHandler extends UseCaseDBSocketHandler {
             WHERE
                 bp.currency_code = '${currency}'
                 AND cp.ts >= ? and cp.ts < ?
-                ${this.filter('currency_code')}
+                ${this.filter('cp.currency_code')}
             ORDER BY cp.ts ASC`;
 
         const rows = this.db.prepare(sql).all(start, end);
@@ -0,0 +1,134 @@
+import argparse
+import hashlib
+import json
+import sys
+import zlib
+
+import blocks
+import stockdb
+import writer
+
+parser = argparse.ArgumentParser(description='precomputes the socket messages of the server per time bucket into stocks_messages')
+parser.add_argument('--db', default='data.db')
+parser.add_argument('--time-factors', type=int, nargs='+', default=[24 * 60 * 60], help='time factors [sec] of the buckets, the timeFactor of the clients, default: 1 day')
+parser.add_argument('--filters', default=None, help='json file with a list of {"filter_in": [...], "filter_ex": [...]} node filters to precompute besides no filter')
+parser.add_argument('--incremental', '-i', action='store_true', help='rebuild only the buckets after the cache watermarks left by crawl.py')
+parser.add_argument('--level', type=int, default=6, help='zlib compression level')
+
+DAY = 24 * 60 * 60
+TABLE = 'stocks_messages'
+# same as TABLE_PRICES_FIELDS and TABLE_PRICES_ROLLUPS of server/index.js
+FIELDS = ('open', 'high', 'low', 'close', 'volume', 'adj_close')
+ROLLUPS = ((90 * DAY, 'stocks_quarterly'), (28 * DAY, 'stocks_monthly'), (7 * DAY, 'stocks_weekly'))
+
+
+def filter_key(filter_in=(), filter_ex=()):
+  '''hash of a node filter, the same as filter_key of server/UseCaseDBSocketHandler.js'''
+  canonical = json.dumps({'ex': sorted(filter_ex or []), 'in': sorted(filter_in or [])}, separators=(',', ':'), sort_keys=True, ensure_ascii=False)
+  return hashlib.sha1(canonical.encode('utf-8')).hexdigest()[:16]
+
+
+def ensure_table(db):
+  # payload = zlib compressed json array of the {nip, ts, attrs} messages of the bucket in ts order
+  db.execute('CREATE TABLE IF NOT EXISTS ' + TABLE + '''(time_factor int, filter text, bucket int, rows int, payload blob,
+    PRIMARY KEY (time_factor, filter, bucket))''')
+
+
+def prices_table(db, time_factor, since=None):
+  for min_time_factor, table in ROLLUPS:
+    if time_factor >= min_time_factor and db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone():
+      return table
+  # the daily bars of the packed months as well, a week before since covers the bucket of since
+  return blocks.source(db, start=stockdb.add_days(since, -7) if since else None)
+
+
+def build(db, time_factor, filters, since=None, level=6):
+  '''rebuilds the buckets of the time factor from the bucket of since on, all if None, returns the number of buckets
+
+  bucket b holds the messages with b * time_factor <= ts < (b + 1) * time_factor, like a step of send_data_impl.
+  filters without any bucket of the time factor yet are built in full, such that the buckets of a key always
+  start at the first data.
+  '''
+  keys = [(filter_key(f.get('filter_in'), f.get('filter_ex')), set(f.get('filter_in') or []), set(f.get('filter_ex') or [])) for f in filters]
+  fresh = set(key for key, _, _ in keys)
+  if since:
+    cached = set(r[0] for r in db.execute('SELECT DISTINCT filter FROM ' + TABLE + ' WHERE time_factor = ?', (time_factor,)))
+    fresh -= cached
+  table = prices_table(db, time_factor, None if fresh else since)
+  first = None
+  if since:
+    # a weekly, monthly or quarterly bar starting before since covers it as well
+    start = db.execute('SELECT max(ts) FROM ' + table + ' WHERE ts <= ?', (stockdb.to_ts(since),)).fetchone()[0]
+    first = (start if start is not None else stockdb.to_ts(since)) // time_factor
+  # drop the changed buckets of filters not rebuilt now as well, the server queries them instead
+  if first is None:
+    db.execute('DELETE FROM ' + TABLE + ' WHERE time_factor = ?', (time_factor,))
+  else:
+    db.execute('DELETE FROM ' + TABLE + ' WHERE time_factor = ? AND bucket >= ?', (time_factor, first))
+
+  cursor = db.execute('SELECT ticker, ts, ' + ', '.join(FIELDS) + ' FROM ' + table + ' WHERE ts >= ? ORDER BY ts',
+                      (0 if fresh else first * time_factor,))
+  insert = 'INSERT INTO ' + TABLE + '(time_factor, filter, bucket, rows, payload) VALUES (?, ?, ?, ?, ?)'
+  n = 0
+  bucket, msgs = None, []
+
+  def flush():
+    for key, filter_in, filter_ex in keys:
+      if key not in fresh and bucket < first:
+        continue
+      selected = [m for m in msgs if (not filter_in or m['nip'] in filter_in) and m['nip'] not in filter_ex]
+      if selected:
+        payload = json.dumps(selected, separators=(',', ':')).encode('utf-8')
+        db.execute(insert, (time_factor, key, bucket, len(selected), zlib.compress(payload, level)))
+
+  for row in cursor:
+    b = row[1] // time_factor
+    if b != bucket:
+      if msgs:
+        flush()
+        n += 1
+      bucket, msgs = b, []
+    msgs.append({'nip': row[0], 'ts': row[1], 'attrs': dict(zip(FIELDS, row[2:]))})
+  if msgs:
+    flush()
+    n += 1
+  return n
+
+
+def load_filters(path):
+  filters = [{}]
+  if path is not None:
+    with open(path, 'r') as f:
+      filters.extend(json.load(f))
+  return filters
+
+
+if __name__ == '__main__':
+  args = parser.parse_args()
+  if any(tf <= 0 or tf % DAY for tf in args.time_factors):
+    # the server reads whole days, see floor_day of server/index.js
+    parser.error('time factors must be multiples of a day')
+  filters = load_filters(args.filters)
+
+  with writer.connect(args.db, bulk=True) as db:
+    stockdb.ensure_schema(db)
+    ensure_table(db)
+    since = None
+    empty = db.execute('SELECT 1 FROM ' + TABLE + ' LIMIT 1').fetchone() is None
+    marks = stockdb.watermarks(db, 'cache')
+    if args.incremental and not empty:
+      if not marks:
+        print('cache is up to date')
+        sys.exit(0)
+      # a bucket holds the messages of all tickers, rebuild from the earliest change on
+      since = min(marks.values())
+    stale = [r[0] for r in db.execute('SELECT DISTINCT time_factor FROM ' + TABLE) if r[0] not in args.time_factors]
+    if stale:
+      db.execute('DELETE FROM ' + TABLE + ' WHERE time_factor IN (' + ','.join('?' * len(stale)) + ')', stale)
+      print('dropped the buckets of time factors ' + ', '.join(str(tf) for tf in stale))
+    for time_factor in args.time_factors:
+      n = build(db, time_factor, filters, since, args.level)
+      print('cached ' + str(n) + ' buckets of ' + str(time_factor) + ' s for ' + str(len(filters)) + ' filters' + (' since ' + since if since else ''))
+    # marks lowered by a concurrent crawl meanwhile stay
+    stockdb.clear_processed(db, 'cache', marks.items())
+    db.commit()
@@ -1,13 +1,20 @@
+from __future__ import print_function
+
 __author__ = 'sam'
 
-from yql import YRequest
+from yql import ResponseCache, YRequest, configure
+from scheduler import FetchScheduler
 import csv
 import argparse
 
 import datetime
 import os
+import time
 
-import sqlite3
+import metrics
+import shards
+import stockdb
+import writer
 
 parser = argparse.ArgumentParser(description='DOT Importer')
 parser.add_argument('--basedir', default='./')
@@ -19,8 +26,39 @@ parser.add_argument('--clear', action='store_true')
 parser.add_argument('--start', '-s', default=None, help='start date')
 parser.add_argument('--end', '-e', default=None, help='end date')
 parser.add_argument('--years', nargs='+', default=None, help='years to import')
+parser.add_argument('--workers', '-w', type=int, default=1, help='number of concurrent fetch workers')
+parser.add_argument('--rate', type=float, default=None, help='max requests per second across all workers')
+parser.add_argument('--retries', type=int, default=3, help='retries per ticker before giving up')
+parser.add_argument('--backoff', type=float, default=1.0, help='initial retry backoff in seconds')
+parser.add_argument('--batch', '-b', type=int, default=1, help='number of tickers to fetch with a single query')
+parser.add_argument('--chunk-months', type=int, default=12, help='split long date ranges into queries of this many months, fetched in parallel, 0 = no split')
+parser.add_argument('--timeout', type=float, default=60, help='http read timeout in seconds')
+metrics.add_arguments(parser)
+parser.add_argument('--yql-url', default=None, help='yql endpoint, e.g. http://localhost:8090/v1/public/yql of ../../tools/yql_server.py')
+parser.add_argument('--backfill', default=None, help='with --lastrun: first date of tickers which were never crawled, default: earliest crawled date')
+parser.add_argument('--force', action='store_true', help='request the whole date range, ignoring the crawl state')
+parser.add_argument('--commit-rows', type=int, default=50000, help='rows per write transaction')
+parser.add_argument('--commit-seconds', type=float, default=5.0, help='max seconds per write transaction')
+parser.add_argument('--cache', default='yql_cache.db', help='response cache in basedir, finished past ranges are never fetched twice')
+parser.add_argument('--no-cache', action='store_true', help='neither read nor write the response cache')
+parser.add_argument('--cache-bypass', action='store_true', help='fetch everything but store the responses in the cache')
+parser.add_argument('--cache-size', type=int, default=2048, help='max size of the response cache in MB')
+parser.add_argument('--cache-ttl', type=float, default=3600, help='seconds until a cached range ending today or later expires')
+parser.add_argument('--shards', default=None, help='directory in basedir of the year-sharded stocks databases to write the rows to, see shards.py')
 
 args = parser.parse_args()
+run = metrics.Metrics('crawl', args)
+
+# one kept alive connection per worker
+cache = None
+if not args.no_cache:
+  cache = ResponseCache(os.path.join(args.basedir, args.cache), max_bytes=args.cache_size * 1024 * 1024, ttl=args.cache_ttl, bypass=args.cache_bypass)
+configure(pool_size=max(1, args.workers), timeout=(10, args.timeout), base_url=args.yql_url, cache=cache)
+
+# the prices go to the shards of their years, the crawl state stays in the database
+router = None
+if args.shards is not None:
+  router = shards.Router(shards.Manifest.open(os.path.join(args.basedir, args.shards)))
 
 class Stock(object):
   def __init__(self, stockline):
@@ -32,56 +70,156 @@ if args.just is None:
     stocks = [Stock(r) for i,r in enumerate(csv.reader(f,delimiter=';')) if i > 0 and len(r) > 0]
 
 
-with sqlite3.connect(args.basedir + args.db) as db:
-  db.execute('CREATE TABLE IF NOT EXISTS stocks(ticker text, date text, volume int, open real, close real, adj_close real, high real, low real, change real, PRIMARY KEY (ticker, date) ON CONFLICT IGNORE )')
-  db.execute('CREATE INDEX IF NOT EXISTS stocks_ticker on stocks(ticker)')
-  db.execute('CREATE INDEX IF NOT EXISTS stocks_date on stocks(date)')
+with writer.connect(args.basedir + args.db) as db:
+  stockdb.ensure_schema(db)
 
   if args.clear:
     db.execute('DELETE from stocks')
+    db.execute('DELETE from stocks_watermarks')
+    db.execute('DELETE from stocks_crawl')
+    db.execute('DELETE from stocks_crawl_gaps')
+    db.commit()
 
-  def load(ticker, start, end):
+  def fetch(tickers, start, end):
     y = YRequest(table='yahoo.finance.historicaldata')
     #query = 'select * from yahoo.finance.historicaldata where symbol = @stock and startDate = @start and endDate = @end';
     #print query
     #result = y.execute(query, dict(stock=ticker, start=start,end=end),env='store://datatables.org/alltableswithkeys')
-    y.add_filter('symbol',ticker)
     y.add_filter('startDate',start)
     y.add_filter('endDate',end)
-    response = y.json()
-    result = hasattr(response.result,'query') and response.result.query.results.quote if response.result.query.results else None
-    #print dir(result), type(result)
-
-    #stock.history = result.rows
-    prev = [0]
-    def toRow(row):
-      if not hasattr(row,'Volume'):
-        pass
-      volume = int(row.Volume)
-      adj_close = float(row.Adj_Close)
-      high = float(row.High)
-      low = float(row.Low)
-      date = row.Date
-      open_ = float(row.Open)
-      close = float(row.Close)
-      change = close - prev[0]
-      prev[0] = close
-      return (ticker, date, volume, open_, close, adj_close, high, low, change)
-    if result is None or (result.count > 0 and not hasattr(result[0],'Volume')):
-      print '\ninvalid return set: skip ' + str(result[0] if result else response.result)
+    started = time.time()
+    with run.stage('http'):
+      response = y.batch('symbol', tickers, stream=True)
+    run.count('requests')
+    if response.from_cache:
+      run.count('cache_hits')
     else:
-      print '\b ' + ticker + ' ' + str(len(result))
-      db.executemany('INSERT OR IGNORE INTO stocks values(?, ?, ?, ?, ?, ?, ?, ?, ?)',(toRow(r) for r in result))
-      db.commit()
-
-  def load_stocks(start, end):
-    print '\b load stocks from ' + start + ' to ' + end
-    if args.just is not None:
-      for stock in args.just:
-        load(stock, start, end)
+      run.count('http_retries', response.retries)
+      run.observe('http_seconds', response.elapsed)
+    if response.status != 200:
+      run.count('http_status_' + str(response.status))
+      raise IOError('invalid response ' + str(response.status) + ': ' + str(response.content[:200]))
+
+    # decode the quotes row by row into (ticker, date, volume, open, close, adj_close, high, low)
+    names = dict((ticker.upper(), ticker) for ticker in tickers)
+    quotes = dict((ticker, []) for ticker in tickers)
+    # download and json decoding are interleaved in the streaming parser
+    with run.stage('decode') as stage:
+      for quote in response.quotes(ticker=tickers[0] if len(tickers) == 1 else None):
+        ticker = names.get(quote[0].upper(), quote[0])
+        quotes.setdefault(ticker, []).append(quote)
+        stage['rows'] += 1
+    if not response.from_cache:
+      run.count('bytes_fetched', response.bytes_read)
+
+    def toRows(ticker, result):
+      prev = 0
+      rows = []
+      # yql returns the quotes in descending date order
+      for (_, date, volume, open_, close, adj_close, high, low) in sorted(result, key=lambda q: q[1]):
+        rows.append((ticker, date, volume, open_, close, adj_close, high, low, close - prev, stockdb.to_ts(date)))
+        prev = close
+      return rows
+    with run.stage('convert') as stage:
+      r = [(ticker, toRows(ticker, quotes[ticker])) for ticker in tickers]
+      stage['rows'] = sum(len(rows) for _, rows in r)
+    run.observe('request_seconds', time.time() - started)
+    return r
+
+  scheduler = FetchScheduler(workers=args.workers, rate=args.rate, retries=args.retries, backoff=args.backoff, metrics=run)
+
+  today = datetime.datetime.now().strftime('%Y-%m-%d')
+
+  def plan_requests(tickers, start, end, catch_up=False, backfill=None):
+    '''(batch, start, end) requests covering the date ranges missing in the crawl state and
+    the (batch, start, end, chunks) window of each, i.e. the range the request is a chunk of'''
+    if args.force:
+      ranges = dict((ticker, [(start, end)]) for ticker in tickers)
     else:
-      for stock in stocks:
-        load(stock.ticker, start, end)
+      ranges = stockdb.plan(db, tickers, start, end, catch_up, backfill)
+    # tickers missing the same range share batched queries
+    by_range = {}
+    for ticker in tickers:
+      for r in ranges[ticker]:
+        by_range.setdefault(r, []).append(ticker)
+    requests = []
+    windows = {}
+    for (s, e), group in sorted(by_range.items()):
+      chunks = stockdb.split_range(s, e, args.chunk_months)
+      for i in range(0, len(group), max(1, args.batch)):
+        batch = tuple(group[i:i + args.batch])
+        # the chunks of a window are queued one after the other, such that few windows are buffered for stitching
+        for cs, ce in chunks:
+          requests.append((batch, cs, ce))
+          windows[(batch, cs, ce)] = (batch, s, e, len(chunks))
+    return requests, windows
+
+  def stitch(parts):
+    '''rows of consecutive chunks in date order, the change of the first row of a chunk relative to the last one before'''
+    rows = []
+    for part in parts:
+      if rows and part:
+        first = part[0]
+        part = [first[:8] + (first[4] - rows[-1][4],) + first[9:]] + part[1:]
+      rows.extend(part)
+    return rows
+
+  def write_window(w, window, results):
+    '''writes the fetched chunks of a window, the failed ones are left as gaps of the crawl state'''
+    batch = window[0]
+    loaded = sorted(chunk for chunk, result in results.items() if result is not None)
+    n = 0
+    for ticker in batch:
+      rows = stitch([results[chunk].get(ticker, []) for chunk in loaded])
+      print('\b ' + ticker + ' ' + str(len(rows)))
+      if router is not None:
+        w.call(router.insert, rows)
+      else:
+        w.put(stockdb.INSERT, rows)
+      if rows:
+        # change of the first row is relative to 0, let transform.py --incremental fix it
+        w.call(stockdb.mark_dirty, [(ticker, rows[0][1])])
+      # queued after the rows, such that a range is never marked as crawled without them
+      for s, e in loaded:
+        w.call(stockdb.crawl_loaded, ticker, s, e)
+      n += len(rows)
+    return n
+
+  def load_stocks(start, end, catch_up=False, backfill=None):
+    # never mark future days as crawled
+    end = min(end, today)
+    print('\b load stocks from ' + start + ' to ' + end)
+    tickers = args.just if args.just is not None else [stock.ticker for stock in stocks]
+    with run.stage('plan'):
+      requests, windows = plan_requests(tickers, start, end, catch_up, backfill)
+    if not requests:
+      print('\b all ' + str(len(tickers)) + ' tickers are up to date')
+      return []
+    print('\b ' + str(len(requests)) + ' requests for ' + str(len(set(t for batch, _, _ in requests for t in batch))) + ' tickers')
+    failed = []
+    pending = {}
+    # fetches run concurrently and ahead of the writer thread, which owns the write connection
+    try:
+      with writer.Writer(args.basedir + args.db, batch_rows=args.commit_rows, batch_seconds=args.commit_seconds, metrics=run) as w:
+        for (batch, s, e), result, error in scheduler.run(fetch, requests):
+          if error is not None:
+            print('\b ' + ' '.join(batch) + ' ' + s + ' to ' + e + ' failed: ' + str(error))
+            w.call(stockdb.crawl_failed, batch, str(error))
+            failed.extend(batch)
+          window = windows[(batch, s, e)]
+          results = pending.setdefault(window, {})
+          results[(s, e)] = dict(result) if error is None else None
+          if len(results) == window[3]:
+            with run.stage('stitch') as stage:
+              stage['rows'] = write_window(w, window, pending.pop(window))
+    finally:
+      # the rows of the shards written so far go into the manifest even if the writer failed
+      if router is not None:
+        router.close()
+    print('\b wrote ' + str(router.rows if router is not None else w.rows) + ' rows in ' + str(w.commits) + ' transactions')
+    if failed:
+      print('\b failed to load ' + str(len(set(failed))) + ' tickers, retried by the next run: ' + ' '.join(sorted(set(failed))))
+    return failed
 
   if args.years is not None:
     for year in args.years:
@@ -95,7 +233,10 @@ with sqlite3.connect(args.basedir + args.db) as db:
       f.seek(0)
       start = f.readline()
 
-    load_stocks(start, end)
+    start = start.strip()
+    # catch up tickers which failed before and backfill new ones
+    backfill = args.backfill or db.execute('SELECT min(first) FROM stocks_crawl').fetchone()[0] or start
+    load_stocks(start, end, catch_up=True, backfill=backfill)
 
     with open(args.basedir + args.lastrun,'w') as f:
       f.seek(0)
@@ -106,3 +247,5 @@ with sqlite3.connect(args.basedir + args.db) as db:
 
   else:
     print('Missing start and end date! Specify by --start and --end or --lastrun logfile.')
+
+run.finish()
@@ -0,0 +1,224 @@
+import argparse
+import json
+import re
+
+import numpy as np
+import blocks
+import parallel
+import stockdb
+import writer
+
+parser = argparse.ArgumentParser(description='materializes the derived attributes of the traits into stocks_derived')
+parser.add_argument('--db', default='data.db')
+parser.add_argument('--traits', default='../sp500.json', help='use case json file or traits file')
+parser.add_argument('--trait', default=None, help='name of the trait, default: all traits')
+parser.add_argument('--index-date', default=None, help='index point of the delta_index attributes, default: first date of a ticker')
+parser.add_argument('--window', type=int, default=20, help='window of the default rolling return/volatility attributes')
+parser.add_argument('--just', nargs='+', default=None)
+parser.add_argument('--incremental', '-i', action='store_true', help='recompute only the tickers with a derive watermark left by crawl.py')
+parallel.add_arguments(parser)
+
+COLUMNS = ('volume', 'open', 'close', 'adj_close', 'high', 'low', 'change')
+
+
+def delta_index(cols, spec, index):
+  x = cols[spec['attr']]
+  return x - x[index]
+
+
+def delta_index_percentage(cols, spec, index):
+  x = cols[spec['attr']]
+  with np.errstate(divide='ignore', invalid='ignore'):
+    return (x - x[index]) / x[index]
+
+
+def rolling_return(cols, spec, index):
+  x = cols[spec['attr']]
+  w = spec.get('window', 1)
+  r = np.full(len(x), np.nan)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    r[w:] = x[w:] / x[:-w] - 1
+  return r
+
+
+def rolling_volatility(cols, spec, index):
+  # standard deviation of the daily log returns within the window
+  x = cols[spec['attr']]
+  w = spec.get('window', 20)
+  r = np.full(len(x), np.nan)
+  if len(x) <= w:
+    return r
+  with np.errstate(divide='ignore', invalid='ignore'):
+    l = np.log(x[1:] / x[:-1])
+  s = np.concatenate(([0.], np.cumsum(l)))
+  s2 = np.concatenate(([0.], np.cumsum(l * l)))
+  mean = (s[w:] - s[:-w]) / w
+  var = (s2[w:] - s2[:-w]) / w - mean * mean
+  r[w:] = np.sqrt(np.maximum(var, 0) * w / (w - 1)) if w > 1 else 0
+  return r
+
+
+def adjusted(cols, spec, index):
+  # split/dividend adjusted price using the adj_close/close ratio of the day
+  with np.errstate(divide='ignore', invalid='ignore'):
+    return cols[spec['attr']] * cols['adj_close'] / cols['close']
+
+
+KERNELS = {
+  'delta_index': delta_index,
+  'delta_index_percentage': delta_index_percentage,
+  'rolling_return': rolling_return,
+  'rolling_volatility': rolling_volatility,
+  'adjusted': adjusted
+}
+
+
+def extra_attributes(window):
+  attrs = {
+    'close_ret' + str(window): dict(type='rolling_return', attr='close', window=window),
+    'close_vol' + str(window): dict(type='rolling_volatility', attr='close', window=window)
+  }
+  for c in ('open', 'high', 'low', 'close'):
+    attrs['adj_' + c] = dict(type='adjusted', attr=c)
+  return attrs
+
+
+def load_attributes(path, trait=None):
+  '''derived attributes of the traits, i.e. the ones with a kernel and a stocks column as attr'''
+  with open(path, 'r') as f:
+    desc = json.load(f)
+  traits = desc.get('traits', desc)
+  attrs = {}
+  for name, t in traits.items():
+    if trait is not None and name != trait:
+      continue
+    for a, spec in t.get('attributes', {}).items():
+      if spec.get('type') in KERNELS and spec.get('attr') in COLUMNS:
+        attrs[a] = spec
+  return attrs
+
+
+def ensure_table(db, attrs):
+  db.execute('CREATE TABLE IF NOT EXISTS stocks_derived(ticker text, date text, PRIMARY KEY (ticker, date))')
+  existing = set(r[1] for r in db.execute('PRAGMA table_info(stocks_derived)'))
+  for a in sorted(attrs):
+    if not re.match(r'^\w+$', a):
+      raise ValueError('invalid attribute name: ' + a)
+    if a not in existing:
+      db.execute('ALTER TABLE stocks_derived ADD COLUMN ' + a + ' real')
+
+
+def load_ticker(db, ticker):
+  if blocks.packed(db, [ticker]):
+    # the packed months of the ticker as well
+    index = [stockdb.COLUMNS.index(c) for c in ('date',) + COLUMNS]
+    rows = [tuple(r[i] for i in index) for r in blocks.read(db, [ticker])]
+  else:
+    rows = db.execute('SELECT date, ' + ', '.join(COLUMNS) + ' FROM stocks WHERE ticker = ? ORDER BY date', (ticker,)).fetchall()
+  dates = [r[0] for r in rows]
+  values = np.array([r[1:] for r in rows], dtype=float).reshape(len(rows), len(COLUMNS))
+  return dates, dict((c, values[:, i]) for i, c in enumerate(COLUMNS))
+
+
+def index_of(dates, index_date=None):
+  if index_date is None:
+    return 0
+  return int(min(np.searchsorted(np.array(dates), index_date), len(dates) - 1))
+
+
+def derive(dates, cols, attrs, index):
+  '''computes all attributes of a ticker, returns name -> array'''
+  return dict((a, KERNELS[spec['type']](cols, spec, index)) for a, spec in attrs.items())
+
+
+def to_rows(ticker, dates, derived, names, start=0):
+  values = np.column_stack([derived[a][start:] for a in names]) if names else np.empty((len(dates) - start, 0))
+  values = np.where(np.isfinite(values), values, np.nan).astype(object)
+  values[values != values] = None  # NaN -> NULL
+  return [(ticker, d) + tuple(v) for d, v in zip(dates[start:], values.tolist())]
+
+
+def ticker_rows(db, ticker, attrs, names, index_date=None, since=None):
+  '''first date to replace and the stocks_derived rows of a ticker from it on, None without stocks rows'''
+  dates, cols = load_ticker(db, ticker)
+  if not dates:
+    return None
+  index = index_of(dates, index_date)
+  derived = derive(dates, cols, attrs, index)
+  start = 0
+  # the index point changed, all deltas to it are stale
+  if since is not None and since > dates[index]:
+    start = int(np.searchsorted(np.array(dates), since))
+  return dates[start] if start < len(dates) else '~', to_rows(ticker, dates, derived, names, start)
+
+
+def insert_sql(table, names):
+  return 'INSERT INTO ' + table + '(ticker, date, ' + ', '.join(names) + ') VALUES (' + ', '.join(['?'] * (len(names) + 2)) + ')'
+
+
+def write(db, ticker, first, rows, names):
+  db.execute('DELETE FROM stocks_derived WHERE ticker = ? AND date >= ?', (ticker, first))
+  db.executemany(insert_sql('stocks_derived', names), rows)
+  return len(rows)
+
+
+def stage_derive(db, task):
+  '''derives the (ticker, since) pairs into stage.stocks_derived and stage.stocks_derived_since, a parallel.Pool task'''
+  attrs, names, index_date, marks = task
+  db.execute('CREATE TABLE stage.stocks_derived(ticker text, date text' + ''.join(', ' + a + ' real' for a in names) + ')')
+  db.execute('CREATE TABLE stage.stocks_derived_since(ticker text, since text)')
+  n = 0
+  for ticker, since in marks:
+    r = ticker_rows(db, ticker, attrs, names, index_date, since)
+    if r is None:
+      continue
+    db.execute('INSERT INTO stage.stocks_derived_since(ticker, since) VALUES (?, ?)', (ticker, r[0]))
+    db.executemany(insert_sql('stage.stocks_derived', names), r[1])
+    n += len(r[1])
+  return n
+
+
+def merge(db, stages, names):
+  '''replaces the stocks_derived rows with the ones of the staging databases, returns the number of rows'''
+  parallel.collect(db, stages, ['stocks_derived', 'stocks_derived_since'])
+  db.execute('''DELETE FROM main.stocks_derived WHERE rowid IN (SELECT d.rowid FROM main.stocks_derived d
+    JOIN temp.stage_stocks_derived_since s ON d.ticker = s.ticker AND d.date >= s.since)''')
+  cols = ', '.join(['ticker', 'date'] + names)
+  n = db.execute('INSERT INTO main.stocks_derived(' + cols + ') SELECT ' + cols + ' FROM temp.stage_stocks_derived').rowcount
+  db.execute('DROP TABLE temp.stage_stocks_derived')
+  db.execute('DROP TABLE temp.stage_stocks_derived_since')
+  return n
+
+
+if __name__ == '__main__':
+  args = parser.parse_args()
+  attrs = load_attributes(args.traits, args.trait)
+  attrs.update(extra_attributes(args.window))
+  names = sorted(attrs)
+
+  with writer.connect(args.db, bulk=True) as db:
+    stockdb.ensure_schema(db)
+    ensure_table(db, attrs)
+
+    if args.incremental:
+      pending = stockdb.watermarks(db, 'derive')
+    else:
+      tickers = args.just or blocks.all_tickers(db)
+      pending = dict((ticker, None) for ticker in tickers)
+
+    total = 0
+    if parallel.cores(args.jobs) > 1 and len(pending) > 1:
+      db.commit()
+      marks = sorted(pending.items())
+      with parallel.Pool(args.db, args.jobs) as pool:
+        stages = pool.run(stage_derive, [(attrs, names, args.index_date, shard) for shard in parallel.shards(marks, pool.jobs * 4)])
+        total = merge(db, stages, names)
+    else:
+      for ticker, since in sorted(pending.items()):
+        r = ticker_rows(db, ticker, attrs, names, args.index_date, since)
+        if r is not None:
+          total += write(db, ticker, r[0], r[1], names)
+    if args.incremental:
+      stockdb.clear_processed(db, 'derive', pending.items())
+    db.commit()
+    print('derived ' + str(len(names)) + ' attributes of ' + str(len(pending)) + ' tickers, ' + str(total) + ' rows')
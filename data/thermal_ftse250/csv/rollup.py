@@ -0,0 +1,84 @@
+import argparse
+
+import blocks
+import stockdb
+import writer
+
+parser = argparse.ArgumentParser(description='materializes weekly, monthly and quarterly OHLCV bars of the stocks table')
+parser.add_argument('--db', default='data.db')
+parser.add_argument('--periods', nargs='+', default=None, help='periods to build, default: all')
+parser.add_argument('--incremental', '-i', action='store_true', help='rebuild only the periods after the rollup watermarks left by crawl.py')
+
+# period -> SQL expression of the first day of the period of a date
+PERIODS = {
+  'weekly': "date({0}, 'weekday 0', '-6 days')",  # monday
+  'monthly': "date({0}, 'start of month')",
+  'quarterly': "printf('%04d-%02d-01', strftime('%Y', {0}), ((strftime('%m', {0}) - 1) / 3) * 3 + 1)"
+}
+
+
+def table(period):
+  return 'stocks_' + period
+
+
+def ensure_tables(db, periods):
+  for period in periods:
+    # ts = epoch of the first day of the period, days = number of daily bars in the period
+    db.execute('CREATE TABLE IF NOT EXISTS ' + table(period) + '(ticker text, date text, ts int, open real, high real, low real, close real, adj_close real, volume int, days int, PRIMARY KEY (ticker, date))')
+    db.execute('CREATE INDEX IF NOT EXISTS ' + table(period) + '_ts_ticker on ' + table(period) + '(ts, ticker)')
+
+
+def build(db, period, incremental=True, stocks='stocks'):
+  '''rebuilds the bars of all periods at or after the rollup watermark of each ticker in one pass
+
+  open is the first open, close and adj_close the last ones, high the max, low the min and
+  volume the sum of the daily bars in the period. the daily bars are read from the table or view stocks,
+  see blocks.source
+  '''
+  start = PERIODS[period]
+  if incremental:
+    source = '''SELECT s.* FROM ''' + stocks + ''' s JOIN stocks_watermarks w ON w.stage = 'rollup' AND w.ticker = s.ticker
+      AND s.date >= coalesce(''' + start.format('w.since') + ", '')"
+    db.execute('DELETE FROM ' + table(period) + ''' WHERE rowid IN (SELECT r.rowid FROM ''' + table(period) + ''' r
+      JOIN stocks_watermarks w ON w.stage = 'rollup' AND w.ticker = r.ticker AND r.date >= coalesce(''' + start.format('w.since') + ", ''))")
+  else:
+    source = 'SELECT * FROM ' + stocks
+    db.execute('DELETE FROM ' + table(period))
+
+  # aggregate per period, then pick open and close of the first and last day by primary key lookups,
+  # correlated subqueries such that they are pushed into both parts of the stocks_all view as well
+  db.execute('INSERT INTO ' + table(period) + '''(ticker, date, ts, open, high, low, close, adj_close, volume, days)
+    SELECT g.ticker, g.period, CAST(strftime('%s', g.period) AS INT),
+      (SELECT f.open FROM ''' + stocks + ''' f WHERE f.ticker = g.ticker AND f.date = g.first), g.high, g.low,
+      (SELECT l.close FROM ''' + stocks + ''' l WHERE l.ticker = g.ticker AND l.date = g.last),
+      (SELECT l.adj_close FROM ''' + stocks + ''' l WHERE l.ticker = g.ticker AND l.date = g.last), g.volume, g.days
+    FROM (
+      SELECT ticker, period, min(date) AS first, max(date) AS last, max(high) AS high, min(low) AS low, sum(volume) AS volume, count(*) AS days
+      FROM (SELECT s.ticker, s.date, s.high, s.low, s.volume, ''' + start.format('s.date') + ''' AS period FROM (''' + source + ''') s)
+      GROUP BY ticker, period) g''')
+  return db.execute('SELECT changes()').fetchone()[0]
+
+
+if __name__ == '__main__':
+  args = parser.parse_args()
+  periods = args.periods or sorted(PERIODS)
+
+  with writer.connect(args.db, bulk=True) as db:
+    stockdb.ensure_schema(db)
+    ensure_tables(db, periods)
+    stocks = 'stocks'
+    if not args.incremental:
+      stocks = blocks.source(db)
+    else:
+      marks = stockdb.watermarks(db, 'rollup')
+      if marks:
+        # 92 days before the earliest watermark reach back to the first day of its quarter, month and week
+        since = min(marks.values())
+        stocks = blocks.source(db, sorted(marks), stockdb.add_days(since, -92) if since else None)
+    for period in periods:
+      n = build(db, period, args.incremental, stocks)
+      print('rolled up ' + str(n) + ' ' + period + ' bars')
+    if args.incremental and set(periods) == set(PERIODS):
+      # marks lowered by a concurrent crawl meanwhile stay
+      stockdb.clear_processed(db, 'rollup', marks.items())
+    db.commit()
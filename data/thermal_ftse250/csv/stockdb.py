@@ -0,0 +1,225 @@
+import calendar
+import datetime
+import time
+
+# stages which derive data from the stocks table, each keeps its own per-ticker watermark
+STAGES = ('change', 'derive', 'rollup', 'panel', 'cache')
+
+
+COLUMNS = ('ticker', 'date', 'volume', 'open', 'close', 'adj_close', 'high', 'low', 'change', 'ts')
+INSERT = 'INSERT OR IGNORE INTO stocks(' + ', '.join(COLUMNS) + ') values(' + ', '.join(['?'] * len(COLUMNS)) + ')'
+
+
+def to_ts(date):
+  '''YYYY-MM-DD -> epoch seconds of midnight UTC, same as strftime('%s', date)'''
+  return calendar.timegm(time.strptime(date[:10], '%Y-%m-%d'))
+
+
+def add_days(date, days):
+  return (datetime.datetime.strptime(date[:10], '%Y-%m-%d') + datetime.timedelta(days=days)).strftime('%Y-%m-%d')
+
+
+def ensure_schema(db):
+  ensure_stocks(db)
+  migrate(db)
+  # since = first date of a ticker whose derived values of the stage are stale
+  db.execute('CREATE TABLE IF NOT EXISTS stocks_watermarks(stage text, ticker text, since text, PRIMARY KEY (stage, ticker))')
+  ensure_crawl_state(db)
+
+
+def ensure_stocks(db):
+  db.execute('CREATE TABLE IF NOT EXISTS stocks(ticker text, date text, volume int, open real, close real, adj_close real, high real, low real, change real, ts int, PRIMARY KEY (ticker, date) ON CONFLICT IGNORE )')
+
+
+def ensure_crawl_state(db):
+  # [first, last] = date range successfully requested per ticker, gaps = ranges within it which were not
+  db.execute('CREATE TABLE IF NOT EXISTS stocks_crawl(ticker text PRIMARY KEY, first text, last text, failures int DEFAULT 0, error text)')
+  db.execute('CREATE TABLE IF NOT EXISTS stocks_crawl_gaps(ticker text, since text, until text, PRIMARY KEY (ticker, since))')
+  if db.execute('SELECT 1 FROM stocks_crawl LIMIT 1').fetchone() is None:
+    # existing database: assume the loaded date range of each ticker was crawled without gaps
+    db.execute('INSERT INTO stocks_crawl(ticker, first, last) SELECT ticker, min(date), max(date) FROM stocks GROUP BY ticker')
+    db.commit()
+
+
+def migrate(db, batch=100000, progress=None):
+  '''adds and fills the integer epoch ts column of an existing stocks table in place
+
+  the rows are updated in rowid ranges, each committed on its own, such that an interrupted migration
+  just continues. afterwards the covering (ts, ticker) and (ticker, ts) indexes replace the single
+  column indexes on ticker and date.
+  '''
+  if 'ts' not in [r[1] for r in db.execute('PRAGMA table_info(stocks)')]:
+    db.execute('ALTER TABLE stocks ADD COLUMN ts int')
+    db.commit()
+
+  if db.execute('SELECT 1 FROM stocks WHERE ts IS NULL LIMIT 1').fetchone() is not None:
+    lo, hi = db.execute('SELECT min(rowid), max(rowid) FROM stocks').fetchone()
+    for start in range(lo, hi + 1, batch):
+      db.execute("UPDATE stocks SET ts = CAST(strftime('%s', date) AS INT) WHERE rowid >= ? AND rowid < ? AND ts IS NULL", (start, start + batch))
+      db.commit()
+      if progress is not None:
+        progress(min(start + batch, hi + 1) - lo, hi + 1 - lo)
+
+  db.execute('CREATE INDEX IF NOT EXISTS stocks_ts_ticker on stocks(ts, ticker)')
+  db.execute('CREATE INDEX IF NOT EXISTS stocks_ticker_ts on stocks(ticker, ts)')
+  # ticker is covered by the primary key and stocks_ticker_ts, date is replaced by ts
+  db.execute('DROP INDEX IF EXISTS stocks_ticker')
+  db.execute('DROP INDEX IF EXISTS stocks_date')
+  db.commit()
+
+
+def mark_dirty(db, ticker_since, stages=STAGES):
+  '''lowers the watermarks of the given (ticker, since) pairs for all stages'''
+  db.executemany('''INSERT INTO stocks_watermarks(stage, ticker, since) VALUES (?, ?, ?)
+    ON CONFLICT(stage, ticker) DO UPDATE SET since = min(since, excluded.since)''',
+    ((stage, ticker, since) for ticker, since in ticker_since for stage in stages))
+
+
+def watermarks(db, stage):
+  return dict(db.execute('SELECT ticker, since FROM stocks_watermarks WHERE stage = ?', (stage,)))
+
+
+def clear_watermarks(db, stage):
+  db.execute('DELETE FROM stocks_watermarks WHERE stage = ?', (stage,))
+
+
+# change of the rows after the (ticker, since) watermarks of {marks}, the row before each
+# watermark is included in the window, such that the first recomputed row gets the right previous close
+CHANGE = '''WITH anchors AS (
+    SELECT w.ticker, w.since,
+      coalesce((SELECT max(p.date) FROM stocks p WHERE p.ticker = w.ticker AND p.date < w.since), w.since) AS anchor
+    FROM {marks} w)
+  SELECT rid, change FROM (
+    SELECT s.rowid AS rid, s.date AS date, a.since AS since,
+      coalesce(s.close - lag(s.close) OVER (PARTITION BY s.ticker ORDER BY s.date), 0) AS change
+    FROM anchors a JOIN main.stocks s ON s.ticker = a.ticker AND s.date >= a.anchor)
+  WHERE date >= since'''
+
+
+def recompute_change(db):
+  '''recomputes change = close - previous close for all rows after the change watermarks
+
+  all tickers are handled in a single pass. only the watermarks read at the start are cleared, such that
+  those lowered by a concurrent crawl meanwhile stay.
+  '''
+  marks = sorted(watermarks(db, 'change').items())
+  db.execute('DROP TABLE IF EXISTS temp.change_marks')
+  db.execute('CREATE TEMP TABLE change_marks(ticker text PRIMARY KEY, since text)')
+  db.executemany('INSERT INTO temp.change_marks(ticker, since) VALUES (?, ?)', marks)
+  db.execute('DROP TABLE IF EXISTS temp.stage_stocks_change')
+  db.execute('CREATE TEMP TABLE stage_stocks_change(rid INTEGER PRIMARY KEY, change real)')
+  db.execute('INSERT INTO temp.stage_stocks_change(rid, change) ' + CHANGE.format(marks='temp.change_marks'))
+  db.execute('DROP TABLE temp.change_marks')
+  n = apply_change(db)
+  clear_processed(db, 'change', marks)
+  return n
+
+
+def stage_change(db, marks):
+  '''computes the change of the (ticker, since) pairs into stage.stocks_change, a parallel.Pool task'''
+  db.execute('CREATE TEMP TABLE shard(ticker text PRIMARY KEY, since text)')
+  db.executemany('INSERT INTO temp.shard(ticker, since) VALUES (?, ?)', marks)
+  db.execute('CREATE TABLE stage.stocks_change(rid INTEGER PRIMARY KEY, change real)')
+  return db.execute('INSERT INTO stage.stocks_change(rid, change) ' + CHANGE.format(marks='temp.shard')).rowcount
+
+
+def apply_change(db):
+  '''updates the stocks rows with the changes of temp.stage_stocks_change in one statement'''
+  db.execute('''UPDATE stocks SET change = (SELECT c.change FROM temp.stage_stocks_change c WHERE c.rid = stocks.rowid)
+    WHERE rowid IN (SELECT rid FROM temp.stage_stocks_change)''')
+  n = db.execute('SELECT count(*) FROM temp.stage_stocks_change').fetchone()[0]
+  db.execute('DROP TABLE temp.stage_stocks_change')
+  return n
+
+
+def clear_processed(db, stage, marks):
+  '''deletes the given (ticker, since) watermarks, unless they were lowered meanwhile'''
+  db.executemany('DELETE FROM stocks_watermarks WHERE stage = ? AND ticker = ? AND since = ?', ((stage, t, s) for t, s in marks))
+
+
+def split_range(start, end, months=12):
+  '''[start, end] split into chunks at the first day of every months-th month, e.g. at each new year for 12
+
+  the chunks of divisors of 12 are aligned to the year, such that the same queries are repeated
+  across runs and hit the response cache. 0 does not split.
+  '''
+  if not months:
+    return [(start, end)]
+  chunks = []
+  since = start
+  while since <= end:
+    month = (int(since[5:7]) - 1) // months * months + months
+    boundary = '%04d-%02d-01' % (int(since[:4]) + month // 12, month % 12 + 1)
+    chunks.append((since, min(add_days(boundary, -1), end)))
+    since = boundary
+  return chunks
+
+
+def crawl_state(db, tickers=None):
+  '''ticker -> (first, last, [(since, until)] gaps) of the crawled tickers'''
+  where, params = '', ()
+  if tickers is not None:
+    where, params = ' AND ticker IN (' + ', '.join(['?'] * len(tickers)) + ')', tuple(tickers)
+  state = dict((r[0], (r[1], r[2], [])) for r in db.execute('SELECT ticker, first, last FROM stocks_crawl WHERE first IS NOT NULL' + where, params))
+  for ticker, since, until in db.execute('SELECT ticker, since, until FROM stocks_crawl_gaps WHERE 1' + where + ' ORDER BY ticker, since', params):
+    if ticker in state:
+      state[ticker][2].append((since, until))
+  return state
+
+
+def plan(db, tickers, start, end, catch_up=False, backfill=None):
+  '''minimal date ranges to request per ticker to cover [start, end] given the crawl state
+
+  with catch_up the days after the last crawled date of a ticker are included, even before start, and
+  tickers which were never crawled are backfilled from backfill. returns ticker -> [(start, end)]
+  '''
+  state = crawl_state(db)
+  ranges = {}
+  for ticker in tickers:
+    if ticker not in state:
+      lo = min(start, backfill) if catch_up and backfill else start
+      ranges[ticker] = [(lo, end)] if lo <= end else []
+      continue
+    first, last, gaps = state[ticker]
+    lo = min(start, add_days(last, 1)) if catch_up else start
+    r = []
+    if lo < first:
+      r.append((lo, min(end, add_days(first, -1))))
+    r.extend((max(since, lo), min(until, end)) for since, until in gaps if since <= end and until >= lo)
+    if end > last:
+      r.append((max(lo, add_days(last, 1)), end))
+    ranges[ticker] = [x for x in r if x[0] <= x[1]]
+  return ranges
+
+
+def crawl_loaded(db, ticker, start, end):
+  '''records that [start, end] of the ticker was requested successfully'''
+  state = crawl_state(db, [ticker]).get(ticker)
+  if state is None:
+    db.execute('''INSERT INTO stocks_crawl(ticker, first, last, failures, error) VALUES (?, ?, ?, 0, NULL)
+      ON CONFLICT(ticker) DO UPDATE SET first = excluded.first, last = excluded.last, failures = 0, error = NULL''', (ticker, start, end))
+    return
+  first, last, gaps = state
+  # a range which is not adjacent to the crawled one leaves a gap in between
+  if start > add_days(last, 1):
+    gaps.append((add_days(last, 1), add_days(start, -1)))
+  if end < add_days(first, -1):
+    gaps.append((add_days(end, 1), add_days(first, -1)))
+  remaining = []
+  for since, until in gaps:
+    if since > end or until < start:
+      remaining.append((since, until))
+      continue
+    if since < start:
+      remaining.append((since, add_days(start, -1)))
+    if until > end:
+      remaining.append((add_days(end, 1), until))
+  db.execute('DELETE FROM stocks_crawl_gaps WHERE ticker = ?', (ticker,))
+  db.executemany('INSERT INTO stocks_crawl_gaps(ticker, since, until) VALUES (?, ?, ?)', ((ticker, since, until) for since, until in remaining))
+  db.execute('UPDATE stocks_crawl SET first = ?, last = ?, failures = 0, error = NULL WHERE ticker = ?', (min(first, start), max(last, end), ticker))
+
+
+def crawl_failed(db, tickers, error):
+  '''counts a failed request of the tickers, the planner requests the missing range again next time'''
+  db.executemany('''INSERT INTO stocks_crawl(ticker, failures, error) VALUES (?, 1, ?)
+    ON CONFLICT(ticker) DO UPDATE SET failures = failures + 1, error = excluded.error''', ((ticker, error) for ticker in tickers))
@@ -3,50 +3,70 @@ __author__ = 'sam'
 import csv
 import argparse
 
-import sqlite3
+import blocks
+import metrics
+import parallel
+import stockdb
+import writer
 
 parser = argparse.ArgumentParser(description='DOT Importer')
 parser.add_argument('--db', default="data.db")
 parser.add_argument('--stock', default="sp500.csv")
 parser.add_argument('--just', nargs='+', default=None)
+parser.add_argument('--incremental', '-i', action='store_true', help='recompute only the rows after the per-ticker watermarks left by crawl.py')
+parallel.add_arguments(parser)
+metrics.add_arguments(parser)
 
 args = parser.parse_args()
+run = metrics.Metrics('transform', args)
 
 class Stock(object):
   def __init__(self, stockline):
     self.ticker = stockline[0].strip()
 
-if args.just is None:
+if args.just is None and not args.incremental:
   stocks = []
   with open(args.stock,'r') as f:
-    stocks = [Stock(r) for i,r in enumerate(csv.reader(f,delimiter=';')) if i > 0]
-
-with sqlite3.connect(args.db) as db:
-  db.execute('CREATE TABLE IF NOT EXISTS stocks(ticker text, date text, volume int, open real, close real, adj_close real, high real, low real, change real, PRIMARY KEY (ticker, date) ON CONFLICT IGNORE )')
-  db.execute('CREATE INDEX IF NOT EXISTS stocks_ticker on stocks(ticker)')
-  db.execute('CREATE INDEX IF NOT EXISTS stocks_date on stocks(date)')
-
-
-  def transform(ticker):
-    query = 'SELECT ticker, date, volume, open, close, adj_close, high, low from stocks where ticker = ? order by date asc'
-    rows = db.execute(query, (ticker,))
-    prev = [None, 0]
-    def compute(row):
-      t = list(row)
-      if prev[0] is None:
-        t.append(0)
-      else:
-        t.append(t[4]-prev[0][4])
-      prev[0] = t
-      prev[1] += 1
-      return t
-    db.executemany('INSERT OR REPLACE INTO stocks values(?, ?, ?, ?, ?, ?, ?, ?, ?)',(compute(r) for r in rows))
+    stocks = [Stock(r) for i,r in enumerate(csv.reader(f,delimiter=';')) if i > 0 and len(r) > 0]
+
+with writer.connect(args.db, bulk=True) as db:
+  with run.stage('schema'):
+    stockdb.ensure_schema(db)
+
+  if not args.incremental:
+    # full recompute: move the watermarks of all tickers to the very beginning
+    tickers = args.just if args.just is not None else [stock.ticker for stock in stocks]
+    if blocks.packed(db, tickers):
+      # the first row after the packed months would lose its previous close
+      parser.error('the stocks table has packed months, unpack them with blocks.py --unpack all first')
+    stockdb.mark_dirty(db, ((ticker, '') for ticker in tickers), stages=('change',))
+
+  pending = stockdb.watermarks(db, 'change')
+  # the change after a watermark needs the closes before it and updates the rows after it,
+  # unpack the months of a ticker from the one before its watermark on, blocks.py packs them again
+  with run.stage('unpack') as stage:
+    for ticker, since in sorted(pending.items()):
+      month = blocks.add_months(blocks.month_of(since), -1) if since else None
+      if blocks.packed(db, [ticker], month):
+        stage['rows'] += blocks.unpack(db, month, [ticker])[1]
+  if parallel.cores(args.jobs) > 1 and len(pending) > 1:
+    # the workers read the committed watermarks with their own connections
     db.commit()
-    print 'transformed',ticker,' ',prev[1]
-
-if args.just is not None:
-  for stock in args.just:
-    transform(stock)
-else:
-  for stock in stocks:
-    transform(stock.ticker)
+    marks = sorted(pending.items())
+    with parallel.Pool(args.db, args.jobs) as pool:
+      with run.stage('shards') as stage:
+        stages = pool.run(stockdb.stage_change, parallel.shards(marks, pool.jobs * 4))
+        stage['rows'] = pool.rows
+      with run.stage('merge') as stage:
+        parallel.collect(db, stages, ['stocks_change'])
+        n = stage['rows'] = stockdb.apply_change(db)
+        stockdb.clear_processed(db, 'change', marks)
+  else:
+    with run.stage('recompute_change') as stage:
+      n = stage['rows'] = stockdb.recompute_change(db)
+  with run.stage('commit'):
+    db.commit()
+  run.count('tickers', len(pending))
+  print('transformed ' + str(len(pending)) + ' tickers, ' + str(n) + ' rows')
+
+run.finish()
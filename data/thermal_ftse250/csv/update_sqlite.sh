@@ -1 +1,6 @@
-python crawl.py --basedir=../sqlite/ --lastrun=lastrun.log --stock=ftse250.csv
\ No newline at end of file
+python crawl.py --basedir=../sqlite/ --lastrun=lastrun.log --stock=ftse250.csv
+python transform.py --db=../sqlite/data.db --incremental
+python derive.py --db=../sqlite/data.db --traits=../ftse250.json --incremental
+python rollup.py --db=../sqlite/data.db --incremental
+python panel.py --db=../sqlite/data.db --out=../panel --incremental
+python cache.py --db=../sqlite/data.db --incremental
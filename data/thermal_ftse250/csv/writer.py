@@ -0,0 +1,165 @@
+import threading
+import time
+
+import sqlite3
+from six.moves import queue
+
+# trade memory for fewer page writes while bulk loading, WAL keeps synchronous=NORMAL crash safe
+BULK_PRAGMAS = (
+  'cache_size=-262144',  # 256 MB
+  'temp_store=MEMORY',
+  'wal_autocheckpoint=10000'
+)
+
+_STOP = object()
+_FLUSH = object()
+
+
+def connect(path, bulk=False, timeout=60, check_same_thread=True):
+  '''opens a connection in WAL mode, such that the readers of the servers are not blocked by writes'''
+  db = sqlite3.connect(path, timeout=timeout, check_same_thread=check_same_thread)
+  db.execute('PRAGMA journal_mode=WAL')
+  db.execute('PRAGMA synchronous=NORMAL')
+  if bulk:
+    for pragma in BULK_PRAGMAS:
+      db.execute('PRAGMA ' + pragma)
+  return db
+
+
+class WriterError(Exception):
+  pass
+
+
+class Writer(object):
+  '''single thread owning the write connection of a database
+
+  producers put statements with their rows, or functions called with the connection, on a bounded
+  queue and continue fetching and parsing while the writer executes them in order. a transaction
+  is committed every batch_rows rows or batch_seconds seconds, whatever comes first.
+  '''
+
+  def __init__(self, path, batch_rows=50000, batch_seconds=5.0, queue_size=64, bulk=True, metrics=None):
+    self.path = path
+    self.batch_rows = batch_rows
+    self.batch_seconds = batch_seconds
+    self.bulk = bulk
+    self.metrics = metrics
+    self.queue = queue.Queue(maxsize=queue_size)
+    self.error = None
+    self.rows = 0
+    self.commits = 0
+    self._thread = threading.Thread(target=self._run, name='sqlite-writer')
+    self._thread.daemon = True
+
+  def start(self):
+    self._thread.start()
+    return self
+
+  def __enter__(self):
+    return self.start()
+
+  def __exit__(self, exc_type, exc_value, tb):
+    # rows written so far are valid, commit them even if the producer failed
+    self.close(raise_error=exc_type is None)
+    return False
+
+  def put(self, sql, rows):
+    '''executes sql for each of the rows'''
+    if not isinstance(rows, list):
+      rows = list(rows)
+    if rows:
+      self._put((sql, rows))
+
+  def call(self, fn, *args):
+    '''calls fn(db, *args) on the writer thread, in order with the queued rows'''
+    self._put((fn, args))
+
+  def flush(self):
+    '''blocks until everything queued so far is committed'''
+    done = threading.Event()
+    self._put((_FLUSH, done))
+    while not done.wait(1):
+      self._check()
+    self._check()
+
+  def close(self, raise_error=True):
+    if self._thread.is_alive():
+      self._put(_STOP, check=False)
+      self._thread.join()
+    if raise_error:
+      self._check()
+
+  def _check(self):
+    if self.error is not None:
+      raise WriterError('writing to ' + self.path + ' failed: ' + str(self.error))
+
+  def _put(self, item, check=True):
+    # a dead writer does not drain the queue, do not block on it forever
+    while self._thread.is_alive():
+      if check:
+        self._check()
+      try:
+        self.queue.put(item, timeout=1)
+        return
+      except queue.Full:
+        pass
+    if check:
+      self._check()
+      raise WriterError('writer of ' + self.path + ' is not running')
+
+  def _run(self):
+    db = connect(self.path, bulk=self.bulk)
+    pending = 0
+    dirty = False
+    began = time.time()
+
+    def commit():
+      start = time.time()
+      db.commit()
+      self.commits += 1
+      if self.metrics is not None:
+        self.metrics.add_stage('commit', time.time() - start)
+
+    try:
+      while True:
+        timeout = max(0.0, self.batch_seconds - (time.time() - began)) if dirty else None
+        try:
+          item = self.queue.get(timeout=timeout)
+        except queue.Empty:
+          item = None
+        if item is _STOP:
+          break
+        if item is not None:
+          op, arg = item
+          if op is _FLUSH:
+            if dirty:
+              commit()
+              pending, dirty = 0, False
+            arg.set()
+            continue
+          if not dirty:
+            began = time.time()
+            dirty = True
+          start = time.time()
+          if callable(op):
+            op(db, *arg)
+            if self.metrics is not None:
+              self.metrics.add_stage(op.__name__, time.time() - start)
+          else:
+            db.executemany(op, arg)
+            pending += len(arg)
+            self.rows += len(arg)
+            if self.metrics is not None:
+              self.metrics.add_stage('write', time.time() - start, len(arg))
+        if dirty and (pending >= self.batch_rows or time.time() - began >= self.batch_seconds):
+          commit()
+          pending, dirty = 0, False
+      if dirty:
+        commit()
+      # keep the WAL file small once the load is done, a busy reader just postpones it
+      db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    except Exception as e:
+      self.error = e
+      db.rollback()
+    finally:
+      db.close()
@@ -31,10 +31,21 @@ class _object_decoder(json.JSONDecoder):
             else:
                 return obj
 
+def _map(value):
+    if isinstance(value, dict):
+        return ObjectMapper(value)
+    if isinstance(value, (list, tuple)):
+        return [ObjectMapper(x) if isinstance(x, dict) else x for x in value]
+    return value
+
+
 class ObjectMapper(object):
 
     '''Converts a given dict to object
 
+    The attributes are mapped lazily on first access, such that
+    only the parts of a large response which are used get converted.
+
     Args:
        json_obj(dict): The dict which has to be mapped like an object
 
@@ -48,12 +59,22 @@ class ObjectMapper(object):
 
     def __init__(self, json_obj , *args, **kwargs):
 
-        d = json_obj
-        for a, b in six.iteritems(d):
-            if isinstance(b, (list, tuple)):
-               setattr(self, a, [ObjectMapper(x) if isinstance(x, dict) else x for x in b])
-            else:
-               setattr(self, a, ObjectMapper(b) if isinstance(b, dict) else b)
+        self.__dict__['_json'] = json_obj
+
+    def __getattr__(self, name):
+
+        d = self.__dict__.get('_json')
+        if d is None or name not in d:
+            raise AttributeError(name)
+        value = _map(d[name])
+        setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        return list(self._json)
+
+    def __repr__(self):
+        return 'ObjectMapper({0!r})'.format(self._json)
 
     @staticmethod
     def to_object(json_dict, *args, **kwargs):
@@ -1,4 +1,6 @@
 from ._api_mapper import ObjectMapper
+from ._api_stream import _ArrayStream, _to_quote
+from collections import OrderedDict
 import json
 import six
 
@@ -7,18 +9,62 @@ class _Api_Response(object):
 
     '''A class that takes the request object as input
        and converts into the response of yql api.
+
+       The body is decoded lazily: result and rows() decode the whole
+       document, quotes() streams the rows straight from the response.
     '''
 
+    _chunk_size = 64 * 1024
+
     def __init__(self, response, type="json"):
 
         self.status = response.status_code
-        if type == "json":
+        self.type = type
+        self._response = response
+        self._json = None
+        self._object = None
+
+    @property
+    def content(self):
+        '''Returns the raw body of the response'''
+        return self._response.content
+
+    @property
+    def elapsed(self):
+        '''Returns the seconds until the response headers arrived,
+           including the retries of the connection pool'''
+        return self._response.elapsed.total_seconds()
+
+    @property
+    def from_cache(self):
+        '''Returns whether the response was served from the response cache'''
+        return getattr(self._response, 'from_cache', False)
+
+    @property
+    def retries(self):
+        '''Returns the number of retries of the connection pool,
+           e.g. after a 429 or 503'''
+        retries = getattr(getattr(self._response, 'raw', None), 'retries', None)
+        return len(retries.history) if retries is not None else 0
+
+    @property
+    def bytes_read(self):
+        '''Returns the number of body bytes read so far, as transferred'''
+        raw = getattr(self._response, 'raw', None)
+        return raw.tell() if raw is not None else len(self.content)
+
+    def json(self):
+        '''Returns the decoded json document
+
+        Returns:
+          dict: the document
+        '''
+        if self._json is None:
             if six.PY3:
-                self._object = ObjectMapper(json.loads(response.content.decode()))
+                self._json = json.loads(self.content.decode())
             else:
-                self._object = ObjectMapper(json.loads(response.content))
-        else:
-            self._object = response.content
+                self._json = json.loads(self.content)
+        return self._json
 
     @property
     def result(self):
@@ -27,4 +73,78 @@ class _Api_Response(object):
         Returns:
           _object(object): Mapped Object
         '''
+        if self._object is None:
+            if self.type == "json":
+                self._object = ObjectMapper(self.json())
+            else:
+                self._object = self.content
         return self._object
+
+    def rows(self):
+        '''Returns the result rows of the query, e.g. the quotes
+           of a yahoo.finance.historicaldata query
+
+        Returns:
+          list: Mapped rows, empty if there are no results
+        '''
+        results = (self.json().get('query') or {}).get('results')
+        if not results:
+            return []
+        rows = next(six.itervalues(results))
+        # a single row is not wrapped in a list
+        if not isinstance(rows, list):
+            rows = [rows]
+        return [ObjectMapper(r) if isinstance(r, dict) else r for r in rows]
+
+    def split(self, key, values=()):
+        '''Splits the result rows of a batched query into one
+           row list per value of the given key.
+
+        Args:
+          key(str): attribute of a row to group by, e.g. Symbol
+          values(list): expected values, which get an empty list if
+                        there are no rows for them
+
+        Returns:
+          OrderedDict: value -> list of rows
+        '''
+        groups = OrderedDict((v, []) for v in values)
+        for row in self.rows():
+            groups.setdefault(getattr(row, key, None), []).append(row)
+        return groups
+
+    def iter_rows(self, key='quote'):
+        '''Streams the decoded rows stored under the given key, without
+           holding the whole document in memory. A streamed response
+           can be consumed only once.
+
+        Args:
+          key(str): name of the result rows, e.g. quote
+
+        Returns:
+          generator: the rows as dicts
+        '''
+        stream = _ArrayStream(self._response.iter_content(self._chunk_size), key)
+        try:
+            for row in stream:
+                yield row
+            if not stream.found and '"query"' not in stream.head:
+                raise ValueError('invalid response: ' + stream.head)
+            # the rest of a valid document, e.g. for the response cache
+            finish = getattr(self._response, 'finish', None)
+            if finish is not None:
+                finish()
+        finally:
+            self._response.close()
+
+    def quotes(self, ticker=None):
+        '''Streams the quotes of a yahoo.finance.historicaldata query as
+           typed tuples.
+
+        Args:
+          ticker(str): ticker to use instead of the Symbol of the quotes
+
+        Returns:
+          generator: (ticker, date, volume, open, close, adj_close, high, low) tuples
+        '''
+        return (_to_quote(row, ticker) for row in self.iter_rows('quote'))
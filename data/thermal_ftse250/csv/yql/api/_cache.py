@@ -0,0 +1,241 @@
+import datetime
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+import zlib
+
+_end_date = re.compile(r"endDate\s*=\s*['\"](\d{4}-\d{2}-\d{2})['\"]")
+
+
+class _ResponseCache(object):
+
+    '''An on-disk cache of yql responses, content-addressed by the
+    endpoint, format and query string of a request.
+
+    The bodies are stored zlib compressed in a sqlite database. A query
+    whose endDate lies settle_days before today returns quotes which never
+    change and never expires, any other query expires after ttl seconds.
+    The least recently used responses are evicted beyond max_bytes.
+
+    Args:
+       path(str):        sqlite file of the cache, created if missing
+       max_bytes(int):   max size of the compressed bodies
+       ttl(float):       seconds until a response of an open range expires
+       settle_days(int): days after which the quotes of a day are final
+       bypass(bool):     skip the lookups but store the fresh responses,
+                         i.e. refresh the cache
+    '''
+
+    def __init__(self, path, max_bytes=2 * 1024 ** 3, ttl=3600, settle_days=1, bypass=False):
+
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.settle_days = settle_days
+        self.bypass = bypass
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        db = self._db()
+        db.execute('''CREATE TABLE IF NOT EXISTS responses(key text PRIMARY KEY, query text, created real, expires real,
+                      accessed real, size int, body blob)''')
+        db.execute('CREATE INDEX IF NOT EXISTS responses_accessed on responses(accessed)')
+        db.commit()
+        self._size = db.execute('SELECT coalesce(sum(size), 0) FROM responses').fetchone()[0]
+
+    def _db(self):
+        # one connection per thread, the fetch workers share the cache
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=60)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    @staticmethod
+    def key(base_url, format, query):
+        '''Returns the content address of a request'''
+        return hashlib.sha256(u'\n'.join((base_url, format or '', query)).encode('utf-8')).hexdigest()
+
+    def expires(self, query, now=None):
+        '''Returns the expiry time of the response of a query, None if it never expires'''
+        now = time.time() if now is None else now
+        end = _end_date.search(query)
+        final = datetime.datetime.utcfromtimestamp(now).date() - datetime.timedelta(days=self.settle_days)
+        if end is not None and end.group(1) < final.strftime('%Y-%m-%d'):
+            return None
+        return now + self.ttl
+
+    def get(self, key):
+        '''Returns the cached response or None
+
+        Args:
+           key(str): content address, see key()
+
+        Returns:
+           _CachedResponse: the response
+        '''
+        if self.bypass:
+            return None
+        db = self._db()
+        now = time.time()
+        row = db.execute('SELECT body FROM responses WHERE key = ? AND (expires IS NULL OR expires > ?)', (key, now)).fetchone()
+        with self._lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if row is None:
+            return None
+        db.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+        db.commit()
+        return _CachedResponse(zlib.decompress(row[0]))
+
+    def put(self, key, query, body):
+        '''Stores the complete body of a successful response'''
+        self._store(key, query, zlib.compress(body))
+
+    def _store(self, key, query, data):
+        now = time.time()
+        db = self._db()
+        old = db.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+        db.execute('INSERT OR REPLACE INTO responses(key, query, created, expires, accessed, size, body) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                   (key, query, now, self.expires(query, now), now, len(data), sqlite3.Binary(data)))
+        db.commit()
+        with self._lock:
+            self._size += len(data) - (old[0] if old else 0)
+            evict = self._size > self.max_bytes
+        if evict:
+            self.evict()
+
+    def evict(self, target=0.9):
+        '''Deletes the expired and then the least recently used responses
+           until the cache is below target * max_bytes'''
+        db = self._db()
+        db.execute('DELETE FROM responses WHERE expires IS NOT NULL AND expires <= ?', (time.time(),))
+        size = db.execute('SELECT coalesce(sum(size), 0) FROM responses').fetchone()[0]
+        keys = []
+        for key, n in db.execute('SELECT key, size FROM responses ORDER BY accessed'):
+            if size <= target * self.max_bytes:
+                break
+            keys.append((key,))
+            size -= n
+        db.executemany('DELETE FROM responses WHERE key = ?', keys)
+        db.commit()
+        with self._lock:
+            self._size = size
+
+    def wrap(self, key, query, response, stream=False):
+        '''Stores the body of a fresh response once it is complete
+
+        Args:
+           response(Response): the requests response
+           stream(bool):       whether the body is streamed, it is stored
+                               when the stream is exhausted
+
+        Returns:
+           the response to use instead
+        '''
+        if response.status_code != 200:
+            return response
+        if stream:
+            return _TeeResponse(self, key, query, response)
+        body = response.content
+        if _complete(response, len(body), body):
+            self.put(key, query, body)
+        return response
+
+    def close(self):
+        db = getattr(self._local, 'db', None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+
+
+def _complete(response, size, tail):
+    '''Whether a body is the whole json document, a truncated one does not
+       match its Content-Length or misses the closing brace
+
+    Args:
+       size(int):   decoded size of the body
+       tail(bytes): the body or its last non-blank chunk
+    '''
+    length = response.headers.get('Content-Length')
+    if length is not None:
+        # Content-Length counts the bytes on the wire, before a gzip decoding
+        raw = getattr(response, 'raw', None)
+        read = raw.tell() if raw is not None and hasattr(raw, 'tell') else size
+        if int(length) != read:
+            return False
+    return tail.rstrip()[-1:] == b'}'
+
+
+class _CachedResponse(object):
+
+    '''The parts of a requests response used by _Api_Response, served
+       from the cache'''
+
+    status_code = 200
+    raw = None
+    from_cache = True
+
+    def __init__(self, body):
+
+        self.content = body
+        self.headers = {'Content-Length': str(len(body))}
+        self.elapsed = datetime.timedelta(0)
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def close(self):
+        pass
+
+
+class _TeeResponse(object):
+
+    '''A streamed response which compresses the body while it is read
+       and stores it in the cache when it was read completely'''
+
+    from_cache = False
+
+    def __init__(self, cache, key, query, response):
+
+        self._cache = cache
+        self._key = key
+        self._query = query
+        self._response = response
+        self._chunks = None
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def iter_content(self, chunk_size=1):
+        self._chunks = self._tee(chunk_size)
+        return self._chunks
+
+    def finish(self):
+        '''Reads the rest of a body the consumer did not need, such that it is stored'''
+        if self._chunks is not None:
+            for _ in self._chunks:
+                pass
+
+    def _tee(self, chunk_size):
+        compressor = zlib.compressobj()
+        parts = []
+        size = 0
+        tail = b''
+        for chunk in self._response.iter_content(chunk_size):
+            parts.append(compressor.compress(chunk))
+            size += len(chunk)
+            if chunk.strip():
+                tail = chunk
+            yield chunk
+        parts.append(compressor.flush())
+        if _complete(self._response, size, tail):
+            self._cache._store(self._key, self._query, b''.join(parts))
@@ -0,0 +1,99 @@
+
+import threading
+
+from requests import Session
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+
+class _SessionPool(object):
+
+    '''A shared http session with a bounded connection pool.
+
+    Connections are kept alive and reused across requests, such that
+    only the first request to a host pays for the TCP+TLS handshake.
+    Failed requests with a 429 or 5xx status are retried with backoff.
+
+    Args:
+       pool_size(int):        max number of kept alive connections per host
+       timeout(float, tuple): connect and read timeout in seconds
+       retries(int):          number of retries on connection errors and 429/5xx
+       backoff(float):        backoff factor between retries in seconds
+       base_url(str):         url of the yql endpoint, e.g. a local stand-in,
+                              default: $YQL_BASE_URL or the yahoo api
+       cache(_ResponseCache): on-disk cache of the responses, default: none
+    '''
+
+    def __init__(self, pool_size=10, timeout=(10, 60), retries=3, backoff=0.5,
+                 status_forcelist=(429, 500, 502, 503, 504), base_url=None, cache=None):
+
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.status_forcelist = status_forcelist
+        self.base_url = base_url
+        self.cache = cache
+        self._session = None
+        self._lock = threading.Lock()
+
+    def _create(self):
+
+        retry = Retry(total=self.retries, backoff_factor=self.backoff,
+                      status_forcelist=self.status_forcelist,
+                      respect_retry_after_header=True, raise_on_status=False)
+        # pool_block such that more threads than pool_size wait for a free connection
+        # instead of opening throw-away ones
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size,
+                              max_retries=retry, pool_block=True)
+        session = Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    @property
+    def session(self):
+        '''Lazily created shared requests.Session
+
+        Returns:
+           Session: the session
+        '''
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self._create()
+        return self._session
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.get(url, **kwargs)
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+        if self.cache is not None:
+            self.cache.close()
+
+
+_pool = _SessionPool()
+
+
+def get_pool():
+    '''Returns the process-wide session pool used by all requests'''
+    return _pool
+
+
+def configure(**kwargs):
+    '''Replaces the process-wide session pool
+
+    Args:
+       **kwargs: arguments of _SessionPool, e.g. pool_size, timeout, retries, base_url, cache
+
+    Returns:
+       _SessionPool: the new pool
+    '''
+    global _pool
+    _pool.close()
+    _pool = _SessionPool(**kwargs)
+    return _pool
@@ -50,17 +50,19 @@ async function updateSQLiteData() {
             const timepoints = Object.entries(item.data);
             console.log(`[${symbol}] inserting data...`);
             const changes = timepoints.map(timepoint => {
-                const statement = dbHandler.prepare(`INSERT INTO ${table} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)`)
+                const statement = dbHandler.prepare(`INSERT INTO ${table} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)`)
+                const date = timepoint[0].split('T')[0];
                 const info = statement.run(
                     symbol, // ticker
-                    timepoint[0].split('T')[0], // date
+                    date, // date
                     timepoint[1].volume, // volume
                     timepoint[1].open, // open
                     timepoint[1].close, // close
                     timepoint[1].adjusted, // adj_close
                     timepoint[1].high, // high
                     timepoint[1].low, // low
-                    timepoint[1].change // change
+                    timepoint[1].change, // change
+                    Date.parse(date) / 1000 // ts [ms -> sec]
                 );
                 return info.changes;
             });
@@ -9,8 +9,54 @@ CREATE TABLE IF NOT EXISTS "stocks"(
     high real,
     low real,
     change real,
-    PRIMARY KEY (ticker, ts) ON CONFLICT IGNORE 
+    ts int, -- epoch of date at midnight UTC [sec]
+    PRIMARY KEY (ticker, date) ON CONFLICT IGNORE 
 );
 
-CREATE INDEX IF NOT EXISTS stocks_ticker on stocks(ticker);
-CREATE INDEX IF NOT EXISTS stocks_date on stocks(date);
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS stocks_ts_ticker on stocks(ts, ticker);
+CREATE INDEX IF NOT EXISTS stocks_ticker_ts on stocks(ticker, ts);
+
+-- per-ticker watermarks of the stages deriving data from stocks, see csv/stockdb.py
+CREATE TABLE IF NOT EXISTS "stocks_watermarks"(
+    stage text,
+    ticker text,
+    since text,
+    PRIMARY KEY (stage, ticker)
+);
+
+-- per-ticker crawl state: date range requested successfully and the gaps within it, see csv/stockdb.py
+CREATE TABLE IF NOT EXISTS "stocks_crawl"(
+    ticker text PRIMARY KEY,
+    first text,
+    last text,
+    failures int DEFAULT 0,
+    error text
+);
+
+CREATE TABLE IF NOT EXISTS "stocks_crawl_gaps"(
+    ticker text,
+    since text,
+    until text,
+    PRIMARY KEY (ticker, since)
+);
+
+-- socket messages of the server per time bucket and node filter, zlib compressed json, see csv/cache.py
+CREATE TABLE IF NOT EXISTS "stocks_messages"(
+    time_factor int,
+    filter text,
+    bucket int, -- ts / time_factor
+    rows int,
+    payload blob,
+    PRIMARY KEY (time_factor, filter, bucket)
+);
+
+-- cold months of the stocks table, one compressed block of the rows per ticker and month, see csv/blocks.py
+CREATE TABLE IF NOT EXISTS "stocks_blocks"(
+    ticker text,
+    month text, -- first day of the month
+    first text,
+    last text,
+    rows int,
+    payload blob,
+    PRIMARY KEY (ticker, month)
+);
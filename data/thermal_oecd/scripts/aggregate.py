@@ -0,0 +1,101 @@
+import argparse
+import json
+
+import sqlite3
+
+# name -> SQL aggregate function, None = computed in python
+AGGREGATES = {
+    'avg': 'avg',
+    'min': 'min',
+    'max': 'max',
+    'median': None
+}
+
+
+def value_columns(db):
+    return [r[1] for r in db.execute('PRAGMA table_info(oecd)') if r[1] not in ('key', 'ts', 'epoch')]
+
+
+def median(values):
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    m = len(values) // 2
+    return values[m] if len(values) % 2 else (values[m - 1] + values[m]) / 2.0
+
+
+def groups(regions=None):
+    '''(prefix, keys) of the aggregate groups, all keys and the keys of each region'''
+    r = [('all', None)]
+    for name, keys in sorted((regions or {}).items()):
+        r.append((name, keys))
+    return r
+
+
+def refresh(db, touched=None, aggregates=('avg',), regions=None):
+    '''recomputes the aggregate keys, e.g. all_avg, for the touched timestamps (YYYY-MM), all if None
+
+    the aggregate keys are registered in oecd_aggregates, such that they are excluded as input
+
+    Returns:
+       int: number of written aggregate rows
+    '''
+    columns = value_columns(db)
+    db.execute('CREATE TABLE IF NOT EXISTS oecd_aggregates(key text PRIMARY KEY)')
+    db.execute('DROP TABLE IF EXISTS temp.oecd_touched')
+    db.execute('CREATE TEMP TABLE oecd_touched(ts text PRIMARY KEY)')
+    if touched is None:
+        db.execute('INSERT INTO temp.oecd_touched SELECT DISTINCT ts FROM oecd')
+    else:
+        db.executemany('INSERT OR IGNORE INTO temp.oecd_touched VALUES (?)', ((ts,) for ts in touched))
+
+    upsert = (' ON CONFLICT(key, ts) DO UPDATE SET epoch = excluded.epoch, ' +
+              ', '.join(c + ' = excluded.' + c for c in columns))
+    n = 0
+    for prefix, keys in groups(regions):
+        where = 'key NOT IN (SELECT key FROM oecd_aggregates) AND ts IN (SELECT ts FROM temp.oecd_touched)'
+        params = ()
+        if keys is not None:
+            where += ' AND key IN (' + ', '.join(['?'] * len(keys)) + ')'
+            params = tuple(keys)
+        for name in aggregates:
+            key = prefix + '_' + name
+            db.execute('INSERT OR IGNORE INTO oecd_aggregates VALUES (?)', (key,))
+            func = AGGREGATES[name]
+            if func is not None:
+                db.execute('INSERT INTO oecd(key, ts, epoch, ' + ', '.join(columns) + ') ' +
+                           'SELECT ?, ts, min(epoch), ' + ', '.join(func + '(' + c + ')' for c in columns) +
+                           ' FROM oecd WHERE ' + where + ' GROUP BY ts' + upsert, (key,) + params)
+                n += db.execute('SELECT changes()').fetchone()[0]
+            else:
+                values = {}
+                for row in db.execute('SELECT ts, epoch, ' + ', '.join(columns) + ' FROM oecd WHERE ' + where, params):
+                    values.setdefault((row[0], row[1]), []).append(row[2:])
+                rows = [(key, ts, epoch) + tuple(median(col) for col in zip(*v)) for (ts, epoch), v in values.items()]
+                db.executemany('INSERT INTO oecd(key, ts, epoch, ' + ', '.join(columns) + ') VALUES (' +
+                               ', '.join(['?'] * (3 + len(columns))) + ')' + upsert, rows)
+                n += len(rows)
+    db.execute('DROP TABLE temp.oecd_touched')
+    return n
+
+
+def load_regions(path):
+    if path is None:
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='recomputes the aggregate keys (all_avg, ...) of the oecd table')
+    parser.add_argument('--basedir', default='./')
+    parser.add_argument('--db', default='data.db')
+    parser.add_argument('--ts', nargs='+', default=None, help='months (YYYY-MM) to recompute, default: all')
+    parser.add_argument('--aggregates', nargs='+', default=['avg'], choices=sorted(AGGREGATES))
+    parser.add_argument('--regions', default=None, help='json file: region name -> list of keys')
+    args = parser.parse_args()
+
+    with sqlite3.connect(args.basedir + args.db) as db:
+        n = refresh(db, args.ts, args.aggregates, load_regions(args.basedir + args.regions) if args.regions else None)
+        db.commit()
+        print('aggregated ' + str(n) + ' rows')
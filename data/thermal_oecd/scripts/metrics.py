@@ -0,0 +1,182 @@
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# upper bounds of the latency histogram buckets in seconds, like the prometheus defaults
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float('inf'))
+
+
+def add_arguments(parser):
+    parser.add_argument('--metrics', default=None, help='write a run summary to this file, prometheus textfile format if it ends with .prom, else json')
+    parser.add_argument('--profile', default=None, help='profile the main thread with cProfile and dump the stats to this file')
+    parser.add_argument('--tracemalloc', action='store_true', help='trace memory allocations and report the peak and top allocation sites')
+
+
+class Histogram(object):
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q):
+        '''upper bound of the bucket holding the q quantile'''
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank and n:
+                return min(bound, self.max)
+        return self.max
+
+    def json(self):
+        return dict(count=self.count, sum=round(self.sum, 6), min=self.min, max=self.max,
+                    p50=self.quantile(0.5), p90=self.quantile(0.9), p99=self.quantile(0.99),
+                    buckets=[[b if b != float('inf') else '+Inf', n] for b, n in zip(self.buckets, self.counts)])
+
+
+class Metrics(object):
+    '''stage timings, counters and histograms of a pipeline run, safe to update from worker threads
+
+    stage seconds are summed over all threads, such that the stages of concurrent fetches can add up
+    to more than the wall time of the run
+    '''
+
+    def __init__(self, name, args=None):
+        self.name = name
+        self.started = time.time()
+        self.stages = {}
+        self.counters = {}
+        self.histograms = {}
+        self.extra = {}
+        self._lock = threading.Lock()
+        self._args = args
+        self._profiler = None
+        if args is not None:
+            self._start(args)
+
+    def _start(self, args):
+        if getattr(args, 'tracemalloc', False):
+            try:
+                import tracemalloc
+                tracemalloc.start(25)
+            except ImportError:
+                print('tracemalloc needs python 3.4+, ignored')
+        if getattr(args, 'profile', None):
+            import cProfile
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    @contextmanager
+    def stage(self, name, rows=0):
+        '''times the block as stage name, the yielded dict counts its rows: with m.stage('write') as s: s['rows'] += n'''
+        s = dict(rows=rows)
+        start = time.time()
+        try:
+            yield s
+        finally:
+            self.add_stage(name, time.time() - start, s['rows'])
+
+    def add_stage(self, name, seconds, rows=0):
+        with self._lock:
+            stage = self.stages.setdefault(name, dict(seconds=0.0, calls=0, rows=0))
+            stage['seconds'] += seconds
+            stage['calls'] += 1
+            stage['rows'] += rows
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, value):
+        with self._lock:
+            self.histograms.setdefault(name, Histogram()).observe(value)
+
+    def summary(self):
+        wall = time.time() - self.started
+        with self._lock:
+            stages = {}
+            for name, s in self.stages.items():
+                stages[name] = dict(s, seconds=round(s['seconds'], 6))
+                if s['rows'] and s['seconds'] > 0:
+                    stages[name]['rows_per_s'] = round(s['rows'] / s['seconds'], 1)
+            r = dict(name=self.name, started=self.started, wall_seconds=round(wall, 6), stages=stages, counters=dict(self.counters),
+                     histograms=dict((k, h.json()) for k, h in self.histograms.items()))
+        r.update(self.extra)
+        return r
+
+    def prometheus(self):
+        '''summary in the prometheus textfile collector format'''
+        s = self.summary()
+        job = 'job="' + self.name + '"'
+        lines = ['thermal_run_wall_seconds{%s} %f' % (job, s['wall_seconds']), 'thermal_run_started{%s} %f' % (job, s['started'])]
+        for name, stage in sorted(s['stages'].items()):
+            labels = '%s,stage="%s"' % (job, name)
+            lines.append('thermal_stage_seconds{%s} %f' % (labels, stage['seconds']))
+            lines.append('thermal_stage_calls{%s} %d' % (labels, stage['calls']))
+            lines.append('thermal_stage_rows{%s} %d' % (labels, stage['rows']))
+        for name, n in sorted(s['counters'].items()):
+            lines.append('thermal_%s_total{%s} %s' % (name, job, n))
+        if 'memory' in s:
+            lines.append('thermal_memory_peak_bytes{%s} %d' % (job, s['memory']['peak']))
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+            for name, h in histograms:
+                seen = 0
+                for bound, n in zip(h.buckets, h.counts):
+                    seen += n
+                    lines.append('thermal_%s_bucket{%s,le="%s"} %d' % (name, job, '+Inf' if bound == float('inf') else repr(bound), seen))
+                lines.append('thermal_%s_sum{%s} %f' % (name, job, h.sum))
+                lines.append('thermal_%s_count{%s} %d' % (name, job, h.count))
+        return '\n'.join(lines) + '\n'
+
+    def report(self, out=sys.stdout):
+        '''prints the stages, counters and histograms as a table'''
+        s = self.summary()
+        out.write('%s: %.2f s wall time\n' % (self.name, s['wall_seconds']))
+        for name, stage in sorted(s['stages'].items(), key=lambda x: -x[1]['seconds']):
+            out.write('  %-16s %9.3f s %7d calls %10d rows %12s rows/s\n' % (name, stage['seconds'], stage['calls'], stage['rows'], stage.get('rows_per_s', '-')))
+        for name, n in sorted(s['counters'].items()):
+            out.write('  %-16s %d\n' % (name, n))
+        for name, h in sorted(s['histograms'].items()):
+            out.write('  %-16s n=%d p50<=%.3f p90<=%.3f p99<=%.3f max=%.3f s\n' % (name, h['count'], h['p50'] or 0, h['p90'] or 0, h['p99'] or 0, h['max'] or 0))
+
+    def finish(self):
+        '''stops profiling and writes the summary to the --metrics file'''
+        args = self._args
+        if self._profiler is not None:
+            self._profiler.disable()
+            self._profiler.dump_stats(args.profile)
+            import pstats
+            pstats.Stats(args.profile).sort_stats('cumulative').print_stats(20)
+        if args is not None and getattr(args, 'tracemalloc', False):
+            try:
+                import tracemalloc
+            except ImportError:
+                tracemalloc = None
+            if tracemalloc is not None and tracemalloc.is_tracing():
+                current, peak = tracemalloc.get_traced_memory()
+                top = tracemalloc.take_snapshot().statistics('lineno')[:10]
+                tracemalloc.stop()
+                self.extra['memory'] = dict(current=current, peak=peak, top=[dict(site=str(t.traceback), size=t.size, count=t.count) for t in top])
+        self.report()
+        if args is not None and getattr(args, 'metrics', None):
+            with open(args.metrics, 'w') as f:
+                if args.metrics.endswith('.prom'):
+                    f.write(self.prometheus())
+                else:
+                    json.dump(self.summary(), f, indent=1, sort_keys=True)
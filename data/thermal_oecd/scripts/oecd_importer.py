@@ -2,52 +2,122 @@ __author__ = 'holger'
 
 import csv
 import argparse
+import json
+import os
 
 import sqlite3
+import aggregate
+import metrics
+import oecddb
+import rollup
 
 parser = argparse.ArgumentParser(description='')
 parser.add_argument('--basedir', default='./')
 parser.add_argument('--db', default='data.db')
-parser.add_argument('--file', default="myfile.csv")
+parser.add_argument('--load', nargs='+', default=[], metavar='FILE=COLUMN', help='csv files to import with their target column')
+parser.add_argument('--file', default=None, help='single csv file to import, same as --load FILE=COLUMN')
 parser.add_argument('--column', default="col_name")
+parser.add_argument('--traits', default='../traits.json', help='traits file defining the value columns')
+parser.add_argument('--delimiter', default='|')
+parser.add_argument('--chunk', type=int, default=5000, help='rows per batched upsert')
 parser.add_argument('--clear', action='store_true')
+parser.add_argument('--aggregates', nargs='*', default=['avg'], choices=sorted(aggregate.AGGREGATES), help='aggregate keys, e.g. all_avg, to refresh for the imported months')
+parser.add_argument('--regions', default=None, help='json file: region name -> list of keys, aggregated as <region>_<aggregate>')
+metrics.add_arguments(parser)
 args = parser.parse_args()
+run = metrics.Metrics('oecd_importer', args)
 
-columns_name = ['lt_interest_rate', 'st_interest_rate']
-columns_type = ['real','real']
+columns_type = {'float': 'real', 'int': 'int'}
 
-with sqlite3.connect(args.basedir + args.db) as db:
 
+def trait_columns(path):
+    '''value columns of the traits, i.e. the float and int attributes which are not derived from another one'''
+    with open(path, 'r') as f:
+        traits = json.load(f)
     columns = []
-    i=0
-    for c in columns_name:
-        columns.append(columns_name[i] + ' ' + columns_type[i])
-        i+=1
-
-    columns_str = ', '.join(columns)
-
-    db.execute('CREATE TABLE IF NOT EXISTS oecd(key text, ts text, ' + columns_str + ', PRIMARY KEY (key, ts) ON CONFLICT IGNORE )')
-    db.execute('CREATE INDEX IF NOT EXISTS oecd_key on oecd(key)')
-    db.execute('CREATE INDEX IF NOT EXISTS oecd_ts on oecd(ts)')
-
-    def to_row(r):
-        print r
-        key = r[3].replace('"', '').replace('"', '')
-        ts =  r[6].replace('"', '').replace('"', '')
-        val = float(r[14])
-        return val ,key, ts
-        #return key, ts, val
-
-    column = args.column
-    with open(args.basedir + args.file,'r') as f:
-        it = (r for (i,r) in enumerate(csv.reader(f,delimiter='|')) if i > 0) # skip first row (header)
-        #r = to_row(it.next())
-        #print it.next(), r,r[1],r[1] in keys
-        for ri in (to_row(r) for r in it if r[3] is not None):
-            #if ri[1] is not None:
-            #print ri
-            db.execute('UPDATE oecd SET '+column+' = ? WHERE key = ? AND ts = ?', ri)
-            db.execute('INSERT OR IGNORE INTO oecd('+column+',key,ts) VALUES(?,?,?)', ri)
-            #db.commit()
-        #db.executemany('UPDATE air SET temperature = ? WHERE key = ? AND ts = ?',
+    for trait in traits.values():
+        for name, attr in sorted(trait.get('attributes', {}).items()):
+            if attr.get('type') in columns_type and 'attr' not in attr:
+                columns.append((name, columns_type[attr['type']]))
+    return columns
+
+
+def to_row(r):
+    key = r[3].replace('"', '').replace('"', '')
+    ts =  r[6].replace('"', '').replace('"', '')
+    val = float(r[14])
+    return key, ts, val
+
+
+def read(path):
+    with open(path, 'r') as f:
+        it = (r for (i,r) in enumerate(csv.reader(f,delimiter=args.delimiter)) if i > 0) # skip first row (header)
+        for r in it:
+            if len(r) > 14 and r[3] and r[14] != '':
+                yield to_row(r)
+
+
+def chunks(it, size):
+    chunk = []
+    for item in it:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+loads = [l.split('=', 1) for l in args.load]
+if args.file is not None:
+    loads.append((args.file, args.column))
+
+with sqlite3.connect(args.basedir + args.db) as db:
+
+    columns = trait_columns(args.basedir + args.traits)
+    known = set(name for name, _ in columns)
+    columns += [(c, 'real') for _, c in loads if c not in known]
+    with run.stage('schema'):
+        oecddb.ensure_schema(db, columns)
+        oecddb.ensure_columns(db, columns)
+
+    if args.clear:
+        db.execute('DELETE from oecd')
+
+    # merge all files by (key, ts) in a single streaming pass over each
+    load_columns = sorted(set(c for _, c in loads))
+    merged = {}
+    for path, column in loads:
+        i = load_columns.index(column)
+        with run.stage('read') as stage:
+            for key, ts, val in read(args.basedir + path):
+                values = merged.get((key, ts))
+                if values is None:
+                    values = merged[(key, ts)] = [None] * len(load_columns)
+                values[i] = val
+                stage['rows'] += 1
+        run.count('bytes_read', os.path.getsize(args.basedir + path))
+        print('read ' + str(stage['rows']) + ' values of ' + column + ' from ' + path)
+
+    if merged:
+        # missing values are NULL and keep the current value of the column
+        sql = ('INSERT INTO oecd(key, ts, epoch, ' + ', '.join(load_columns) + ') VALUES (' + ', '.join(['?'] * (3 + len(load_columns))) + ')' +
+               ' ON CONFLICT(key, ts) DO UPDATE SET ' + ', '.join(c + ' = coalesce(excluded.' + c + ', ' + c + ')' for c in load_columns))
+        rows = ((key, ts, oecddb.to_epoch(ts)) + tuple(values) for (key, ts), values in sorted(merged.items()))
+        for chunk in chunks(rows, args.chunk):
+            with run.stage('upsert', len(chunk)):
+                db.executemany(sql, chunk)
+
+        # refresh all_avg, ... of the imported months only
+        regions = aggregate.load_regions(args.basedir + args.regions) if args.regions else None
+        with run.stage('aggregate') as stage:
+            stage['rows'] = aggregate.refresh(db, set(ts for _, ts in merged), args.aggregates, regions)
+        since = min(ts for _, ts in merged)
+        # refresh the quarterly and yearly averages of the touched periods
+        with run.stage('rollup'):
+            rollup.build_all(db, since)
+    with run.stage('commit'):
         db.commit()
+    print('imported ' + str(len(merged)) + ' rows into ' + ', '.join(load_columns))
+
+run.finish()
@@ -0,0 +1,48 @@
+import calendar
+import time
+
+
+def to_epoch(ts):
+    '''YYYY-MM -> epoch seconds of the first day of the month at midnight UTC'''
+    return calendar.timegm(time.strptime(ts[:7], '%Y-%m'))
+
+
+def ensure_schema(db, columns):
+    '''creates the oecd table with the given (name, type) value columns'''
+    columns_str = ', '.join(name + ' ' + type_ for name, type_ in columns)
+    db.execute('CREATE TABLE IF NOT EXISTS oecd(key text, ts text, ' + columns_str + ', epoch int, PRIMARY KEY (key, ts) ON CONFLICT IGNORE )')
+    migrate(db)
+
+
+def ensure_columns(db, columns):
+    '''adds the given (name, type) value columns missing in an existing oecd table'''
+    existing = set(r[1] for r in db.execute('PRAGMA table_info(oecd)'))
+    for name, type_ in columns:
+        if name not in existing:
+            db.execute('ALTER TABLE oecd ADD COLUMN ' + name + ' ' + type_)
+
+
+def migrate(db, batch=100000, progress=None):
+    '''adds and fills the integer epoch column of an existing oecd table in place
+
+    the rows are updated in rowid ranges, each committed on its own. afterwards the covering
+    (epoch, key) and (key, epoch) indexes replace the single column index on key.
+    '''
+    if 'epoch' not in [r[1] for r in db.execute('PRAGMA table_info(oecd)')]:
+        db.execute('ALTER TABLE oecd ADD COLUMN epoch int')
+        db.commit()
+
+    if db.execute('SELECT 1 FROM oecd WHERE epoch IS NULL LIMIT 1').fetchone() is not None:
+        lo, hi = db.execute('SELECT min(rowid), max(rowid) FROM oecd').fetchone()
+        for start in range(lo, hi + 1, batch):
+            db.execute("UPDATE oecd SET epoch = CAST(strftime('%s', substr(ts, 1, 7) || '-01') AS INT) WHERE rowid >= ? AND rowid < ? AND epoch IS NULL", (start, start + batch))
+            db.commit()
+            if progress is not None:
+                progress(min(start + batch, hi + 1) - lo, hi + 1 - lo)
+
+    db.execute('CREATE INDEX IF NOT EXISTS oecd_epoch_key on oecd(epoch, key)')
+    db.execute('CREATE INDEX IF NOT EXISTS oecd_key_epoch on oecd(key, epoch)')
+    # key is covered by the primary key, oecd_ts stays for the text range reads of the server
+    db.execute('DROP INDEX IF EXISTS oecd_key')
+    db.execute('CREATE INDEX IF NOT EXISTS oecd_ts on oecd(ts)')
+    db.commit()
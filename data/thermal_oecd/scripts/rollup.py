@@ -0,0 +1,73 @@
+import argparse
+
+import sqlite3
+
+# period -> SQL expression of the first month (YYYY-MM) of the period of a ts
+PERIODS = {
+    'quarterly': "printf('%s-%02d', substr({0}, 1, 4), ((substr({0}, 6, 2) - 1) / 3) * 3 + 1)",
+    'yearly': "substr({0}, 1, 4) || '-01'"
+}
+
+
+def table(period):
+    return 'oecd_' + period
+
+
+def value_columns(db):
+    return [r[1] for r in db.execute('PRAGMA table_info(oecd)') if r[1] not in ('key', 'ts', 'epoch')]
+
+
+def ensure_tables(db, periods):
+    columns = value_columns(db)
+    for period in periods:
+        # ts = first month of the period, months = number of monthly values in the period
+        db.execute('CREATE TABLE IF NOT EXISTS ' + table(period) + '(key text, ts text, epoch int, months int, PRIMARY KEY (key, ts))')
+        db.execute('CREATE INDEX IF NOT EXISTS ' + table(period) + '_epoch_key on ' + table(period) + '(epoch, key)')
+        # server/index.js reads the rollups by ts range like the oecd table
+        db.execute('CREATE INDEX IF NOT EXISTS ' + table(period) + '_ts_key on ' + table(period) + '(ts, key)')
+        existing = set(r[1] for r in db.execute('PRAGMA table_info(' + table(period) + ')'))
+        for c in columns:
+            if c not in existing:
+                db.execute('ALTER TABLE ' + table(period) + ' ADD COLUMN ' + c + ' real')
+
+
+def build(db, period, since=None):
+    '''rebuilds the period averages of all periods at or after the one of since (YYYY-MM), all if None
+
+    Returns:
+       int: number of rebuilt rows
+    '''
+    columns = value_columns(db)
+    start = PERIODS[period]
+    params = dict(since=since)
+    delete = 'DELETE FROM ' + table(period)
+    where = ''
+    if since is not None:
+        delete += ' WHERE ts >= ' + start.format(':since')
+        where = ' WHERE period >= ' + start.format(':since')
+    db.execute(delete, params)
+    db.execute('INSERT INTO ' + table(period) + '(key, ts, epoch, months, ' + ', '.join(columns) + ''')
+        SELECT key, period, CAST(strftime('%s', period || '-01') AS INT), count(*), ''' + ', '.join('avg(' + c + ')' for c in columns) + '''
+        FROM (SELECT o.*, ''' + start.format('o.ts') + ''' AS period FROM oecd o)''' + where + '''
+        GROUP BY key, period''', params)
+    return db.execute('SELECT changes()').fetchone()[0]
+
+
+def build_all(db, since=None, periods=None):
+    periods = periods or sorted(PERIODS)
+    ensure_tables(db, periods)
+    return dict((period, build(db, period, since)) for period in periods)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='materializes quarterly and yearly averages of the oecd table')
+    parser.add_argument('--basedir', default='./')
+    parser.add_argument('--db', default='data.db')
+    parser.add_argument('--since', default=None, help='rebuild only the periods at or after this month (YYYY-MM)')
+    parser.add_argument('--periods', nargs='+', default=None, help='periods to build, default: all')
+    args = parser.parse_args()
+
+    with sqlite3.connect(args.basedir + args.db) as db:
+        for period, n in sorted(build_all(db, args.since, args.periods).items()):
+            print('rolled up ' + str(n) + ' ' + period + ' averages')
+        db.commit()
@@ -9,6 +9,12 @@ const SQLITE_DB_PATH = path.join(BASE_PATH, 'sqlite', 'data.db');
 const BASE_TABLE = 'oecd';
 
 const SQLITE_FIELDS = ['lt_interest_rate', 'st_interest_rate'];
+const DAY = 24 * 60 * 60; // [sec]
+// averages of scripts/rollup.py, coarsest first, used from the given time factor on
+const BASE_TABLE_ROLLUPS = [
+    { table: 'oecd_yearly', min_time_factor: 365 * DAY },
+    { table: 'oecd_quarterly', min_time_factor: 90 * DAY }
+];
 
 function open_db() {
     logger.debug('connecting to sqlite db at %s', SQLITE_DB_PATH);
@@ -28,10 +34,19 @@ class SocketHandler extends UseCaseDBSocketHandler {
     constructor(socket) {
         super(socket, 30 * 24 * 60 * 60, 'month');  // TIME FACTOR in sec = 1 month (30.44 days)
         this.dateformat = 'Y-m';
+        this.rollups = [];
     }
 
     open_db() {
-        return open_db();
+        const db = open_db();
+        const stmt = db.prepare(`select 1 from sqlite_master where type = 'table' and name = ?`);
+        this.rollups = BASE_TABLE_ROLLUPS.filter((rollup) => stmt.get(rollup.table) !== undefined);
+        return db;
+    }
+
+    base_table(time_factor) {
+        const rollup = this.rollups.find((rollup) => time_factor >= rollup.min_time_factor);
+        return rollup ? rollup.table : BASE_TABLE;
     }
 
     find_first_ts() {
@@ -59,9 +74,10 @@ class SocketHandler extends UseCaseDBSocketHandler {
             return r;
         }
 
-        logger.info('read data between [%s (%d s)] and [%s (%d s)] with timeFactor: %s', to_time(start), start, to_time(end), end, time_factor);
+        const table = this.base_table(time_factor);
+        logger.info('read data between [%s (%d s)] and [%s (%d s)] with timeFactor: %s from %s', to_time(start), start, to_time(end), end, time_factor, table);
         const sql = ('select key, ts, ' + SQLITE_FIELDS.join(',') +
-            ' from ' + BASE_TABLE + ' s where s.ts >= ? and s.ts < ?  ' + this.filter('key') +
+            ' from ' + table + ' s where s.ts >= ? and s.ts < ?  ' + this.filter('key') +
             ' order by s.ts asc')
 
         const rows = this.db.prepare(sql).all(to_time(start), to_time(end));
@@ -0,0 +1,359 @@
+import argparse
+import datetime
+import heapq
+import struct
+import zlib
+
+import stockdb
+import writer
+
+parser = argparse.ArgumentParser(description='packs the cold months of the stocks table into one compressed block per ticker and month. '
+                                 'the server reads just the rows, it serves the packed months from the rollups and the message cache only')
+parser.add_argument('--db', default='data.db')
+parser.add_argument('--keep-months', type=int, default=24, help='months before the current one which stay rows in the stocks table')
+parser.add_argument('--before', default=None, help='pack the months before the month of this date YYYY-MM-DD instead')
+parser.add_argument('--unpack', default=None, metavar='SINCE', help='unpack the blocks from the month of this date YYYY-MM-DD on into rows again, "all" for all blocks')
+parser.add_argument('--level', type=int, default=9, help='zlib compression level')
+parser.add_argument('--vacuum', action='store_true', help='vacuum the database afterwards, such that the file shrinks')
+
+TABLE = 'stocks_blocks'
+VERSION = 1
+DAY = 24 * 60 * 60
+EPOCH = datetime.date(1970, 1, 1).toordinal()
+# block columns besides the dates, in the order of stockdb.COLUMNS
+FIELDS = ('volume', 'open', 'close', 'adj_close', 'high', 'low', 'change')
+INTEGERS = ('volume',)
+# prices move little from day to day, they are stored as differences to the previous day
+DELTAS = ('open', 'close', 'adj_close', 'high', 'low')
+MAX_DECIMALS = 8
+
+# column encodings, HAS_NULLS marks a null bitmap in front of the values
+EMPTY, SCALED, FLOAT, CLOSE_DIFF = 0, 1, 2, 3
+HAS_NULLS = 0x80
+
+
+def ensure_table(db):
+  # payload = zlib compressed block of the rows of the month, see encode
+  db.execute('CREATE TABLE IF NOT EXISTS ' + TABLE + '(ticker text, month text, first text, last text, rows int, payload blob, PRIMARY KEY (ticker, month))')
+
+
+def month_of(date):
+  return date[:7] + '-01'
+
+
+def add_months(month, months):
+  m = int(month[:4]) * 12 + int(month[5:7]) - 1 + months
+  return '%04d-%02d-01' % (m // 12, m % 12 + 1)
+
+
+def _put_varint(out, v):
+  while v >= 0x80:
+    out.append(v & 0x7f | 0x80)
+    v >>= 7
+  out.append(v)
+
+
+def _get_varint(buf, pos):
+  v, shift = 0, 0
+  while True:
+    b = buf[pos]
+    pos += 1
+    v |= (b & 0x7f) << shift
+    if b < 0x80:
+      return v, pos
+    shift += 7
+
+
+def _get_varints(buf, pos, n):
+  '''n zigzag varints from pos on and the position after them'''
+  values = []
+  v, shift = 0, 0
+  while len(values) < n:
+    b = buf[pos]
+    pos += 1
+    if b < 0x80:
+      v |= b << shift
+      values.append(v >> 1 if not v & 1 else -((v + 1) >> 1))
+      v, shift = 0, 0
+    else:
+      v |= (b & 0x7f) << shift
+      shift += 7
+  return values, pos
+
+
+def _zigzag(v):
+  return v * 2 if v >= 0 else -v * 2 - 1
+
+
+def _scaled(values):
+  '''(decimals, integers) of the fewest decimals which give back exactly the same floats, (None, None) if there are none'''
+  for d in range(MAX_DECIMALS + 1):
+    scale = 10.0 ** d
+    try:
+      ints = [int(round(v * scale)) for v in values]
+    except (OverflowError, ValueError):  # inf, nan
+      return None, None
+    if all(abs(i) < 2 ** 53 and i / scale == v for i, v in zip(ints, values)):
+      return d, ints
+  return None, None
+
+
+def _encode_column(out, name, values, closes):
+  present = [v for v in values if v is not None]
+  if not present:
+    out.append(EMPTY)
+    return
+  if name == 'change' and len(present) == len(values) and None not in closes and \
+     all(values[i] == closes[i] - closes[i - 1] for i in range(1, len(values))):
+    # change = close - previous close, just the first one depends on the month before
+    out.append(CLOSE_DIFF)
+    out.extend(struct.pack('<d', values[0]))
+    return
+  d, ints = _scaled(present)
+  mode = (FLOAT if d is None else SCALED) | (HAS_NULLS if len(present) < len(values) else 0)
+  out.append(mode)
+  if mode & HAS_NULLS:
+    bits = bytearray((len(values) + 7) // 8)
+    for i, v in enumerate(values):
+      if v is not None:
+        bits[i // 8] |= 1 << (i % 8)
+    out.extend(bits)
+  if d is None:
+    out.extend(struct.pack('<%dd' % len(present), *present))
+    return
+  out.append(d)
+  previous = 0
+  for i in ints:
+    _put_varint(out, _zigzag(i - previous))
+    if name in DELTAS:
+      previous = i
+
+
+def _decode_column(buf, pos, name, n, closes):
+  mode = buf[pos]
+  pos += 1
+  if mode == EMPTY:
+    return [None] * n, pos
+  if mode == CLOSE_DIFF:
+    first = struct.unpack_from('<d', bytes(buf[pos:pos + 8]))[0]
+    return [first] + [closes[i] - closes[i - 1] for i in range(1, n)], pos + 8
+  present = list(range(n))
+  if mode & HAS_NULLS:
+    bits = buf[pos:pos + (n + 7) // 8]
+    pos += len(bits)
+    present = [i for i in range(n) if bits[i // 8] >> (i % 8) & 1]
+  if mode & ~HAS_NULLS == FLOAT:
+    size = 8 * len(present)
+    values = struct.unpack('<%dd' % len(present), bytes(buf[pos:pos + size]))
+    pos += size
+  else:
+    d = buf[pos]
+    pos += 1
+    values, pos = _get_varints(buf, pos, len(present))
+    if name in DELTAS:
+      for i in range(1, len(values)):
+        values[i] += values[i - 1]
+    if d or name not in INTEGERS:
+      scale = 10.0 ** d
+      values = [i / scale for i in values]
+  column = [None] * n
+  for i, v in zip(present, values):
+    column[i] = v
+  return column, pos
+
+
+def encode(rows, level=9):
+  '''compressed block of the (date, volume, open, close, adj_close, high, low, change) rows of a ticker in date order
+
+  the dates are stored as day differences, the prices as the differences of integers scaled by the fewest
+  decimals that give back the same floats, volumes as plain integers, all as varints. change is left out
+  where it equals the difference of the closes. prices without such decimals are stored as raw doubles,
+  so decode(encode(rows)) == rows always.
+  '''
+  out = bytearray([VERSION])
+  _put_varint(out, len(rows))
+  previous = 0
+  for row in rows:
+    day = datetime.date(int(row[0][:4]), int(row[0][5:7]), int(row[0][8:10])).toordinal() - EPOCH
+    _put_varint(out, _zigzag(day - previous))
+    previous = day
+  columns = list(zip(*rows))[1:] if rows else [()] * len(FIELDS)
+  closes = columns[FIELDS.index('close')]
+  for name, values in zip(FIELDS, columns):
+    _encode_column(out, name, list(values), closes)
+  return zlib.compress(bytes(out), level)
+
+
+def decode(ticker, payload):
+  '''rows of a block in the column order of stockdb.COLUMNS, ready for stockdb.INSERT'''
+  buf = bytearray(zlib.decompress(payload))
+  if buf[0] != VERSION:
+    raise ValueError('unknown block version ' + str(buf[0]))
+  n, pos = _get_varint(buf, 1)
+  days, pos = _get_varints(buf, pos, n)
+  for i in range(1, n):
+    days[i] += days[i - 1]
+  columns = {}
+  for name in FIELDS:
+    columns[name], pos = _decode_column(buf, pos, name, n, columns.get('close'))
+  dates = [datetime.date.fromordinal(EPOCH + day).isoformat() for day in days]
+  return [(ticker, dates[i]) + tuple(columns[name][i] for name in FIELDS) + (days[i] * DAY,) for i in range(n)]
+
+
+def _blocks(db, where='', params=()):
+  for ticker, month, payload in db.execute('SELECT ticker, month, payload FROM ' + TABLE + ' WHERE 1' + where + ' ORDER BY ticker, month', params):
+    for row in decode(ticker, payload):
+      yield row
+
+
+def _range(start, end, tickers, columns):
+  '''SQL conditions and parameters of the filters, columns = (first, last) date columns of a row or block'''
+  where, params = '', []
+  if tickers is not None:
+    where += ' AND ticker IN (' + ', '.join(['?'] * len(tickers)) + ')'
+    params.extend(tickers)
+  if start is not None:
+    where += ' AND ' + columns[1] + ' >= ?'
+    params.append(start)
+  if end is not None:
+    where += ' AND ' + columns[0] + ' <= ?'
+    params.append(end)
+  return where, tuple(params)
+
+
+def pack(db, before, level=9):
+  '''moves the rows of the months before the month of before into blocks, returns (blocks, rows)
+
+  rows of a month that already has a block, e.g. filled gaps, are merged into it.
+  '''
+  before = month_of(before)
+  insert = 'INSERT OR REPLACE INTO ' + TABLE + '(ticker, month, first, last, rows, payload) VALUES (?, ?, ?, ?, ?, ?)'
+  blocks, rows = 0, 0
+  key, month_rows = None, []
+
+  def flush():
+    ticker, month = key
+    merged = dict((r[1], r[2:9]) for r in _blocks(db, ' AND ticker = ? AND month = ?', key))
+    merged.update((r[0], r[1:]) for r in month_rows)
+    dates = sorted(merged)
+    db.execute(insert, (ticker, month, dates[0], dates[-1], len(dates), encode([(date,) + tuple(merged[date]) for date in dates], level)))
+
+  cursor = db.execute('SELECT ticker, date, ' + ', '.join(FIELDS) + ' FROM stocks WHERE date < ? ORDER BY ticker, date', (before,))
+  for row in cursor:
+    k = (row[0], month_of(row[1]))
+    if k != key:
+      if month_rows:
+        flush()
+        blocks += 1
+      key, month_rows = k, []
+    month_rows.append(row[1:])
+    rows += 1
+  if month_rows:
+    flush()
+    blocks += 1
+  db.execute('DELETE FROM stocks WHERE date < ?', (before,))
+  return blocks, rows
+
+
+def unpack(db, since=None, tickers=None):
+  '''moves the blocks of the tickers, all if None, from the month of since on, all if None, back into rows, returns (blocks, rows)'''
+  where, params = _range(None if since is None else month_of(since), None, tickers, ('month', 'month'))
+  blocks = db.execute('SELECT count(*) FROM ' + TABLE + ' WHERE 1' + where, params).fetchone()[0]
+  # rows written to the stocks table meanwhile are newer, INSERT OR IGNORE keeps them
+  rows = db.executemany(stockdb.INSERT, _blocks(db, where, params)).rowcount
+  db.execute('DELETE FROM ' + TABLE + ' WHERE 1' + where, params)
+  return blocks, rows
+
+
+def read(db, tickers=None, start=None, end=None):
+  '''rows of the stocks table and the blocks in [start, end] ordered by ticker and date, in the column order of stockdb.COLUMNS
+
+  a row in both, i.e. one written to a packed month later on, is taken from the stocks table
+  '''
+  where, params = _range(start, end, tickers, ('first', 'last'))
+  cold = ((r[0], r[1], 1, r) for r in _blocks(db, where, params) if (start is None or r[1] >= start) and (end is None or r[1] <= end))
+  where, params = _range(start, end, tickers, ('date', 'date'))
+  hot = ((r[0], r[1], 0, r) for r in db.execute('SELECT ' + ', '.join(stockdb.COLUMNS) + ' FROM stocks WHERE 1' + where + ' ORDER BY ticker, date', params))
+  last = None
+  for ticker, date, _, row in heapq.merge(hot, cold):
+    if (ticker, date) != last:
+      last = (ticker, date)
+      yield row
+
+
+def view(db, tickers=None, start=None, end=None, name='stocks_all'):
+  '''creates the temp view name over the stocks table and the blocks in [start, end], returns the number of unpacked rows
+
+  the blocks are decoded into temp.stocks_cold with the indexes of the stocks table, such that the
+  queries of the stocks table work on the view as well:
+
+  >>> blocks.view(db, start='2000-01-01', end='2004-12-31')
+  >>> db.execute('SELECT ticker, avg(close) FROM stocks_all GROUP BY ticker')
+  '''
+  db.execute('DROP VIEW IF EXISTS temp.' + name)
+  db.execute('DROP TABLE IF EXISTS temp.stocks_cold')
+  db.execute('CREATE TEMP TABLE stocks_cold AS SELECT * FROM main.stocks WHERE 0')
+  where, params = _range(start, end, tickers, ('first', 'last'))
+  rows = (r for r in _blocks(db, where, params) if (start is None or r[1] >= start) and (end is None or r[1] <= end))
+  db.executemany('INSERT INTO temp.stocks_cold(' + ', '.join(stockdb.COLUMNS) + ') VALUES (' + ', '.join(['?'] * len(stockdb.COLUMNS)) + ')', rows)
+  db.execute('DELETE FROM temp.stocks_cold WHERE EXISTS (SELECT 1 FROM main.stocks s WHERE s.ticker = stocks_cold.ticker AND s.date = stocks_cold.date)')
+  db.execute('CREATE UNIQUE INDEX temp.stocks_cold_ticker_date on stocks_cold(ticker, date)')
+  db.execute('CREATE INDEX temp.stocks_cold_ticker_ts on stocks_cold(ticker, ts)')
+  db.execute('CREATE INDEX temp.stocks_cold_ts_ticker on stocks_cold(ts, ticker)')
+  db.execute('CREATE TEMP VIEW ' + name + ' AS SELECT ' + ', '.join(stockdb.COLUMNS) + ' FROM main.stocks UNION ALL SELECT ' + ', '.join(stockdb.COLUMNS) + ' FROM temp.stocks_cold')
+  return db.execute('SELECT count(*) FROM temp.stocks_cold').fetchone()[0]
+
+
+def packed(db, tickers=None, start=None):
+  '''whether there are blocks of the tickers, all if None, ending at or after start'''
+  if db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (TABLE,)).fetchone() is None:
+    return False
+  where, params = _range(start, None, tickers, ('first', 'last'))
+  return db.execute('SELECT 1 FROM ' + TABLE + ' WHERE 1' + where + ' LIMIT 1', params).fetchone() is not None
+
+
+def all_tickers(db):
+  '''tickers of the stocks table and the blocks, in order'''
+  union = ' UNION SELECT ticker FROM ' + TABLE if packed(db) else ''
+  return [r[0] for r in db.execute('SELECT DISTINCT ticker FROM stocks' + union + ' ORDER BY ticker')]
+
+
+def source(db, tickers=None, start=None):
+  '''table to read the stocks rows of the tickers from start on from: stocks, or the temp view stocks_all if there are blocks
+
+  such that the stages rebuilding their data from the stocks table keep the packed months
+  '''
+  if not packed(db, tickers, start):
+    return 'stocks'
+  view(db, tickers, start)
+  return 'stocks_all'
+
+
+def size(db):
+  return db.execute('PRAGMA page_count').fetchone()[0] * db.execute('PRAGMA page_size').fetchone()[0]
+
+
+if __name__ == '__main__':
+  args = parser.parse_args()
+
+  with writer.connect(args.db, bulk=True) as db:
+    stockdb.ensure_schema(db)
+    ensure_table(db)
+    before_size = size(db)
+    if args.unpack:
+      blocks, rows = unpack(db, None if args.unpack == 'all' else args.unpack)
+      print('unpacked ' + str(blocks) + ' blocks into ' + str(rows) + ' rows')
+    else:
+      before = month_of(args.before) if args.before else add_months(month_of(datetime.date.today().strftime('%Y-%m-%d')), -args.keep_months)
+      # months whose derived values are still stale stay rows until the stages ran
+      pending = db.execute('SELECT min(since) FROM stocks_watermarks').fetchone()[0]
+      if pending is not None and month_of(pending) < before:
+        before = month_of(pending)
+        print('packing just the months before ' + before + ', the later ones have pending watermarks')
+      blocks, rows = pack(db, before, args.level)
+      stored = db.execute('SELECT count(*), coalesce(sum(length(payload)), 0) FROM ' + TABLE).fetchone()
+      print('packed ' + str(rows) + ' rows before ' + before + ' into ' + str(blocks) + ' blocks, ' + str(stored[0]) + ' blocks of ' + str(stored[1] // 1024) + ' KiB in total')
+    db.commit()
+    if args.vacuum:
+      db.execute('VACUUM')
+      print('vacuumed ' + args.db + ' from ' + str(before_size // 1024 ** 2) + ' MiB to ' + str(size(db) // 1024 ** 2) + ' MiB')
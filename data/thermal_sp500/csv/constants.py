@@ -0,0 +1,99 @@
+import argparse
+import datetime
+import json
+import os
+import re
+import zlib
+
+import writer
+
+parser = argparse.ArgumentParser(description='imports the constant attributes of the tickers into the typed constants table and pre-encodes their messages')
+parser.add_argument('--db', default='data.db')
+parser.add_argument('--constants', default='../sqlite/sp500_constants.json', help='json list of {"Ticker": ..., attribute: value} objects')
+parser.add_argument('--as-of', default=None, help='date of the values YYYY-MM-DD, default: modification date of the file')
+parser.add_argument('--level', type=int, default=6, help='zlib compression level')
+
+TABLE = 'constants'
+MESSAGES = 'constants_messages'
+KEY = 'Ticker'
+MISSING = ('', 'NA', 'N/A', '-')
+
+
+def to_value(v):
+  '''float of a constant, None if missing or not a number'''
+  if v is None or isinstance(v, (int, float)):
+    return v
+  v = v.strip()
+  if v in MISSING:
+    return None
+  try:
+    return float(v.replace(',', ''))
+  except ValueError:
+    return None
+
+
+def ensure_tables(db, names=()):
+  db.execute('CREATE TABLE IF NOT EXISTS ' + TABLE + '(ticker text, as_of text, PRIMARY KEY (ticker, as_of))')
+  db.execute('CREATE INDEX IF NOT EXISTS constants_as_of on ' + TABLE + '(as_of, ticker)')
+  # payload = zlib compressed json array of the {nip, ts: 0, attrs} messages of send_constant_data
+  db.execute('CREATE TABLE IF NOT EXISTS ' + MESSAGES + '(as_of text PRIMARY KEY, rows int, payload blob)')
+  existing = set(r[1] for r in db.execute('PRAGMA table_info(' + TABLE + ')'))
+  for name in names:
+    if not re.match(r'^\w+$', name):
+      raise ValueError('invalid attribute name: ' + name)
+    if name not in existing:
+      db.execute('ALTER TABLE ' + TABLE + ' ADD COLUMN ' + name + ' real')
+
+
+def names_of(db):
+  return [r[1] for r in db.execute('PRAGMA table_info(' + TABLE + ')') if r[1] not in ('ticker', 'as_of')]
+
+
+def load(path):
+  '''attribute names and (ticker, [values]) rows of a constants json file'''
+  with open(path, 'r') as f:
+    entries = json.load(f)
+  names = []
+  for entry in entries:
+    names.extend(k for k in entry if k != KEY and k not in names)
+  return names, [(entry[KEY].strip(), [to_value(entry.get(name)) for name in names]) for entry in entries if entry.get(KEY)]
+
+
+def upsert(db, as_of, names, rows):
+  sql = 'INSERT OR REPLACE INTO ' + TABLE + '(ticker, as_of, ' + ', '.join(names) + ') VALUES (' + ', '.join(['?'] * (len(names) + 2)) + ')'
+  db.executemany(sql, ((ticker, as_of) + tuple(values) for ticker, values in rows))
+  return len(rows)
+
+
+def snapshot(db, as_of):
+  '''messages of the latest values of each ticker as of the date, missing values are left out like the server did'''
+  names = names_of(db)
+  rows = db.execute('SELECT c.ticker, ' + ', '.join('c.' + n for n in names) + ' FROM ' + TABLE + ''' c
+    JOIN (SELECT ticker, max(as_of) AS as_of FROM ''' + TABLE + ''' WHERE as_of <= ? GROUP BY ticker) l ON c.ticker = l.ticker AND c.as_of = l.as_of
+    ORDER BY c.ticker''', (as_of,))
+  return [dict(nip=r[0], ts=0, attrs=dict((n, v) for n, v in zip(names, r[1:]) if v is not None)) for r in rows]
+
+
+def encode(db, as_of, level=6):
+  '''stores the snapshot of the date as pre-encoded payload, returns the number of messages'''
+  msgs = snapshot(db, as_of)
+  payload = zlib.compress(json.dumps(msgs, separators=(',', ':')).encode('utf-8'), level)
+  db.execute('INSERT OR REPLACE INTO ' + MESSAGES + '(as_of, rows, payload) VALUES (?, ?, ?)', (as_of, len(msgs), payload))
+  return len(msgs)
+
+
+if __name__ == '__main__':
+  args = parser.parse_args()
+  as_of = args.as_of or datetime.datetime.utcfromtimestamp(os.path.getmtime(args.constants)).strftime('%Y-%m-%d')
+  names, rows = load(args.constants)
+
+  with writer.connect(args.db) as db:
+    ensure_tables(db, names)
+    n = upsert(db, as_of, names, rows)
+    # later snapshots include the new values of their tickers too
+    for (date,) in db.execute('SELECT as_of FROM ' + MESSAGES + ' WHERE as_of > ?', (as_of,)).fetchall():
+      encode(db, date, args.level)
+    m = encode(db, as_of, args.level)
+    db.commit()
+    missing = sum(v is None for _, values in rows for v in values)
+    print('imported ' + str(n) + ' tickers x ' + str(len(names)) + ' constants as of ' + as_of + ', ' + str(missing) + ' missing, ' + str(m) + ' messages')
@@ -0,0 +1,21 @@
+import argparse
+import sys
+import time
+
+import stockdb
+import writer
+
+parser = argparse.ArgumentParser(description='migrates the stocks table of an existing data.db in place to integer epoch ts and covering indexes')
+parser.add_argument('--db', default='../sqlite/data.db')
+parser.add_argument('--batch', type=int, default=100000, help='rows per committed batch')
+args = parser.parse_args()
+
+start = time.time()
+
+def progress(done, total):
+  sys.stdout.write('\r migrated %d / %d rows (%.1f s)' % (done, total, time.time() - start))
+  sys.stdout.flush()
+
+with writer.connect(args.db, bulk=True) as db:
+  stockdb.migrate(db, batch=args.batch, progress=progress)
+  print('\n done in %.1f s' % (time.time() - start))
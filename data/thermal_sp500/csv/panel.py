@@ -0,0 +1,180 @@
+import argparse
+import json
+import os
+import shutil
+
+import numpy as np
+import blocks
+import stockdb
+import writer
+
+parser = argparse.ArgumentParser(description='exports the stocks table as memory-mapped date x ticker panels, one file per field')
+parser.add_argument('--db', default='data.db')
+parser.add_argument('--out', default='../panel', help='directory of the panel')
+parser.add_argument('--incremental', '-i', action='store_true', help='update the days after the panel watermarks left by crawl.py and append new days')
+parser.add_argument('--chunk', type=int, default=100000, help='rows fetched at once')
+
+FIELDS = ('open', 'high', 'low', 'close', 'adj_close', 'volume')
+DTYPE = '<f8'  # missing values are NaN, volumes are exact up to 2^53
+META = 'meta.json'
+
+
+class Panel(object):
+  '''read-only view of an exported panel
+
+  each field is a C-ordered (dates x tickers) float64 array mapped from <field>.f8, such that
+  a date range of all tickers is a contiguous block and slicing copies nothing
+
+  >>> p = Panel('../panel')
+  >>> close = p.slice('close', '2010-01-01', '2015-12-31')
+  >>> close[:, p.column('AAPL')]
+  '''
+
+  def __init__(self, path):
+    self.path = path
+    with open(os.path.join(path, META), 'r') as f:
+      self.meta = json.load(f)
+    self.tickers = self.meta['tickers']
+    self.dates = self.meta['dates']
+    self.fields = self.meta['fields']
+    self._columns = dict((t, i) for i, t in enumerate(self.tickers))
+    self._arrays = {}
+
+  @property
+  def shape(self):
+    return len(self.dates), len(self.tickers)
+
+  def column(self, ticker):
+    return self._columns[ticker]
+
+  def row(self, date):
+    '''index of the first date >= date'''
+    return int(np.searchsorted(np.array(self.dates), date))
+
+  def field(self, name):
+    if name not in self._arrays:
+      if not self.dates or not self.tickers:
+        return np.empty(self.shape, dtype=DTYPE)
+      # map just the rows of the meta data, a concurrent append may have grown the file already
+      self._arrays[name] = np.memmap(os.path.join(self.path, name + '.f8'), dtype=DTYPE, mode='r', shape=self.shape)
+    return self._arrays[name]
+
+  def slice(self, name, start=None, end=None, tickers=None):
+    '''rows of the dates in [start, end], a view unless tickers are selected'''
+    a = self.field(name)[self.row(start) if start else 0:self.row(stockdb.add_days(end, 1)) if end else None]
+    if tickers is not None:
+      a = a[:, [self._columns[t] for t in tickers]]
+    return a
+
+
+def write_meta(out, tickers, dates):
+  # replace atomically, readers see either the old or the new shape
+  tmp = os.path.join(out, META + '.tmp')
+  with open(tmp, 'w') as f:
+    json.dump(dict(version=1, dtype=DTYPE, layout='dates x tickers, C order', fields=list(FIELDS), tickers=tickers, dates=dates), f)
+  os.rename(tmp, os.path.join(out, META))
+
+
+def fill(db, arrays, columns, rows, sql, params, chunk):
+  '''writes the fields of the selected stocks rows into the panels, returns the number of rows'''
+  cursor = db.execute(sql, params)
+  n = 0
+  while True:
+    batch = cursor.fetchmany(chunk)
+    if not batch:
+      return n
+    r = np.array([rows[b[1]] for b in batch])
+    c = np.array([columns[b[0]] for b in batch])
+    values = np.array([b[2:] for b in batch], dtype=float)
+    for i, name in enumerate(FIELDS):
+      arrays[name][r, c] = values[:, i]
+    n += len(batch)
+
+
+def export(db, out, chunk=100000):
+  '''writes the whole panel, including the packed months, into a new directory, which replaces out'''
+  stocks = blocks.source(db)
+  tickers = [r[0] for r in db.execute('SELECT DISTINCT ticker FROM ' + stocks + ' ORDER BY ticker')]
+  dates = [r[0] for r in db.execute('SELECT DISTINCT date FROM ' + stocks + ' ORDER BY date')]
+  tmp = out.rstrip('/\\') + '.tmp'
+  shutil.rmtree(tmp, ignore_errors=True)
+  os.makedirs(tmp)
+  n = 0
+  if tickers and dates:
+    arrays = {}
+    for name in FIELDS:
+      arrays[name] = np.memmap(os.path.join(tmp, name + '.f8'), dtype=DTYPE, mode='w+', shape=(len(dates), len(tickers)))
+      arrays[name][:] = np.nan
+    columns = dict((t, i) for i, t in enumerate(tickers))
+    rows = dict((d, i) for i, d in enumerate(dates))
+    n = fill(db, arrays, columns, rows, 'SELECT ticker, date, ' + ', '.join(FIELDS) + ' FROM ' + stocks, (), chunk)
+    for a in arrays.values():
+      a.flush()
+  else:
+    for name in FIELDS:
+      open(os.path.join(tmp, name + '.f8'), 'wb').close()
+  write_meta(tmp, tickers, dates)
+  # open maps of readers keep the replaced files alive
+  shutil.rmtree(out, ignore_errors=True)
+  os.rename(tmp, out)
+  return n
+
+
+def update(db, out, chunk=100000):
+  '''rewrites the days after the panel watermarks in place and appends the new days
+
+  falls back to a full export if there is no panel yet, a ticker is new or a day is
+  missing in the middle of the date index
+  '''
+  if not os.path.isfile(os.path.join(out, META)):
+    return export(db, out, chunk)
+  marks = stockdb.watermarks(db, 'panel')
+  if not marks:
+    return 0
+  p = Panel(out)
+  tickers, dates = p.tickers, p.dates
+  if any(t not in p._columns for t in marks) or not dates:
+    return export(db, out, chunk)
+
+  last = dates[-1]
+  known = set(dates)
+  dirty = [r[0] for r in db.execute('''SELECT DISTINCT s.date FROM stocks s JOIN stocks_watermarks w ON w.stage = 'panel' AND w.ticker = s.ticker
+    AND s.date >= w.since''')]
+  if any(d <= last and d not in known for d in dirty):
+    return export(db, out, chunk)
+  new = sorted(d for d in dirty if d > last)
+
+  # grow the files first, the meta data is written last and makes the new days visible
+  shape = (len(dates) + len(new), len(tickers))
+  block = np.full((len(new), len(tickers)), np.nan, dtype=DTYPE).tobytes()
+  for name in FIELDS:
+    path = os.path.join(out, name + '.f8')
+    with open(path, 'r+b') as f:
+      f.truncate(len(dates) * len(tickers) * 8)  # drop the rest of an interrupted append
+      f.seek(0, os.SEEK_END)
+      f.write(block)
+  arrays = dict((name, np.memmap(os.path.join(out, name + '.f8'), dtype=DTYPE, mode='r+', shape=shape)) for name in FIELDS)
+  rows = dict((d, i) for i, d in enumerate(dates + new))
+  n = fill(db, arrays, p._columns, rows, '''SELECT s.ticker, s.date, ''' + ', '.join('s.' + f for f in FIELDS) + ''' FROM stocks s
+    JOIN stocks_watermarks w ON w.stage = 'panel' AND w.ticker = s.ticker AND s.date >= w.since''', (), chunk)
+  for a in arrays.values():
+    a.flush()
+  write_meta(out, tickers, dates + new)
+  return n
+
+
+if __name__ == '__main__':
+  args = parser.parse_args()
+
+  with writer.connect(args.db) as db:
+    stockdb.ensure_schema(db)
+    marks = stockdb.watermarks(db, 'panel')
+    if args.incremental:
+      n = update(db, args.out, args.chunk)
+    else:
+      n = export(db, args.out, args.chunk)
+    # marks lowered by a concurrent crawl meanwhile stay
+    stockdb.clear_processed(db, 'panel', marks.items())
+    db.commit()
+    p = Panel(args.out)
+    print('exported ' + str(n) + ' rows, panel of ' + str(len(p.dates)) + ' days x ' + str(len(p.tickers)) + ' tickers')
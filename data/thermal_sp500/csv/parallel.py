@@ -0,0 +1,105 @@
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import tempfile
+
+
+def add_arguments(parser):
+  parser.add_argument('--jobs', '-j', type=int, default=1, help='worker processes recomputing shards of the tickers, 0 = number of cores')
+
+
+def cores(jobs):
+  return jobs if jobs > 0 else multiprocessing.cpu_count()
+
+
+def shards(items, n):
+  '''splits the sorted items into n interleaved shards, such that tickers with long and short histories mix'''
+  items = sorted(items)
+  return [s for s in (items[i::n] for i in range(n)) if s]
+
+
+def _stage(job):
+  path, stage, fn, task = job
+  # the database is just read, the results go to an own staging file, so the workers never wait for each other
+  db = sqlite3.connect(path, timeout=60)
+  try:
+    db.execute('ATTACH DATABASE ? AS stage', (stage,))
+    db.execute('PRAGMA stage.journal_mode=OFF')
+    db.execute('PRAGMA stage.synchronous=OFF')
+    n = fn(db, task)
+    db.commit()
+  finally:
+    db.close()
+  return stage, n
+
+
+class Pool(object):
+  '''process pool computing shards of a database into staging databases
+
+  fn(db, task) is called in a worker with a connection of the database and an empty
+  database attached as stage, where it creates and fills its result tables. fn has to be
+  a module level function for pickling. the staging files are removed on close.
+
+  >>> with Pool('data.db', 16) as pool:
+  ...   stages = pool.run(stockdb.stage_change, parallel.shards(marks, 64))
+  ...   parallel.collect(db, stages, ['stocks_change'])
+  '''
+
+  def __init__(self, path, jobs, tmpdir=None):
+    self.path = os.path.abspath(path)
+    self.jobs = cores(jobs)
+    # next to the database by default, /tmp may be a small ram disk
+    self.tmpdir = tempfile.mkdtemp(prefix='stage-', dir=tmpdir or os.path.dirname(self.path))
+    self.rows = 0
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, tb):
+    self.close()
+    return False
+
+  def run(self, fn, tasks):
+    '''computes the tasks, returns the staging files in task order'''
+    jobs = [(self.path, os.path.join(self.tmpdir, 'shard%04d.db' % i), fn, task) for i, task in enumerate(tasks)]
+    if self.jobs == 1 or len(jobs) <= 1:
+      results = [_stage(job) for job in jobs]
+    else:
+      pool = multiprocessing.Pool(min(self.jobs, len(jobs)))
+      try:
+        results = pool.map(_stage, jobs, chunksize=1)
+        pool.close()
+      except BaseException:
+        pool.terminate()
+        raise
+      finally:
+        pool.join()
+    self.rows += sum(n or 0 for _, n in results)
+    return [stage for stage, _ in results]
+
+  def close(self):
+    shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+
+def collect(db, stages, tables):
+  '''copies the tables of the staging databases into temp.stage_<table> of db, returns the number of rows
+
+  the staging databases are attached one after the other, sqlite allows just 10 at once. the
+  temp tables are committed right away, the main database is not touched until the caller
+  applies them in a single statement.
+  '''
+  for table in tables:
+    db.execute('DROP TABLE IF EXISTS temp.stage_' + table)
+  n = 0
+  for i, stage in enumerate(stages):
+    db.execute('ATTACH DATABASE ? AS stage', (stage,))
+    try:
+      for table in tables:
+        if i == 0:
+          db.execute('CREATE TEMP TABLE stage_' + table + ' AS SELECT * FROM stage.' + table + ' WHERE 0')
+        n += db.execute('INSERT INTO temp.stage_' + table + ' SELECT * FROM stage.' + table).rowcount
+      db.commit()
+    finally:
+      db.execute('DETACH DATABASE stage')
+  return n
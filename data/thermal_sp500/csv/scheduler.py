@@ -0,0 +1,81 @@
+import random
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+
+class RateLimiter(object):
+  '''token bucket shared by all fetch workers, rate in requests per second (None = unlimited)'''
+
+  def __init__(self, rate=None, burst=None):
+    self.rate = float(rate) if rate else None
+    self.capacity = float(burst) if burst else max(1.0, self.rate or 1.0)
+    self.tokens = self.capacity
+    self.last = time.time()
+    self.lock = threading.Lock()
+
+  def acquire(self):
+    if self.rate is None:
+      return
+    while True:
+      with self.lock:
+        now = time.time()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens >= 1:
+          self.tokens -= 1
+          return
+        wait = (1 - self.tokens) / self.rate
+      time.sleep(wait)
+
+
+class FetchScheduler(object):
+  '''runs fetch(*task) for every task on a pool of worker threads
+
+  results are yielded as (task, result, error) tuples in completion order to the calling thread,
+  such that a single thread can own the database connection
+  '''
+
+  def __init__(self, workers=1, rate=None, retries=3, backoff=1.0, max_backoff=60.0, metrics=None):
+    self.workers = max(1, workers)
+    self.limiter = RateLimiter(rate)
+    self.retries = retries
+    self.backoff = backoff
+    self.max_backoff = max_backoff
+    self.metrics = metrics
+
+  def delay(self, attempt):
+    # exponential backoff with jitter, such that failing workers do not retry in lockstep
+    d = min(self.max_backoff, self.backoff * (2 ** (attempt - 1)))
+    return d * (0.5 + random.random() / 2)
+
+  def call(self, fetch, task):
+    attempt = 0
+    while True:
+      self.limiter.acquire()
+      try:
+        return task, fetch(*task), None
+      except Exception as e:
+        attempt += 1
+        if attempt > self.retries:
+          if self.metrics is not None:
+            self.metrics.count('fetch_failures')
+          return task, None, e
+        if self.metrics is not None:
+          self.metrics.count('fetch_retries')
+        time.sleep(self.delay(attempt))
+
+  def run(self, fetch, tasks):
+    if self.workers == 1:
+      for task in tasks:
+        yield self.call(fetch, task)
+      return
+
+    pool = ThreadPool(self.workers)
+    try:
+      for r in pool.imap_unordered(lambda task: self.call(fetch, task), tasks):
+        yield r
+      pool.close()
+    finally:
+      pool.terminate()
+      pool.join()
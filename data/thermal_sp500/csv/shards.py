@@ -0,0 +1,334 @@
+import argparse
+import datetime
+import hashlib
+import io
+import json
+import os
+import stat
+import sys
+from collections import OrderedDict
+
+import stockdb
+import writer
+
+parser = argparse.ArgumentParser(description='manages the stocks table sharded into one database per year or period, see the manifest.json of the directory')
+parser.add_argument('--shards', default='../sqlite/shards', help='directory of the shards and their manifest.json')
+parser.add_argument('--months', type=int, default=12, help='months per shard of a new directory, a divisor of 12')
+parser.add_argument('--split', default=None, metavar='DB', help='copy the stocks table of an existing database into the shards')
+parser.add_argument('--export', default=None, metavar='DB', help='copy the rows of the shards into the stocks table of a single database, e.g. for the server')
+parser.add_argument('--since', default=None, help='with --export: just the rows from this date YYYY-MM-DD on, e.g. those of the open shards')
+parser.add_argument('--incremental', '-i', action='store_true', help='with --export: just the rows from the earliest change watermark of the database on, i.e. those crawled since the last transform.py')
+parser.add_argument('--freeze', nargs='+', default=None, metavar='NAME', help='vacuum the shards, make them read-only and record their checksums, "closed" for all shards of past periods')
+parser.add_argument('--thaw', nargs='+', default=None, metavar='NAME', help='make frozen shards writable again')
+
+MANIFEST = 'manifest.json'
+# sqlite attaches at most 10 databases by default
+MAX_ATTACHED = 10
+
+
+class ShardError(Exception):
+  pass
+
+
+class Manifest(object):
+  '''the shards of a directory, one stocks table per period of months, aligned to the calendar year
+
+  manifest.json lists each shard with its file, date range [since, until], rows and whether it is
+  frozen, i.e. read-only and unchanged since its sha1 was recorded:
+
+  {"months": 12, "shards": {"2015": {"file": "stocks-2015.db", "since": "2015-01-01", "until": "2015-12-31",
+   "rows": 126000, "frozen": true, "size": 9543680, "sha1": "..."}}}
+  '''
+
+  def __init__(self, directory, months=12):
+    if 12 % months:
+      raise ValueError('months per shard must be a divisor of 12, not ' + str(months))
+    self.directory = directory
+    self.months = months
+    self.shards = OrderedDict()
+
+  @classmethod
+  def open(cls, directory, months=12):
+    '''the manifest of the directory, a new one with the given months per shard if there is none'''
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.isfile(path):
+      if not os.path.isdir(directory):
+        os.makedirs(directory)
+      return cls(directory, months)
+    with io.open(path, 'r', encoding='utf-8') as f:
+      desc = json.load(f, object_pairs_hook=OrderedDict)
+    manifest = cls(directory, desc['months'])
+    manifest.shards = desc['shards']
+    return manifest
+
+  def save(self):
+    desc = OrderedDict([('months', self.months), ('shards', OrderedDict(sorted(self.shards.items())))])
+    path = os.path.join(self.directory, MANIFEST)
+    # replace the file at once, readers never see a partial manifest
+    with io.open(path + '.tmp', 'w', encoding='utf-8') as f:
+      f.write(json.dumps(desc, indent=2, ensure_ascii=False) + u'\n')
+    os.rename(path + '.tmp', path)
+
+  def name(self, date):
+    '''name of the shard of a date, the year or YYYY-MM of the first month of its period'''
+    if self.months == 12:
+      return date[:4]
+    return '%s-%02d' % (date[:4], (int(date[5:7]) - 1) // self.months * self.months + 1)
+
+  def period(self, name):
+    '''[since, until] of the shard'''
+    since = name + '-01-01' if len(name) == 4 else name + '-01'
+    return stockdb.split_range(since, since[:4] + '-12-31', self.months)[0]
+
+  def path(self, name):
+    return os.path.join(self.directory, self.shards[name]['file'])
+
+  def add(self, name):
+    if name not in self.shards:
+      since, until = self.period(name)
+      self.shards[name] = OrderedDict([('file', 'stocks-' + name + '.db'), ('since', since), ('until', until), ('rows', 0), ('frozen', False)])
+    return self.shards[name]
+
+  def overlapping(self, start=None, end=None):
+    '''names of the shards overlapping [start, end] in date order'''
+    return [name for name, shard in sorted(self.shards.items())
+            if (start is None or shard['until'] >= start[:10]) and (end is None or shard['since'] <= end[:10])]
+
+  def connect(self, name, check_same_thread=True):
+    '''a write connection of the shard, created with the stocks table and its indexes if missing'''
+    shard = self.add(name)
+    if shard['frozen']:
+      raise ShardError('shard ' + name + ' is frozen, thaw it to write ' + shard['since'] + ' to ' + shard['until'])
+    db = writer.connect(self.path(name), bulk=True, check_same_thread=check_same_thread)
+    stockdb.ensure_stocks(db)
+    stockdb.migrate(db)
+    return db
+
+  def refresh(self, name, db):
+    self.shards[name]['rows'] = db.execute('SELECT count(*) FROM stocks').fetchone()[0]
+
+
+class Router(object):
+  '''routes the rows of the stocks table to the shards of their dates
+
+  insert(db, rows) has the signature of writer.Writer.call, such that the crawler queues it on its
+  writer thread in order with the crawl state. the rows are committed to the shards before the
+  call returns, the crawl state of the main database is committed after them. the connections of
+  the shards are opened on first use and closed by close, call it once the writer stopped, also if
+  it failed, such that the manifest keeps the rows written so far. frozen shards, e.g. of a backfill,
+  are thawed on first use and frozen again by close:
+
+  >>> router = shards.Router(shards.Manifest.open('../sqlite/shards'))
+  >>> try:
+  ...   with writer.Writer(path) as w:
+  ...     w.call(router.insert, rows)
+  ... finally:
+  ...   router.close()
+  '''
+
+  def __init__(self, manifest):
+    self.manifest = manifest
+    self.connections = {}
+    self.thawed = []
+    self.rows = 0
+
+  def insert(self, db, rows):
+    by_shard = {}
+    for row in rows:
+      by_shard.setdefault(self.manifest.name(row[1]), []).append(row)
+    for name, shard_rows in sorted(by_shard.items()):
+      if name not in self.connections:
+        if self.manifest.shards.get(name, {}).get('frozen'):
+          thaw(self.manifest, name)
+          self.thawed.append(name)
+        # closed on the main thread once the writer thread stopped
+        self.connections[name] = self.manifest.connect(name, check_same_thread=False)
+      shard = self.connections[name]
+      shard.executemany(stockdb.INSERT, shard_rows)
+      shard.commit()
+      self.rows += len(shard_rows)
+
+  def close(self, db=None):
+    try:
+      for name, shard in sorted(self.connections.items()):
+        self.manifest.refresh(name, shard)
+        shard.close()
+      self.connections = {}
+      for name in self.thawed:
+        freeze(self.manifest, name)
+      self.thawed = []
+    finally:
+      self.manifest.save()
+
+
+def attach(db, manifest, start=None, end=None, name='stocks_all'):
+  '''attaches the shards overlapping [start, end] and creates the read-only temp view name of their union
+
+  the shards are attached as shard_<name>, e.g. shard_2015, returns the attached names. conditions on
+  the view are pushed into the selects of the shards, such that they use their indexes. sqlite attaches
+  at most 10 databases, narrow the range for more shards.
+
+  >>> shards.attach(db, shards.Manifest.open('../sqlite/shards'), '2010-01-01', '2014-12-31')
+  >>> db.execute('SELECT ticker, avg(close) FROM stocks_all GROUP BY ticker')
+  '''
+  names = manifest.overlapping(start, end)
+  if len(names) > MAX_ATTACHED:
+    raise ShardError(str(len(names)) + ' shards overlap ' + str(start) + ' to ' + str(end) + ', at most ' + str(MAX_ATTACHED) + ' can be attached')
+  attached = set(r[1] for r in db.execute('PRAGMA database_list'))
+  schemas = []
+  for n in names:
+    schema = 'shard_' + n.replace('-', '_')
+    if schema not in attached:
+      db.execute('ATTACH DATABASE ? AS ' + schema, (manifest.path(n),))
+    schemas.append(schema)
+  columns = ', '.join(stockdb.COLUMNS)
+  db.execute('DROP VIEW IF EXISTS temp.' + name)
+  if schemas:
+    db.execute('CREATE TEMP VIEW ' + name + ' AS ' + ' UNION ALL '.join('SELECT ' + columns + ' FROM ' + s + '.stocks' for s in schemas))
+  else:
+    db.execute('CREATE TEMP VIEW ' + name + ' AS SELECT ' + ', '.join('NULL AS ' + c for c in stockdb.COLUMNS) + ' WHERE 0')
+  return schemas
+
+
+def split(manifest, path):
+  '''copies the stocks table of a database into the shards, returns the number of copied rows'''
+  source = writer.connect(path)
+  first, last = source.execute('SELECT min(date), max(date) FROM stocks').fetchone()
+  source.close()
+  n = 0
+  if first is None:
+    return n
+  for since, until in stockdb.split_range(first[:10], last[:10], manifest.months):
+    name = manifest.name(since)
+    db = manifest.connect(name)
+    try:
+      db.execute('ATTACH DATABASE ? AS source', (os.path.abspath(path),))
+      columns = ', '.join(stockdb.COLUMNS)
+      n += db.execute('INSERT OR IGNORE INTO main.stocks(' + columns + ') SELECT ' + columns + ' FROM source.stocks WHERE date >= ? AND date <= ?',
+                      (since, until)).rowcount
+      db.commit()
+      db.execute('DETACH DATABASE source')
+      manifest.refresh(name, db)
+    finally:
+      db.close()
+    print('copied ' + str(manifest.shards[name]['rows']) + ' rows into ' + manifest.shards[name]['file'])
+  manifest.save()
+  return n
+
+
+def export(manifest, path, since=None):
+  '''copies the rows from since on, all if None, of the shards into the stocks table of a single database
+
+  new rows are inserted, rows with other prices get the prices of the shards. change is left alone, the
+  shards keep the one of crawl time, and the changed (ticker, since) pairs are marked dirty instead,
+  such that transform.py --incremental recomputes it. returns the number of inserted and updated rows.
+  '''
+  db = writer.connect(path, bulk=True)
+  try:
+    stockdb.ensure_schema(db)
+    names = manifest.overlapping(since)
+    prices = [c for c in stockdb.COLUMNS if c not in ('ticker', 'date', 'change')]
+    differs = ' OR '.join('m.' + c + ' IS NOT s.' + c for c in prices)
+    n = 0
+    # a batch at a time, sqlite attaches at most MAX_ATTACHED databases
+    for i in range(0, len(names), MAX_ATTACHED):
+      batch = names[i:i + MAX_ATTACHED]
+      schemas = attach(db, manifest, manifest.shards[batch[0]]['since'], manifest.shards[batch[-1]]['until'], 'stocks_shards')
+      for schema in schemas:
+        params = (since or '',)
+        dirty = db.execute('''SELECT s.ticker, min(s.date) FROM ''' + schema + '''.stocks s LEFT JOIN main.stocks m ON m.ticker = s.ticker AND m.date = s.date
+          WHERE s.date >= ? AND (m.ticker IS NULL OR ''' + differs + ''') GROUP BY s.ticker''', params).fetchall()
+        columns = ', '.join(stockdb.COLUMNS)
+        n += db.execute('INSERT OR IGNORE INTO main.stocks(' + columns + ') SELECT ' + columns + ' FROM ' + schema + '.stocks WHERE date >= ?', params).rowcount
+        n += db.execute('''UPDATE main.stocks AS m SET ''' + ', '.join(c + ' = s.' + c for c in prices) + ''' FROM ''' + schema + '''.stocks s
+          WHERE s.ticker = m.ticker AND s.date = m.date AND s.date >= ? AND (''' + differs + ''')''', params).rowcount
+        stockdb.mark_dirty(db, dirty)
+        db.commit()
+      db.execute('DROP VIEW temp.stocks_shards')
+      for schema in schemas:
+        db.execute('DETACH DATABASE ' + schema)
+    return n
+  finally:
+    db.close()
+
+
+def sha1(path):
+  h = hashlib.sha1()
+  with open(path, 'rb') as f:
+    for chunk in iter(lambda: f.read(1 << 20), b''):
+      h.update(chunk)
+  return h.hexdigest()
+
+
+def freeze(manifest, name):
+  '''compacts a shard into a single read-only file and records its size and sha1'''
+  db = manifest.connect(name)
+  try:
+    manifest.refresh(name, db)
+    db.execute('ANALYZE')
+    db.commit()
+    # no -wal and -shm files next to a frozen shard, it can be cached and shipped as is
+    db.execute('PRAGMA journal_mode=DELETE')
+    db.execute('VACUUM')
+  finally:
+    db.close()
+  path = manifest.path(name)
+  os.chmod(path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+  shard = manifest.shards[name]
+  shard.update(frozen=True, size=os.path.getsize(path), sha1=sha1(path))
+
+
+def thaw(manifest, name):
+  path = manifest.path(name)
+  os.chmod(path, os.stat(path).st_mode | stat.S_IWUSR)
+  shard = manifest.shards[name]
+  shard['frozen'] = False
+  shard.pop('size', None)
+  shard.pop('sha1', None)
+
+
+if __name__ == '__main__':
+  args = parser.parse_args()
+  manifest = Manifest.open(args.shards, args.months)
+
+  if args.split:
+    n = split(manifest, args.split)
+    print('copied ' + str(n) + ' rows of ' + args.split + ' into ' + str(len(manifest.shards)) + ' shards')
+
+  if args.thaw:
+    for name in args.thaw:
+      thaw(manifest, name)
+      print('thawed ' + name)
+    manifest.save()
+
+  if args.freeze:
+    names = args.freeze
+    if names == ['closed']:
+      today = datetime.date.today().strftime('%Y-%m-%d')
+      names = [name for name, shard in manifest.shards.items() if shard['until'] < today and not shard['frozen']]
+    for name in names:
+      if name not in manifest.shards:
+        sys.exit('no shard ' + name + ' in ' + os.path.join(args.shards, MANIFEST))
+      if manifest.shards[name]['frozen']:
+        print(name + ' is frozen already')
+        continue
+      freeze(manifest, name)
+      print('froze ' + name + ', ' + str(manifest.shards[name]['rows']) + ' rows, ' + str(manifest.shards[name]['size'] // 1024) + ' KiB')
+    manifest.save()
+
+  if args.export:
+    if args.incremental:
+      db = writer.connect(args.export)
+      stockdb.ensure_schema(db)
+      # the rows of the crawl, the watermarks of the other stages may be older
+      args.since = db.execute("SELECT min(since) FROM stocks_watermarks WHERE stage = 'change'").fetchone()[0]
+      db.close()
+      if args.since is None:
+        print('no crawl watermarks, ' + args.export + ' is up to date')
+        sys.exit(0)
+    n = export(manifest, args.export, args.since)
+    print('exported ' + str(n) + ' rows' + (' since ' + args.since if args.since else '') + ' into ' + args.export)
+
+  if not (args.split or args.thaw or args.freeze or args.export):
+    for name, shard in sorted(manifest.shards.items()):
+      print('%-8s %-20s %s to %s %10d rows %s' % (name, shard['file'], shard['since'], shard['until'], shard['rows'], 'frozen' if shard['frozen'] else ''))
@@ -20,8 +20,11 @@ from .api._api_request import _Api_Request
 from .api._api_response import _Api_Response
 
 from .api._api_mapper import ObjectMapper
+from .api._session import configure
+from .api._cache import _ResponseCache
 
 YRequest = _Api_Request
 YResponse = _Api_Response
+ResponseCache = _ResponseCache
 
-__all__= ['YRequest', 'YResponse', 'ObjectMapper']
+__all__= ['YRequest', 'YResponse', 'ResponseCache', 'ObjectMapper', 'configure']
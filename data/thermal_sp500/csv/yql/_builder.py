@@ -71,6 +71,29 @@ class _Filter(object):
         return str(self)
 
 
+class _InFilter(_Filter):
+
+    '''Filter the match of particular key to a list of values
+       >>>_filter = _InFilter('key', ['a', 'b'])
+
+    '''
+
+    def __init__(self, name, values, type="unicode"):
+
+        '''Represents an IN condition in yql query
+         For example: select * from query where symbol in ('YHOO', 'AAPL')
+
+        Args:
+            name(str):               Name of the key.
+            values(list):            Values to be use for query.
+            type:                    Represents the type of data used as a value.
+        '''
+
+        self.name = name
+        self.operator = "in"
+        self.value = "({0})".format(", ".join(_Filter(name, v, type=type).value for v in values))
+
+
 class _object(object):
     pass
 
@@ -82,20 +105,6 @@ class _YQLBuilder(_object):
          table(str): name of the table
     '''
 
-    __instance = None
-
-    def __new__(cls, *args, **kwargs):
-
-        '''Making it Singleton
-           Such that it return only single instance at
-           any point of time.
-        '''
-
-        if not cls.__instance:
-            cls.__instance = super(_YQLBuilder, cls).__new__(cls, *args, **kwargs)
-        return cls.__instance
-
-
     def __init__(self, table):
 
         self.table = table
@@ -120,6 +129,23 @@ class _YQLBuilder(_object):
         self._filters.append(_Filter(name, value, type=type))
         return self
 
+    def filter_in(self, name, values, type="unicode"):
+
+        '''Adds a new IN condtion to YQL
+
+        Args:
+           name(str): name of the column
+           values(list): values of which the column has to match one
+
+        Returns:
+           _YQLBuilder: return the current instance of the object
+                        for chaining.
+
+        '''
+
+        self._filters.append(_InFilter(name, values, type=type))
+        return self
+
     def get(self, *args):
 
         if args:
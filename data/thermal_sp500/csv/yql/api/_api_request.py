@@ -1,17 +1,21 @@
 
-from requests import Session
 from yql._builder import _YQLBuilder
 from ._api_response import _Api_Response
+from ._session import get_pool
 from six.moves.urllib.parse import urlencode
 import json
+import os
 
-_yahoo_api = 'https://query.yahooapis.com/v1/public/yql'
+# the public api is gone, point YQL_BASE_URL to a stand-in such as data/tools/yql_server.py
+_yahoo_api = os.environ.get('YQL_BASE_URL', 'https://query.yahooapis.com/v1/public/yql')
+_yahoo_env = 'store://datatables.org/alltableswithkeys'
 
-class _Api_Request(Session):
+class _Api_Request(object):
 
     '''
     A new Request of object for creating a
-    new api session object.
+    new api query, the http connections are
+    drawn from the shared session pool.
 
     '''
 
@@ -25,8 +29,12 @@ class _Api_Request(Session):
         """
 
         self.__tablename = kwargs.pop('table', None)
+        self.__pool = kwargs.pop('pool', None) or get_pool()
+        self.__base_url = kwargs.pop('base_url', None) or self.__pool.base_url or _yahoo_api
+        # cache=False bypasses the response cache of the pool for this request
+        cache = kwargs.pop('cache', None)
+        self.__cache = self.__pool.cache if cache is None else (cache or None)
         self.__yql = _YQLBuilder(self.__tablename)
-        super(_Api_Request, self).__init__(*args, **kwargs)
 
 
     def add_filter(self, name, value):
@@ -42,6 +50,37 @@ class _Api_Request(Session):
         self.__yql.filter(name, value)
         return self
 
+    def add_filter_in(self, name, values):
+        '''Adds an IN filter on to the request
+
+        Args:
+           name(str): name of the yql column
+           values(list): the values of which one should be matched
+
+        Returns:
+           the current reference for chaining.
+        '''
+        self.__yql.filter_in(name, values)
+        return self
+
+    def batch(self, name, values, stream=False):
+        '''Queries several values of a column with a single request,
+        e.g. the quotes of multiple symbols at once.
+
+        Args:
+           name(str): name of the yql column
+           values(list): the values to query
+           stream(bool): whether to stream the response, see json()
+
+        Returns:
+           _Api_Response: the json response, use split() or quotes() to get the rows per value
+        '''
+        if len(values) == 1:
+            self.add_filter(name, values[0])
+        else:
+            self.add_filter_in(name, values)
+        return self.json(stream=stream)
+
     def get(self, column):
         '''Used to query the column on from tyql.
 
@@ -56,26 +95,51 @@ class _Api_Request(Session):
 
         '''
 
-        self._yql.get(column)
+        self.__yql.get(column)
         return self
 
 
 
+    def url(self, format=None):
+        '''Constructs the request url of the query.
+
+        Args:
+           format(str): response format, json or xml
+
+        Returns:
+           str: the url
+        '''
+        params = dict(q=self.__yql._construct(), env=_yahoo_env) # SAM HACK ADDED env param
+        if format is not None:
+            params['format'] = format
+        return self.__base_url + "?" + urlencode(params)
+
+    def _fetch(self, format=None, stream=False):
+        if self.__cache is None:
+            return self.__pool.get(self.url(format), stream=stream)
+        query = self.__yql._construct()
+        key = self.__cache.key(self.__base_url, format, query)
+        response = self.__cache.get(key)
+        if response is None:
+            response = self.__cache.wrap(key, query, self.__pool.get(self.url(format), stream=stream), stream=stream)
+        return response
+
     @property
     def result(self):
-        url = self.__yql._construct() # SAM HACK ADDED env param
-        url = _yahoo_api+"?"+ urlencode(dict(q=url,env='store://datatables.org/alltableswithkeys'))
-        response = super(_Api_Request, self).get(url)
-        return _Api_Response(response)
+        return _Api_Response(self._fetch())
+
+    def json(self, stream=False):
+        '''Queries the json response.
+
+        Args:
+           stream(bool): if set the body is not downloaded upfront,
+                         such that it can be decoded row by row with
+                         _Api_Response.quotes()
 
-    def json(self):
-        url = self.__yql._construct() # SAM HACK ADDED env param
-        url = _yahoo_api+"?"+ urlencode(dict(q=url, format="json",env='store://datatables.org/alltableswithkeys'))
-        response = super(_Api_Request, self).get(url)
-        return _Api_Response(response)
+        Returns:
+           _Api_Response: the response
+        '''
+        return _Api_Response(self._fetch("json", stream=stream))
 
     def xml(self):
-        url = self.__yql._construct() # SAM HACK ADDED env param
-        url = _yahoo_api+"?"+ urlencode(dict(q=url, format="xml",env='store://datatables.org/alltableswithkeys'))
-        response = super(_Api_Request, self).get(url)
-        return _Api_Response(response)
+        return _Api_Response(self._fetch("xml"), type="xml")
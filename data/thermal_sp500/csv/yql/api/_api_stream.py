@@ -0,0 +1,102 @@
+
+import codecs
+import json
+import re
+
+from six.moves.urllib.parse import unquote
+
+
+class _ArrayStream(object):
+
+    '''Incrementally decodes the objects of the array stored under
+       a given key from a stream of json chunks, without decoding
+       the whole document.
+
+       >>>stream = _ArrayStream(response.iter_content(65536), 'quote')
+       >>>for obj in stream:
+       ...     print obj['Date']
+
+    Args:
+       chunks(iterable): byte chunks of the json document
+       key(str):         name of the key holding the array of objects,
+                         a single object or null
+    '''
+
+    _head_size = 512
+
+    def __init__(self, chunks, key):
+
+        self._chunks = iter(chunks)
+        self._decoder = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self._marker = re.compile(r'"{0}"\s*:\s*([\[{{n])'.format(re.escape(key)))
+        self.found = False
+        # start of the document, kept for error messages
+        self.head = ''
+
+    def _more(self):
+        for chunk in self._chunks:
+            data = self._utf8.decode(chunk)
+            if data:
+                if len(self.head) < self._head_size:
+                    self.head = (self.head + data)[:self._head_size]
+                return data
+        return None
+
+    def __iter__(self):
+
+        buf = ''
+        while True:
+            m = self._marker.search(buf)
+            if m:
+                break
+            data = self._more()
+            if data is None:
+                return
+            # keep a tail in case the key is split across two chunks
+            buf = buf[-128:] + data
+
+        self.found = True
+        if m.group(1) == 'n':  # null
+            return
+
+        pos = m.end(1) if m.group(1) == '[' else m.start(1)
+        single = m.group(1) == '{'
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                pos += 1
+            if pos < len(buf) and buf[pos] == ']':
+                return
+            try:
+                if pos >= len(buf):
+                    raise ValueError('incomplete')
+                obj, pos = self._decoder.raw_decode(buf, pos)
+            except ValueError:
+                data = self._more()
+                if data is None:
+                    raise ValueError('truncated json stream: ' + buf[pos:pos + 100])
+                buf = buf[pos:] + data
+                pos = 0
+                continue
+            yield obj
+            if single:
+                return
+            if pos > 65536:  # drop the consumed part
+                buf = buf[pos:]
+                pos = 0
+
+
+def _to_quote(row, ticker=None):
+
+    '''Converts a yahoo.finance.historicaldata quote to a typed tuple
+
+    Args:
+       row(dict):  the decoded quote
+       ticker(str): ticker to use instead of the Symbol of the quote
+
+    Returns:
+       tuple: (ticker, date, volume, open, close, adj_close, high, low)
+    '''
+    return (ticker or unquote(row['Symbol']), row['Date'], int(row['Volume']),
+            float(row['Open']), float(row['Close']), float(row['Adj_Close']),
+            float(row['High']), float(row['Low']))
@@ -1,5 +1,6 @@
 const fs = require('fs');
 const path = require('path');
+const zlib = require('zlib');
 const Database = require('better-sqlite3');
 
 const UseCaseDBSocketHandler = require('../../../server/UseCaseDBSocketHandler');
@@ -9,7 +10,26 @@ const BASE_PATH = path.join(__dirname, '..');
 const SQLITE_DB_PATH = path.join(BASE_PATH, 'sqlite', 'data.db');
 const TABLE_PRICES = 'stocks';
 const TABLE_PRICES_FIELDS = ['open', 'high', 'low', 'close', 'volume', 'adj_close'];
+// socket messages per time bucket of csv/cache.py
+const TABLE_MESSAGES = 'stocks_messages';
+const DAY = 24 * 60 * 60; // [sec]
+// pre-aggregated bars of csv/rollup.py, coarsest first, used from the given time factor on
+const TABLE_PRICES_ROLLUPS = [
+    { table: 'stocks_quarterly', min_time_factor: 90 * DAY },
+    { table: 'stocks_monthly', min_time_factor: 28 * DAY },
+    { table: 'stocks_weekly', min_time_factor: 7 * DAY }
+];
 const CONSTANTS_JSON = path.join(BASE_PATH, 'sqlite', 'sp500_constants.json');
+// pre-encoded constant messages of csv/constants.py
+const TABLE_CONSTANTS_MESSAGES = 'constants_messages';
+
+// decoded messages of the latest constants snapshot, shared by all connections
+let constants_cache = { as_of: null, msgs: null };
+
+// s.ts is the epoch of the day at midnight UTC, round down to match whole days
+function floor_day(ts) {
+    return ts - ts % DAY;
+}
 
 function open_db() {
     logger.debug('connecting to sqlite db at %s', SQLITE_DB_PATH);
@@ -29,25 +49,47 @@ class SocketHandler extends UseCaseDBSocketHandler {
     constructor(socket) {
         super(socket, 24 * 60 * 60);  // TIME FACTOR in sec = 1 day
         this.dateformat = 'Y-m-d';
+        this.rollups = [];
 
         //this.filter_in = ['AA.L', '^FTMC'];
     }
 
     open_db() {
-        return open_db();
+        const db = open_db();
+        const stmt = db.prepare(`select 1 from sqlite_master where type = 'table' and name = ?`);
+        this.rollups = TABLE_PRICES_ROLLUPS.filter((rollup) => stmt.get(rollup.table) !== undefined);
+        this.cache_table = stmt.get(TABLE_MESSAGES) !== undefined ? TABLE_MESSAGES : null;
+        this.constants_table = stmt.get(TABLE_CONSTANTS_MESSAGES) !== undefined ? TABLE_CONSTANTS_MESSAGES : null;
+        return db;
+    }
+
+    prices_table(time_factor) {
+        const rollup = this.rollups.find((rollup) => time_factor >= rollup.min_time_factor);
+        return rollup ? rollup.table : TABLE_PRICES;
     }
 
     find_first_ts() {
-        const row = this.db.prepare(`select min(CAST(strftime('%s', s.date) AS INT)) as ts from ${TABLE_PRICES} s where 1=1 ${this.filter('ticker')}`).get();
+        const row = this.db.prepare(`select min(s.ts) as ts from ${TABLE_PRICES} s where 1=1 ${this.filter('ticker')}`).get();
         return row.ts; // [sec]
     }
 
     find_last_ts() {
-        const row = this.db.prepare(`select max(CAST(strftime('%s', s.date) AS INT)) as ts from ${TABLE_PRICES} s where 1=1 ${this.filter('ticker')}`).get();
+        const row = this.db.prepare(`select max(s.ts) as ts from ${TABLE_PRICES} s where 1=1 ${this.filter('ticker')}`).get();
         return row.ts; // [sec]
     }
 
     read_constant_data() {
+        if (this.constants_table) {
+            const latest = this.db.prepare(`select max(as_of) as as_of from ${this.constants_table}`).get();
+            if (latest && latest.as_of !== null) {
+                if (constants_cache.as_of !== latest.as_of) {
+                    const row = this.db.prepare(`select payload from ${this.constants_table} where as_of = ?`).get(latest.as_of);
+                    constants_cache = { as_of: latest.as_of, msgs: JSON.parse(zlib.inflateSync(row.payload).toString('utf8')) };
+                    logger.info('loaded %d constants as of %s', constants_cache.msgs.length, latest.as_of);
+                }
+                return constants_cache.msgs;
+            }
+        }
         const constants = JSON.parse(fs.readFileSync(CONSTANTS_JSON, 'utf8'));
         // map JSON to message format
         return constants.map((row) => {
@@ -69,19 +111,20 @@ class SocketHandler extends UseCaseDBSocketHandler {
         start *= time_factor;
         end *= time_factor;
 
-        logger.info('read data between [%s (%d s)] and [%s (%d s)] with timeFactor: %s', new Date(start * 1000).toUTCString(), start, new Date(end * 1000).toUTCString(), end, time_factor);
+        const table = this.prices_table(time_factor);
+        logger.info('read data between [%s (%d s)] and [%s (%d s)] with timeFactor: %s from %s', new Date(start * 1000).toUTCString(), start, new Date(end * 1000).toUTCString(), end, time_factor, table);
         const sql = `
             SELECT
                 ticker,
-                CAST(strftime('%s', s.date) AS INT) as ts,
+                s.ts as ts,
                 ${TABLE_PRICES_FIELDS.map((field) => `s.${field} as ${field}`).join(',')} 
-            FROM ${TABLE_PRICES} s 
+            FROM ${table} s 
             WHERE
-                s.date >= date(?, 'unixepoch') AND s.date < date(?, 'unixepoch') 
+                s.ts >= ? AND s.ts < ? 
                 ${this.filter('ticker')}
             ORDER BY ts ASC`;
 
-        const rows = this.db.prepare(sql).all(start, end);
+        const rows = this.db.prepare(sql).all(floor_day(start), floor_day(end));
 
         return rows.map((row) => {
             const r = {
@@ -120,12 +163,12 @@ class CSVHandler {
 
         const sql = (`SELECT date, ${TABLE_PRICES_FIELDS.join(', ')} 
             FROM ${TABLE_PRICES} 
-            WHERE date >= date(?, 'unixepoch') AND date < date(?, 'unixepoch') AND ticker = ? 
-            ORDER BY date ${order_by}`);
+            WHERE ts >= ? AND ts < ? AND ticker = ? 
+            ORDER BY ts ${order_by}`);
 
         logger.info(sql);
         logger.info('execute query with %s %s %s', field, start, end);
-        const rows = db.prepare(sql).all(start, end, field);
+        const rows = db.prepare(sql).all(floor_day(start), floor_day(end), field);
 
         close_db(db);
 
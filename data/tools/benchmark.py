@@ -0,0 +1,278 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import sqlite3
+
+DATA = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STOCKS_SCRIPTS = os.path.join(DATA, 'thermal_sp500', 'csv')
+OECD_SCRIPTS = os.path.join(DATA, 'thermal_oecd', 'scripts')
+sys.path.insert(0, STOCKS_SCRIPTS)
+
+import stockdb
+import writer
+
+parser = argparse.ArgumentParser(description='times ingest, transform and the server queries on synthetic stocks, oecd and crypto databases')
+parser.add_argument('--tickers', type=int, nargs='+', default=[500], help='numbers of tickers (stocks), keys (oecd) and currencies (crypto)')
+parser.add_argument('--years', type=int, nargs='+', default=[1], help='numbers of years of daily (stocks, crypto) or monthly (oecd) data')
+parser.add_argument('--datasets', nargs='+', default=['stocks', 'oecd', 'crypto'], choices=['stocks', 'oecd', 'crypto'])
+parser.add_argument('--end', default='2015-12-31', help='last date of the synthetic data')
+parser.add_argument('--repeat', type=int, default=5, help='runs per query, the median is reported')
+parser.add_argument('--filter', type=int, nargs='+', default=[0, 1, 50], help='filter_in sizes of the queries, 0 = no filter')
+parser.add_argument('--seed', type=int, default=42)
+parser.add_argument('--workdir', default=None, help='directory of the generated databases, default: a temporary one which is removed')
+parser.add_argument('--out', default='benchmark.json', help='json file of the results')
+parser.add_argument('--compare', default=None, help='json file of a previous run to compare with')
+parser.add_argument('--threshold', type=float, default=1.25, help='slowdown factor reported as regression by --compare')
+parser.add_argument('--min-seconds', type=float, default=0.001, help='timings below are too noisy to be compared')
+
+DAY = 24 * 60 * 60
+
+
+class Results(object):
+  def __init__(self):
+    self.entries = []
+
+  def time(self, dataset, scale, name, fn, rows=None, repeat=1):
+    times = []
+    result = None
+    for _ in range(repeat):
+      start = time.time()
+      result = fn()
+      times.append(time.time() - start)
+    seconds = sorted(times)[len(times) // 2]
+    entry = dict(dataset=dataset, tickers=scale[0], years=scale[1], name=name, seconds=round(seconds, 6), min=round(min(times), 6), repeat=repeat)
+    if rows is None and isinstance(result, list):
+      rows = len(result)
+    if rows is not None:
+      entry['rows'] = rows
+      entry['rows_per_s'] = round(rows / seconds) if seconds > 0 else None
+    self.entries.append(entry)
+    print('%-7s %6d x %2dy  %-40s %9.4f s%s' % (dataset, scale[0], scale[1], name, seconds, '' if rows is None else '  %d rows' % rows))
+    return result
+
+
+def dates(end, years, weekdays):
+  last = datetime.datetime.strptime(end, '%Y-%m-%d')
+  d = last - datetime.timedelta(days=365 * years - 1)
+  r = []
+  while d <= last:
+    if not weekdays or d.weekday() < 5:
+      r.append(d.strftime('%Y-%m-%d'))
+    d += datetime.timedelta(days=1)
+  return r
+
+
+def walk(rng, n, start=50.0, sigma=0.02):
+  return start * np.exp(np.cumsum(rng.normal(0, sigma, n)))
+
+
+def names(prefix, n):
+  return [prefix + str(i).zfill(len(str(n))) for i in range(n)]
+
+
+def filter_sql(prop, values):
+  # same shape as UseCaseDBSocketHandler.filter, with standard string literals
+  if not values:
+    return ''
+  return 'and ' + prop + " in ('" + "','".join(values) + "') "
+
+
+def run_script(cwd, script, *args):
+  subprocess.check_call([sys.executable, script] + list(args), cwd=cwd, stdout=open(os.devnull, 'w'))
+
+
+def time_reads(results, dataset, scale, db, read_data, find_first, find_last, keys, ts, after):
+  '''times the query shapes of read_data for a single step, 30 steps and all, and of find_first_ts / find_last_ts
+
+  ts are the distinct time steps of the data, after a value after the last one
+  '''
+  ts = list(ts) + [after]
+  m = len(ts) // 2
+  windows = [('1 step', ts[m], ts[m + 1]), ('30 steps', ts[m], ts[min(m + 30, len(ts) - 1)]), ('all', ts[0], ts[-1])]
+  for n in args.filter:
+    f = keys[:n]
+    label = 'filter %d' % n if n else 'no filter'
+    for name, start, end in windows:
+      results.time(dataset, scale, 'read_data %s, %s' % (name, label), lambda: read_data(db, start, end, f), repeat=args.repeat)
+    results.time(dataset, scale, 'find_first_ts, ' + label, lambda: find_first(db, f), repeat=args.repeat)
+    results.time(dataset, scale, 'find_last_ts, ' + label, lambda: find_last(db, f), repeat=args.repeat)
+
+
+def bench_stocks(results, scale, workdir, rng):
+  tickers = names('T', scale[0])
+  days = dates(args.end, scale[1], True)
+  ts = [stockdb.to_ts(d) for d in days]
+  path = os.path.join(workdir, 'stocks.db')
+  db = writer.connect(path)
+  stockdb.ensure_schema(db)
+  db.commit()
+
+  def ingest():
+    # same writes as crawl.py: rows, watermarks and crawl state through the writer thread
+    with writer.Writer(path) as w:
+      for ticker in tickers:
+        close = walk(rng, len(days))
+        open_ = close * (1 + rng.normal(0, 0.005, len(days)))
+        high = np.maximum(open_, close) * 1.01
+        low = np.minimum(open_, close) * 0.99
+        volume = rng.randint(1000, 1000000, len(days))
+        change = np.diff(close, prepend=0)
+        rows = list(zip([ticker] * len(days), days, volume.tolist(), open_.tolist(), close.tolist(), close.tolist(), high.tolist(), low.tolist(), change.tolist(), ts))
+        w.put(stockdb.INSERT, rows)
+        w.call(stockdb.mark_dirty, [(ticker, days[0])])
+        w.call(stockdb.crawl_loaded, ticker, days[0], days[-1])
+  results.time('stocks', scale, 'ingest (crawl.py writer)', ingest, rows=len(tickers) * len(days))
+
+  with open(os.path.join(workdir, 'stocks.csv'), 'w') as f:
+    f.write('Ticker;Name\n' + ''.join(t + ';' + t + '\n' for t in tickers))
+  results.time('stocks', scale, 'transform.py', lambda: run_script(STOCKS_SCRIPTS, 'transform.py', '--db', path, '--stock', os.path.join(workdir, 'stocks.csv')),
+               rows=len(tickers) * len(days))
+  results.time('stocks', scale, 'rollup.py', lambda: run_script(STOCKS_SCRIPTS, 'rollup.py', '--db', path), rows=len(tickers) * len(days))
+
+  # nightly run: one new day per ticker, then the incremental stages
+  day = stockdb.add_days(days[-1], 1)
+  rows = [(t, day, 1000, 1.0, 1.0, 1.0, 1.0, 1.0, 0.0, stockdb.to_ts(day)) for t in tickers]
+
+  def append():
+    with writer.Writer(path) as w:
+      w.put(stockdb.INSERT, rows)
+      w.call(stockdb.mark_dirty, [(t, day) for t in tickers])
+  results.time('stocks', scale, 'ingest 1 day', append, rows=len(rows))
+  results.time('stocks', scale, 'transform.py --incremental 1 day', lambda: run_script(STOCKS_SCRIPTS, 'transform.py', '--db', path, '--incremental'), rows=len(rows))
+  results.time('stocks', scale, 'rollup.py --incremental 1 day', lambda: run_script(STOCKS_SCRIPTS, 'rollup.py', '--db', path, '--incremental'), rows=len(rows))
+
+  def read_data(db, start, end, f):
+    return db.execute('SELECT ticker, s.ts as ts, s.volume, s.open, s.close, s.adj_close, s.high, s.low, s.change FROM stocks s WHERE s.ts >= ? AND s.ts < ? ' +
+                      filter_sql('ticker', f) + ' ORDER BY ts ASC', (start, end)).fetchall()
+
+  def find(agg):
+    return lambda db, f: db.execute('select ' + agg + '(s.ts) as ts from stocks s where 1=1 ' + filter_sql('ticker', f)).fetchone()[0]
+
+  time_reads(results, 'stocks', scale, db, read_data, find('min'), find('max'), tickers, ts, ts[-1] + DAY)
+  db.close()
+
+
+def bench_oecd(results, scale, workdir, rng):
+  keys = names('K', scale[0])
+  months = sorted(set(d[:7] for d in dates(args.end, scale[1], False)))
+  columns = ('lt_interest_rate', 'st_interest_rate')
+  shutil.copy(os.path.join(DATA, 'thermal_oecd', 'traits.json'), os.path.join(workdir, 'traits.json'))
+
+  # pipe separated OECD export: key in column 3, month in column 6, value in column 14
+  loads = []
+  for c in columns:
+    name = c + '.csv'
+    with open(os.path.join(workdir, name), 'w') as f:
+      f.write('|'.join('h' + str(i) for i in range(17)) + '\n')
+      for key in keys:
+        for month, value in zip(months, walk(rng, len(months), 5.0, 0.05).tolist()):
+          r = [''] * 17
+          r[3], r[6], r[14] = '"' + key + '"', '"' + month + '"', '%.4f' % value
+          f.write('|'.join(r) + '\n')
+    loads.append(name + '=' + c)
+  basedir = workdir + os.sep
+  results.time('oecd', scale, 'oecd_importer.py', lambda: run_script(OECD_SCRIPTS, 'oecd_importer.py', '--basedir', basedir, '--db', 'oecd.db',
+                                                                     '--traits', 'traits.json', '--load', *loads),
+               rows=len(keys) * len(months) * len(columns))
+
+  def read_data(db, start, end, f):
+    return db.execute('select key, ts, ' + ','.join(columns) + ' from oecd s where s.ts >= ? and s.ts < ?  ' + filter_sql('key', f) + ' order by s.ts asc',
+                      (start, end)).fetchall()
+
+  def find(agg):
+    return lambda db, f: db.execute('select ' + agg + '(s.ts) as date from oecd s where 1=1 ' + filter_sql('key', f)).fetchone()[0]
+
+  db = sqlite3.connect(os.path.join(workdir, 'oecd.db'))
+  time_reads(results, 'oecd', scale, db, read_data, find('min'), find('max'), keys, months, '9999-12')
+  db.close()
+
+
+def bench_crypto(results, scale, workdir, rng):
+  currencies = names('C', scale[0])
+  ts = [float(stockdb.to_ts(d)) for d in dates(args.end, scale[1], False)]
+  path = os.path.join(workdir, 'crypto.db')
+  db = writer.connect(path)
+  with open(os.path.join(DATA, 'thermal_crypto', 'sqlite', 'setup-sqlite-tables.sql')) as f:
+    db.executescript(f.read())
+
+  def ingest():
+    with writer.Writer(path) as w:
+      for fiat in ('USD', 'EUR'):
+        btc = walk(rng, len(ts), 1000.0).tolist()
+        w.put('INSERT INTO btc_prices VALUES (?, ?, ?, ?, ?, ?, ?, ?)', ((t, p, p, p, p, 1.0, p, fiat) for t, p in zip(ts, btc)))
+      for c in currencies:
+        p = walk(rng, len(ts), 0.01).tolist()
+        w.put('INSERT INTO crypto_prices VALUES (?, ?, ?, ?, ?, ?, ?, ?)', ((t, v, v * 1.01, v * 0.99, v, 100.0, v * 100, c) for t, v in zip(ts, p)))
+  results.time('crypto', scale, 'ingest', ingest, rows=(2 + len(currencies)) * len(ts))
+
+  def read_data(db, start, end, f):
+    return db.execute('''SELECT cp.currency_code, cp.ts, cp.opening_price*bp.opening_price as opening_price, cp.highest_price*bp.highest_price as highest_price,
+        cp.lowest_price*bp.lowest_price as lowest_price, cp.closing_price*bp.closing_price as closing_price, cp.volume_crypto, cp.volume_btc,
+        cp.volume_btc*bp.closing_price as volume_currency, cp.volume_btc as volume
+      FROM crypto_prices cp LEFT JOIN btc_prices bp ON cp.ts = bp.ts
+      WHERE bp.currency_code = 'USD' AND cp.ts >= ? and cp.ts < ? ''' + filter_sql('cp.currency_code', f) + ' ORDER BY cp.ts ASC', (start, end)).fetchall()
+
+  def find(agg):
+    return lambda db, f: db.execute('select ' + agg + '(s.ts) as ts from crypto_prices s where 1=1 ' + filter_sql('currency_code', f)).fetchone()[0]
+
+  time_reads(results, 'crypto', scale, db, read_data, find('min'), find('max'), currencies, ts, ts[-1] + DAY)
+  db.close()
+
+
+BENCHMARKS = {
+  'stocks': bench_stocks,
+  'oecd': bench_oecd,
+  'crypto': bench_crypto
+}
+
+
+def compare(entries, path, threshold, min_seconds=0.0):
+  '''prints the entries which got slower than threshold compared to the previous run, returns their number'''
+  with open(path, 'r') as f:
+    previous = dict(((e['dataset'], e['tickers'], e['years'], e['name']), e) for e in json.load(f)['results'])
+  regressions = 0
+  for e in entries:
+    p = previous.get((e['dataset'], e['tickers'], e['years'], e['name']))
+    if p is None or max(p['seconds'], e['seconds']) < min_seconds or not p['seconds']:
+      continue
+    ratio = e['seconds'] / p['seconds']
+    if ratio > threshold:
+      regressions += 1
+      print('REGRESSION %-7s %6d x %2dy  %-40s %9.4f s -> %9.4f s (x%.2f)' % (e['dataset'], e['tickers'], e['years'], e['name'], p['seconds'], e['seconds'], ratio))
+  return regressions
+
+
+if __name__ == '__main__':
+  args = parser.parse_args()
+  results = Results()
+  for tickers in args.tickers:
+    for years in args.years:
+      for dataset in args.datasets:
+        workdir = args.workdir or tempfile.mkdtemp(prefix='thermal-bench-')
+        if args.workdir:
+          workdir = os.path.join(args.workdir, '%s-%d-%d' % (dataset, tickers, years))
+          shutil.rmtree(workdir, ignore_errors=True)
+          os.makedirs(workdir)
+        try:
+          BENCHMARKS[dataset](results, (tickers, years), workdir, np.random.RandomState(args.seed))
+        finally:
+          if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+  meta = dict(created=datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'), python=platform.python_version(), sqlite=sqlite3.sqlite_version,
+              numpy=np.__version__, platform=platform.platform(), args=vars(args))
+  with open(args.out, 'w') as f:
+    json.dump(dict(meta=meta, results=results.entries), f, indent=1, sort_keys=True)
+  print('results written to ' + args.out)
+
+  if args.compare is not None:
+    sys.exit(1 if compare(results.entries, args.compare, args.threshold, args.min_seconds) else 0)
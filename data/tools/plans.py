@@ -0,0 +1,304 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import re
+import sys
+import time
+
+import sqlite3
+
+parser = argparse.ArgumentParser(description='checks the query plans and timings of the read_data, find_first_ts and find_last_ts queries of the use case servers')
+parser.add_argument('--db', required=True)
+parser.add_argument('--use-case', default=None, choices=['stocks', 'oecd', 'crypto'], help='default: by the tables of the database')
+parser.add_argument('--filters', type=int, nargs='+', default=[1, 50, 500], help='sizes of the filter_in and filter_ex lists of setNodeFilter')
+parser.add_argument('--repeat', type=int, default=3, help='runs per query, the median is reported')
+parser.add_argument('--seed', type=int, default=42, help='seed of the sampled filter lists')
+parser.add_argument('--out', default=None, help='json file of the plans and timings')
+parser.add_argument('--compare', default=None, help='json file of a previous run, fail just on plans which became full table scans since')
+parser.add_argument('--threshold', type=float, default=1.25, help='slowdown factor reported by --compare')
+parser.add_argument('--min-seconds', type=float, default=0.001, help='timings below are too noisy to be compared')
+
+DAY = 24 * 60 * 60
+# same as TABLE_PRICES_FIELDS and TABLE_PRICES_ROLLUPS of thermal_sp500/server/index.js
+STOCKS_FIELDS = ('open', 'high', 'low', 'close', 'volume', 'adj_close')
+STOCKS_ROLLUPS = ('stocks_weekly', 'stocks_monthly', 'stocks_quarterly')
+# SQLITE_FIELDS of thermal_oecd/server/index.js
+OECD_FIELDS = ('lt_interest_rate', 'st_interest_rate')
+# BASE_TABLE_ROLLUPS of thermal_oecd/server/index.js
+OECD_ROLLUPS = ('oecd_quarterly', 'oecd_yearly')
+# TABLE_CRYPTO_PRICES_FIELDS of thermal_crypto/server/index.js
+CRYPTO_FIELDS = ('opening_price', 'highest_price', 'lowest_price', 'closing_price', 'volume_crypto', 'volume_btc')
+
+
+class Shape(object):
+  '''a query of a server, {filter} is replaced by the clauses of UseCaseDBSocketHandler.filter
+
+  candidates are the (table, columns) indexes which could serve it, suggested if missing
+  '''
+
+  def __init__(self, name, table, sql, prop, windowed, candidates):
+    self.name = name
+    self.table = table
+    self.sql = sql
+    self.prop = prop
+    self.windowed = windowed
+    self.candidates = candidates
+
+
+def stocks_shapes(tables):
+  read = '''
+            SELECT
+                ticker,
+                s.ts as ts,
+                ''' + ','.join('s.' + f + ' as ' + f for f in STOCKS_FIELDS) + '''
+            FROM {table} s
+            WHERE
+                s.ts >= ? AND s.ts < ?
+                {filter}
+            ORDER BY ts ASC'''
+  shapes = [Shape('read_data ' + t, t, read.replace('{table}', t), 'ticker', True, [(t, ('ts', 'ticker')), (t, ('ticker', 'ts'))])
+            for t in ('stocks',) + STOCKS_ROLLUPS if t in tables]
+  for fn, agg in (('find_first_ts', 'min'), ('find_last_ts', 'max')):
+    shapes.append(Shape(fn, 'stocks', 'select ' + agg + '(s.ts) as ts from stocks s where 1=1 {filter}', 'ticker', False,
+                        [('stocks', ('ticker', 'ts')), ('stocks', ('ts', 'ticker'))]))
+  return shapes
+
+
+def oecd_shapes(tables):
+  read = 'select key, ts, ' + ','.join(OECD_FIELDS) + ' from {table} s where s.ts >= ? and s.ts < ?  {filter} order by s.ts asc'
+  candidates = [('oecd', ('ts', 'key')), ('oecd', ('key', 'ts'))]
+  shapes = [Shape('read_data ' + t, t, read.replace('{table}', t), 'key', True, [(t, ('ts', 'key')), (t, ('key', 'ts'))])
+            for t in ('oecd',) + OECD_ROLLUPS if t in tables]
+  shapes.append(Shape('find_first_ts', 'oecd', 'select min(s.ts) as date from oecd s where 1=1 {filter}', 'key', False, candidates))
+  shapes.append(Shape('find_last_ts', 'oecd', 'select max(s.ts) from oecd s where 1=1 {filter}', 'key', False, candidates))
+  return shapes
+
+
+def crypto_shapes(tables):
+  read = '''
+            SELECT
+                cp.currency_code,
+                cp.ts,
+                ''' + ','.join('cp.' + f + '*bp.' + f + ' as ' + f for f in CRYPTO_FIELDS[:-2]) + ''',
+                cp.volume_crypto,
+                cp.volume_btc,
+                cp.volume_btc*bp.closing_price as volume_currency,
+                cp.volume_btc as volume
+            FROM crypto_prices cp
+            LEFT JOIN btc_prices bp
+            ON cp.ts = bp.ts
+            WHERE
+                bp.currency_code = 'USD'
+                AND cp.ts >= ? and cp.ts < ?
+                {filter}
+            ORDER BY cp.ts ASC'''
+  candidates = [('crypto_prices', ('ts', 'currency_code')), ('crypto_prices', ('currency_code', 'ts'))]
+  return [Shape('read_data crypto_prices', 'crypto_prices', read, 'cp.currency_code', True,
+                candidates + [('btc_prices', ('ts', 'currency_code')), ('btc_prices', ('currency_code', 'ts'))]),
+          Shape('find_first_ts', 'crypto_prices', 'select min(s.ts) as ts from crypto_prices s where 1=1 {filter}', 'currency_code', False, candidates),
+          Shape('find_last_ts', 'crypto_prices', 'select max(s.ts) as ts from crypto_prices s where 1=1 {filter}', 'currency_code', False, candidates)]
+
+
+USE_CASES = {
+  # use case -> (table which identifies it, key column, shapes)
+  'stocks': ('stocks', 'ticker', stocks_shapes),
+  'oecd': ('oecd', 'key', oecd_shapes),
+  'crypto': ('crypto_prices', 'currency_code', crypto_shapes)
+}
+
+
+def filter_sql(prop, filter_in, filter_ex):
+  # same as UseCaseDBSocketHandler.filter, including the double quoted values
+  r = ''
+  if filter_in:
+    r += 'and ' + prop + ' in ("' + '","'.join(filter_in) + '") '
+  if filter_ex:
+    r += 'and ' + prop + ' not in ("' + '","'.join(filter_ex) + '") '
+  return r
+
+
+def filters(keys, sizes, seed):
+  '''(label, filter_in, filter_ex) of no filter and of sampled lists of the sizes'''
+  rng = random.Random(seed)
+  r = [('no filter', [], [])]
+  used = set()
+  for n in sizes:
+    n = min(n, len(keys))
+    # sizes beyond the number of keys sample the same lists, their labels would collide in --compare
+    if n < 1 or n in used:
+      continue
+    used.add(n)
+    sample = sorted(rng.sample(keys, n))
+    r.append(('in %d' % n, sample, []))
+    r.append(('ex %d' % n, [], sample))
+  return r
+
+
+def windows(db, table):
+  '''(label, start, end) of a single step and 30 steps before the last one, like the steps of send_data_impl'''
+  ts = [r[0] for r in db.execute('SELECT DISTINCT ts FROM ' + table + ' ORDER BY ts DESC LIMIT 31')]
+  if len(ts) < 2:
+    return [('1 step', ts[0] if ts else 0, ts[0] if ts else 0)]
+  return [('1 step', ts[1], ts[0]), ('%d steps' % (len(ts) - 1), ts[-1], ts[0])]
+
+
+SCAN = re.compile(r'^SCAN (?:TABLE )?(\S+)(?: AS \S+)?( USING (?:COVERING )?INDEX \S+)?')
+
+
+def scans(plan):
+  '''(full table scans, full index scans) of the details of a query plan'''
+  # views and subqueries evaluated as co-routines are scanned as well, they are no tables
+  inner = set(d.split(' ', 1)[1] for d in plan if d.startswith('CO-ROUTINE ') or d.startswith('MATERIALIZE '))
+  tables, indexes = [], []
+  for d in plan:
+    m = SCAN.match(d)
+    if m is None or m.group(1) == 'CONSTANT' or m.group(1) in inner or m.group(1).startswith('('):
+      continue
+    (indexes if m.group(2) else tables).append(d)
+  return tables, indexes
+
+
+def explain(db, sql, params):
+  return [r[3] for r in db.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+
+
+def measure(db, sql, params, repeat):
+  times = []
+  rows = 0
+  for _ in range(repeat):
+    start = time.time()
+    rows = len(db.execute(sql, params).fetchall())
+    times.append(time.time() - start)
+  return sorted(times)[len(times) // 2], rows
+
+
+def clone_schema(db):
+  '''an empty in-memory copy of the tables, indexes and statistics of the database, the planner chooses the same plans on it'''
+  clone = sqlite3.connect(':memory:')
+  for (sql,) in db.execute("SELECT sql FROM sqlite_master WHERE type IN ('table', 'index') AND sql IS NOT NULL AND name NOT LIKE 'sqlite_%' ORDER BY type DESC"):
+    clone.execute(sql)
+  if db.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone():
+    clone.execute('ANALYZE')
+    clone.execute('DELETE FROM sqlite_stat1')
+    clone.executemany('INSERT INTO sqlite_stat1 VALUES (?, ?, ?)', db.execute('SELECT tbl, idx, stat FROM sqlite_stat1'))
+    clone.execute('ANALYZE sqlite_master')  # reload the statistics
+  return clone
+
+
+def indexed(db, table, columns):
+  '''whether an index of the table starts with the columns'''
+  for index in db.execute('PRAGMA index_list("' + table + '")').fetchall():
+    names = [r[2] for r in db.execute('PRAGMA index_info("' + index[1] + '")')]
+    if tuple(names[:len(columns)]) == tuple(columns):
+      return True
+  return False
+
+
+def cost(plan):
+  '''comparable cost of a plan: full table scans, full index scans, temp b-trees and fewer constrained index terms'''
+  full, index = scans(plan)
+  terms = sum(d.count('?') for d in plan if d.startswith('SEARCH'))
+  return (len(full), len(index), sum(d.startswith('USE TEMP B-TREE') for d in plan), -terms)
+
+
+def suggest(clone, shape, sql, params):
+  '''CREATE INDEX statements of the missing candidates of the shape which give the query a cheaper plan, tried on the clone'''
+  before = cost(explain(clone, sql, params))
+  r = []
+  for table, columns in shape.candidates:
+    if indexed(clone, table, columns):
+      continue
+    name = table + '_' + '_'.join(columns)
+    create = 'CREATE INDEX IF NOT EXISTS ' + name + ' on ' + table + '(' + ', '.join(columns) + ')'
+    clone.execute(create)
+    try:
+      plan = explain(clone, sql, params)
+      if any(' ' + name + ' ' in d + ' ' for d in plan) and cost(plan) < before:
+        r.append(create)
+    finally:
+      clone.execute('DROP INDEX ' + name)
+  return r
+
+
+def run(db, use_case, sizes, repeat, seed):
+  table, key, shapes = USE_CASES[use_case]
+  tables = set(r[0] for r in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'"))
+  keys = [r[0] for r in db.execute('SELECT DISTINCT ' + key + ' FROM ' + table + ' ORDER BY ' + key)]
+  clone = clone_schema(db)
+  results = []
+  for shape in shapes(tables):
+    steps = windows(db, shape.table) if shape.windowed else [(None, None, None)]
+    for label, filter_in, filter_ex in filters(keys, sizes, seed):
+      sql = shape.sql.replace('{filter}', filter_sql(shape.prop, filter_in, filter_ex))
+      for window, start, end in steps:
+        params = (start, end) if shape.windowed else ()
+        plan = explain(db, sql, params)
+        full, index = scans(plan)
+        seconds, rows = measure(db, sql, params, repeat)
+        name = shape.name + (', ' + window if window else '') + ', ' + label
+        entry = dict(name=name, plan=plan, full_scans=full, index_scans=index, seconds=round(seconds, 6), rows=rows,
+                     suggestions=suggest(clone, shape, sql, params))
+        results.append(entry)
+        summary = [d for d in plan if d.startswith(('SCAN', 'SEARCH', 'USE TEMP'))]
+        # a full index scan is reported, just full table scans fail
+        status = 'SCAN' if full else 'idx' if index else 'ok'
+        print('%-4s %-46s %9.2f ms %8d rows  %s' % (status, name, seconds * 1000, rows, '; '.join(summary)))
+  return results
+
+
+def compare(entries, path, threshold, min_seconds=0.0):
+  '''prints the changed plans and slowdowns compared to a previous run, returns the number of queries which became full table scans'''
+  with open(path, 'r') as f:
+    previous = dict((e['name'], e) for e in json.load(f)['results'])
+  regressions = 0
+  for e in entries:
+    p = previous.get(e['name'])
+    if p is None:
+      continue
+    if p['plan'] != e['plan']:
+      print('PLAN CHANGED %s\n  was: %s\n  now: %s' % (e['name'], '; '.join(p['plan']), '; '.join(e['plan'])))
+      if e['full_scans'] and not p['full_scans']:
+        regressions += 1
+    if max(p['seconds'], e['seconds']) >= min_seconds and p['seconds'] and e['seconds'] / p['seconds'] > threshold:
+      print('SLOWER %-46s %9.2f ms -> %9.2f ms (x%.2f)' % (e['name'], p['seconds'] * 1000, e['seconds'] * 1000, e['seconds'] / p['seconds']))
+  return regressions
+
+
+if __name__ == '__main__':
+  args = parser.parse_args()
+  if not os.path.isfile(args.db):
+    sys.exit('no database ' + args.db)
+  # read-only, the database is never modified nor created
+  db = sqlite3.connect('file:' + args.db + '?mode=ro', uri=True)
+  tables = set(r[0] for r in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'"))
+  use_case = args.use_case or next((u for u, (table, _, _) in sorted(USE_CASES.items()) if table in tables), None)
+  if use_case is None:
+    sys.exit('no table of a use case in ' + args.db + ', one of ' + ', '.join(t for t, _, _ in USE_CASES.values()))
+
+  results = run(db, use_case, args.filters, args.repeat, args.seed)
+
+  full = [e for e in results if e['full_scans']]
+  for e in full:
+    print('FULL SCAN %s: %s' % (e['name'], '; '.join(e['full_scans'])))
+  suggestions = {}
+  for e in results:
+    for s in e['suggestions']:
+      suggestions.setdefault(s, []).append(e['name'])
+  if suggestions:
+    print('missing indexes:')
+    for s, names in sorted(suggestions.items()):
+      print('  ' + s + ';  -- ' + str(len(names)) + ' queries, e.g. ' + names[0])
+
+  if args.out is not None:
+    meta = dict(created=datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'), python=platform.python_version(), sqlite=sqlite3.sqlite_version,
+                use_case=use_case, args=vars(args))
+    with open(args.out, 'w') as f:
+      json.dump(dict(meta=meta, results=results), f, indent=1, sort_keys=True)
+    print('results written to ' + args.out)
+
+  if args.compare is not None:
+    sys.exit(1 if compare(results, args.compare, args.threshold, args.min_seconds) else 0)
+  sys.exit(1 if full else 0)
@@ -0,0 +1,304 @@
+import argparse
+import io
+import json
+import math
+import multiprocessing
+import random
+import re
+import sys
+from collections import OrderedDict
+from json.decoder import scanstring
+
+import numpy as np
+import sqlite3
+
+parser = argparse.ArgumentParser(description='profiles the attributes of a use case database in one streaming pass and suggests the ranges of the traits file')
+parser.add_argument('--db', required=True)
+parser.add_argument('--traits', required=True, help='use case json file or traits file, e.g. ../thermal_sp500/sp500.json')
+parser.add_argument('--trait', default=None, help='name of the trait, default: all traits')
+parser.add_argument('--table', default=None, help='table of the attributes, default: the one with most attribute columns')
+parser.add_argument('--quantiles', type=float, nargs=2, default=[0.01, 0.99], help='quantiles of the suggested display range')
+parser.add_argument('--digits', type=int, default=2, help='significant digits the display range is rounded outward to')
+parser.add_argument('--real-key', default=None, help='key of the real [min, max], default: __range__ if the file uses it, else realrange')
+parser.add_argument('--sketch-size', type=int, default=512, help='items per level of the quantile sketches, the rank error is about 1 / size')
+parser.add_argument('--chunk', type=int, default=50000, help='rows fetched at once')
+parser.add_argument('--jobs', '-j', type=int, default=0, help='processes scanning rowid ranges of the table, 0 = number of cores')
+parser.add_argument('--write', action='store_true', help='write the suggested ranges into the traits file, else just report them')
+
+NUMERIC = ('float', 'int')
+
+
+class Sketch(object):
+  '''quantile sketch of a stream in bounded memory, a hierarchy of compactors like KLL
+
+  level h holds items of weight 2^h. a level exceeding size items is sorted and every second
+  item, starting at a random offset, moves up a level, the others are dropped. memory is
+  about size * log2(n / size) items, whole numpy chunks are added at once.
+  '''
+
+  def __init__(self, size=512, seed=0):
+    self.size = size
+    self.levels = []
+    self.n = 0
+    self.random = random.Random(seed)
+
+  def update(self, values, h=0):
+    self.n += len(values) * 2 ** h
+    self._add(values, h)
+
+  def merge(self, other):
+    for h, values in enumerate(other.levels):
+      self.update(values, h)
+
+  def _add(self, values, h):
+    while len(values):
+      if h == len(self.levels):
+        self.levels.append(values[:0])
+      values = np.concatenate((self.levels[h], values))
+      if len(values) <= self.size:
+        self.levels[h] = values
+        return
+      values.sort()
+      # an odd item stays, the rest is halved
+      keep = len(values) % 2
+      self.levels[h] = values[len(values) - keep:]
+      values = values[self.random.randint(0, 1):len(values) - keep:2]
+      h += 1
+
+  def quantiles(self, qs):
+    if not self.n:
+      return [None] * len(qs)
+    values = np.concatenate(self.levels)
+    weights = np.concatenate([np.full(len(l), 2.0 ** h) for h, l in enumerate(self.levels)])
+    order = np.argsort(values, kind='mergesort')
+    values, ranks = values[order], np.cumsum(weights[order])
+    return [float(values[min(int(np.searchsorted(ranks, q * ranks[-1])), len(values) - 1)]) for q in qs]
+
+
+class Profile(object):
+  def __init__(self, size):
+    self.rows = 0
+    self.nulls = 0
+    self.min = None
+    self.max = None
+    self.sketch = Sketch(size)
+
+  def merge(self, other):
+    self.rows += other.rows
+    self.nulls += other.nulls
+    if other.min is not None:
+      self.min = other.min if self.min is None else min(self.min, other.min)
+      self.max = other.max if self.max is None else max(self.max, other.max)
+    self.sketch.merge(other.sketch)
+
+  def update(self, values):
+    self.rows += len(values)
+    finite = values[np.isfinite(values)]
+    self.nulls += len(values) - len(finite)
+    values = finite
+    if len(values):
+      lo, hi = float(values.min()), float(values.max())
+      self.min = lo if self.min is None else min(self.min, lo)
+      self.max = hi if self.max is None else max(self.max, hi)
+      self.sketch.update(values)
+
+
+def load(path):
+  with io.open(path, 'r', encoding='utf-8') as f:
+    text = f.read()
+  return text, json.loads(text, object_pairs_hook=OrderedDict)
+
+
+def attributes(desc, trait=None):
+  '''(path, name, spec) of the numeric attributes, path is the key path of spec in the file'''
+  root = ('traits',) if 'traits' in desc else ()
+  traits = desc.get('traits', desc)
+  for t, v in traits.items():
+    if trait is not None and t != trait:
+      continue
+    for name, spec in v.get('attributes', {}).items():
+      if spec.get('type') in NUMERIC:
+        yield root + (t, 'attributes', name), name, spec
+
+
+def pick_table(db, names):
+  best, found = None, 0
+  for (table,) in db.execute("SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name"):
+    n = len(set(r[1] for r in db.execute('PRAGMA table_info("' + table + '")')) & names)
+    if n > found:
+      best, found = table, n
+  return best
+
+
+def profile(db, table, columns, size=512, chunk=50000, where='', params=()):
+  '''column -> Profile of one pass over the table'''
+  profiles = OrderedDict((c, Profile(size)) for c in columns)
+  cursor = db.execute('SELECT ' + ', '.join('"' + c + '"' for c in columns) + ' FROM "' + table + '"' + where, params)
+  while True:
+    batch = cursor.fetchmany(chunk)
+    if not batch:
+      return profiles
+    values = np.array(batch, dtype=float).reshape(len(batch), len(columns))  # NULL -> NaN
+    for i, p in enumerate(profiles.values()):
+      p.update(values[:, i])
+
+
+def _profile_range(job):
+  path, table, columns, size, chunk, lo, hi = job
+  db = sqlite3.connect(path)
+  try:
+    return profile(db, table, columns, size, chunk, ' WHERE rowid >= ? AND rowid < ?', (lo, hi))
+  finally:
+    db.close()
+
+
+def profile_parallel(path, table, columns, jobs, size=512, chunk=50000):
+  '''profile of rowid ranges of the table scanned by worker processes, merged into one'''
+  db = sqlite3.connect(path)
+  lo, hi = db.execute('SELECT min(rowid), max(rowid) FROM "' + table + '"').fetchone()
+  db.close()
+  if lo is None:
+    return OrderedDict((c, Profile(size)) for c in columns)
+  step = (hi - lo) // jobs + 1
+  ranges = [(path, table, columns, size, chunk, start, start + step) for start in range(lo, hi + 1, step)]
+  pool = multiprocessing.Pool(len(ranges))
+  try:
+    parts = pool.map(_profile_range, ranges, chunksize=1)
+    pool.close()
+  except BaseException:
+    pool.terminate()
+    raise
+  finally:
+    pool.join()
+  profiles = parts[0]
+  for part in parts[1:]:
+    for c, p in part.items():
+      profiles[c].merge(p)
+  return profiles
+
+
+def nice(lo, hi, digits, integer=False):
+  '''[lo, hi] rounded outward to the given significant digits of the larger bound'''
+  m = max(abs(lo), abs(hi))
+  if m == 0:
+    return [0, 0]
+  exponent = int(math.floor(math.log10(m))) - digits + 1
+  step = 10.0 ** exponent
+  r = [math.floor(lo / step) * step, math.ceil(hi / step) * step]
+  if integer or exponent >= 0:
+    return [int(round(v)) for v in r]
+  return [round(v, -exponent) for v in r]
+
+
+def suggest(spec, p, quantiles, digits):
+  '''suggested display range of an attribute, non-negative attributes shown from 0 keep their 0'''
+  lo, hi = p.sketch.quantiles(quantiles)
+  r = nice(lo, hi, digits, spec.get('type') == 'int')
+  old = spec.get('range')
+  if p.min >= 0 and old and old[0] == 0:
+    r[0] = 0
+  return r
+
+
+def exact(v, integer=False):
+  return int(round(v)) if integer else float('%.6g' % v)
+
+
+WS = re.compile(r'[ \t\n\r]*')
+NUMBER = re.compile(r'-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?')
+
+
+def spans(text):
+  '''path -> (start, end) of every value of a json text, paths are tuples of keys and indexes'''
+  r = {}
+  decoder = json.JSONDecoder()
+
+  def value(i, path):
+    i = WS.match(text, i).end()
+    start = i
+    if text[i] in '{[':
+      close = '}' if text[i] == '{' else ']'
+      i = WS.match(text, i + 1).end()
+      index = 0
+      while text[i] != close:
+        if close == '}':
+          key, i = scanstring(text, i + 1)
+          i = WS.match(text, i).end() + 1  # :
+        else:
+          key, index = index, index + 1
+        i = WS.match(text, value(i, path + (key,))).end()
+        if text[i] == ',':
+          i = WS.match(text, i + 1).end()
+      i += 1
+    else:
+      i = decoder.raw_decode(text, i)[1]
+    r[path] = (start, i)
+    return i
+
+  value(0, ())
+  return r
+
+
+def update_text(text, updates):
+  '''sets the [lo, hi] values of the (path, key) updates in place, keeping the formatting of the file
+
+  existing arrays keep their layout, just the numbers are replaced. missing keys are added after
+  the last member of their object with the indentation of it.
+  '''
+  where = spans(text)
+  edits = []
+  for path, key, v in updates:
+    if path + (key,) in where:
+      start, end = where[path + (key,)]
+      numbers = iter(v)
+      edits.append((start, end, NUMBER.sub(lambda m: json.dumps(next(numbers)), text[start:end])))
+    else:
+      members = [p for p in where if len(p) == len(path) + 1 and p[:-1] == path]
+      last = max(members, key=lambda p: where[p][1])
+      line = text.rfind('\n', 0, where[last][0]) + 1
+      indent = WS.match(text, line).group()
+      edits.append((where[last][1], where[last][1], ',\n' + indent + json.dumps(key) + ': ' + json.dumps(v)))
+  for start, end, replacement in sorted(edits, reverse=True):
+    text = text[:start] + replacement + text[end:]
+  return text
+
+
+if __name__ == '__main__':
+  args = parser.parse_args()
+  text, desc = load(args.traits)
+  attrs = list(attributes(desc, args.trait))
+  real_key = args.real_key or ('__range__' if '"__range__"' in text else 'realrange')
+
+  db = sqlite3.connect(args.db)
+  names = set(name for _, name, _ in attrs)
+  table = args.table or pick_table(db, names)
+  if table is None:
+    sys.exit('no table with a column of the attributes ' + ', '.join(sorted(names)))
+  existing = set(r[1] for r in db.execute('PRAGMA table_info("' + table + '")'))
+  columns = sorted(names & existing)
+  for name in sorted(names - existing):
+    print('skipped ' + name + ', no column in ' + table)
+  jobs = args.jobs if args.jobs > 0 else multiprocessing.cpu_count()
+  if jobs > 1:
+    profiles = profile_parallel(args.db, table, columns, jobs, args.sketch_size, args.chunk)
+  else:
+    profiles = profile(db, table, columns, args.sketch_size, args.chunk)
+
+  q_lo, q_hi = args.quantiles
+  updates = []
+  print('%-20s %10s %8s %12s %12s %12s %12s  %-24s %s' % ('attribute', 'rows', 'nulls', 'min', 'q%g' % q_lo, 'q%g' % q_hi, 'max', 'range', 'suggested'))
+  for path, name, spec in attrs:
+    p = profiles.get(name)
+    if p is None or p.min is None:
+      continue
+    integer = spec.get('type') == 'int'
+    r = suggest(spec, p, args.quantiles, args.digits)
+    lo, hi = p.sketch.quantiles(args.quantiles)
+    print('%-20s %10d %8d %12.6g %12.6g %12.6g %12.6g  %-24s %s' % (name, p.rows, p.nulls, p.min, lo, hi, p.max, json.dumps(spec.get('range')), json.dumps(r)))
+    updates.append((path, 'range', r))
+    updates.append((path, real_key, [exact(p.min, integer), exact(p.max, integer)]))
+
+  if args.write:
+    with io.open(args.traits, 'w', encoding='utf-8') as f:
+      f.write(update_text(text, updates))
+    print('wrote range and ' + real_key + ' of ' + str(len(updates) // 2) + ' attributes to ' + args.traits)
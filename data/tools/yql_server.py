@@ -0,0 +1,213 @@
+import argparse
+import datetime
+import json
+import random
+import re
+import signal
+import sys
+import threading
+import time
+import zlib
+from math import exp, sin
+
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from six.moves.socketserver import ThreadingMixIn
+from six.moves.urllib.parse import parse_qs, urlparse
+
+parser = argparse.ArgumentParser(description='local stand-in of the yql yahoo.finance.historicaldata table serving deterministic synthetic quotes')
+parser.add_argument('--host', default='localhost')
+parser.add_argument('--port', type=int, default=8090)
+parser.add_argument('--latency', type=float, default=0.0, help='mean response latency in seconds')
+parser.add_argument('--jitter', type=float, default=0.0, help='max random deviation of the latency in seconds')
+parser.add_argument('--row-latency', type=float, default=0.0, help='additional latency per returned quote in seconds')
+parser.add_argument('--rate', type=float, default=None, help='requests per second before answering 429 with a Retry-After header')
+parser.add_argument('--burst', type=float, default=None, help='burst size of --rate')
+parser.add_argument('--throttle-rate', type=float, default=0.0, help='probability of a random 429')
+parser.add_argument('--error-rate', type=float, default=0.0, help='probability of a random 500/502/503')
+parser.add_argument('--truncate-rate', type=float, default=0.0, help='probability of a response cut off in the middle of the body')
+parser.add_argument('--max-days', type=int, default=0, help='reject date ranges longer than this like yql did, 0 = unlimited')
+parser.add_argument('--seed', type=int, default=None, help='seed of the failure injection, the quotes are always the same')
+
+PATH = '/v1/public/yql'
+
+
+def quote(symbol, date):
+  '''deterministic quote of a symbol at a date, independent of the requested range'''
+  seed = zlib.crc32(symbol.encode('utf-8')) & 0xffffffff
+  day = (datetime.datetime.strptime(date, '%Y-%m-%d') - datetime.datetime(1970, 1, 1)).days
+  noise = (zlib.crc32((symbol + date).encode('utf-8')) & 0xffff) / 65535.0 - 0.5
+  base = 10 + seed % 200
+  close = base * exp(0.4 * sin(day / 150.0 + seed % 7) + 0.1 * sin(day / 11.0 + seed % 5) + 0.02 * noise)
+  open_ = close * (1 - 0.01 * noise)
+  adj = close * (1 - 0.0001 * max(0, 16800 - day) / 100)  # dividends: older prices adjusted down
+  return {
+    'Symbol': symbol,
+    'Date': date,
+    'Open': '%.2f' % open_,
+    'High': '%.2f' % (max(open_, close) * 1.01),
+    'Low': '%.2f' % (min(open_, close) * 0.99),
+    'Close': '%.2f' % close,
+    'Volume': str(100000 + (seed + day * 7919) % 5000000),
+    'Adj_Close': '%.2f' % adj
+  }
+
+
+def trading_days(start, end):
+  d = datetime.datetime.strptime(start, '%Y-%m-%d')
+  last = datetime.datetime.strptime(end, '%Y-%m-%d')
+  while d <= last:
+    if d.weekday() < 5:
+      yield d.strftime('%Y-%m-%d')
+    d += datetime.timedelta(days=1)
+
+
+def parse_query(q):
+  '''symbols, startDate and endDate of a historicaldata query as built by yql._YQLBuilder'''
+  if not re.search(r'from\s+yahoo\.finance\.historicaldata', q, re.I):
+    raise ValueError('unsupported table, only yahoo.finance.historicaldata is served')
+  single = re.search(r"symbol\s*=\s*['\"]([^'\"]+)['\"]", q)
+  multi = re.search(r'symbol\s+in\s*\(([^)]*)\)', q)
+  start = re.search(r"startDate\s*=\s*['\"]([^'\"]+)['\"]", q)
+  end = re.search(r"endDate\s*=\s*['\"]([^'\"]+)['\"]", q)
+  if not (single or multi) or not start or not end:
+    raise ValueError('missing symbol, startDate or endDate')
+  symbols = [single.group(1)] if single else re.findall(r"['\"]([^'\"]+)['\"]", multi.group(1))
+  return symbols, start.group(1), end.group(1)
+
+
+def results(symbols, start, end):
+  # yql lists the quotes of each symbol in descending date order
+  quotes = []
+  days = list(trading_days(start, end))[::-1]
+  for symbol in symbols:
+    quotes.extend(quote(symbol, d) for d in days)
+  return quotes
+
+
+class Bucket(object):
+  def __init__(self, rate, burst=None):
+    self.rate = rate
+    self.capacity = burst or max(1.0, rate)
+    self.tokens = self.capacity
+    self.last = time.time()
+    self.lock = threading.Lock()
+
+  def take(self):
+    '''None if a token was available, else the seconds until the next one'''
+    with self.lock:
+      now = time.time()
+      self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+      self.last = now
+      if self.tokens >= 1:
+        self.tokens -= 1
+        return None
+      return (1 - self.tokens) / self.rate
+
+
+class Stats(object):
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.counts = {}
+
+  def count(self, key, n=1):
+    with self.lock:
+      self.counts[key] = self.counts.get(key, 0) + n
+
+  def json(self):
+    with self.lock:
+      return dict(self.counts)
+
+
+class Handler(BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'  # keep alive, like the real api
+
+  def log_message(self, format, *args):
+    pass
+
+  def send(self, status, body, headers=None, truncate=False):
+    data = json.dumps(body).encode('utf-8')
+    self.send_response(status)
+    self.send_header('Content-Type', 'application/json; charset=utf-8')
+    self.send_header('Content-Length', str(len(data)))
+    for k, v in (headers or {}).items():
+      self.send_header(k, v)
+    self.end_headers()
+    if truncate:
+      self.wfile.write(data[:len(data) // 2])
+      self.close_connection = True
+    else:
+      self.wfile.write(data)
+    self.server.stats.count('status_' + str(status))
+
+  def error(self, status, description, headers=None):
+    self.send(status, {'error': {'lang': 'en-US', 'description': description}}, headers)
+
+  def do_GET(self):
+    server = self.server
+    options = server.options
+    server.stats.count('requests')
+    url = urlparse(self.path)
+    if url.path == '/stats':
+      return self.send(200, server.stats.json())
+    if url.path != PATH:
+      return self.error(404, 'not found: ' + url.path)
+
+    if options.rate:
+      wait = server.bucket.take()
+      if wait is not None:
+        return self.error(429, 'rate limit exceeded', {'Retry-After': str(max(1, int(wait + 0.999)))})
+    rnd = server.random
+    if rnd.random() < options.throttle_rate:
+      return self.error(429, 'too many requests', {'Retry-After': '1'})
+    if rnd.random() < options.error_rate:
+      status = rnd.choice((500, 502, 503))
+      return self.error(status, 'injected error')
+
+    params = parse_qs(url.query)
+    try:
+      symbols, start, end = parse_query(params.get('q', [''])[0])
+      days = (datetime.datetime.strptime(end, '%Y-%m-%d') - datetime.datetime.strptime(start, '%Y-%m-%d')).days
+    except ValueError as e:
+      return self.error(400, str(e))
+    if options.max_days and days > options.max_days:
+      return self.error(400, 'date range of %d days exceeds %d days' % (days, options.max_days))
+
+    quotes = results(symbols, start, end)
+    delay = options.latency + rnd.uniform(-options.jitter, options.jitter) + options.row_latency * len(quotes)
+    if delay > 0:
+      time.sleep(delay)
+
+    server.stats.count('quotes', len(quotes))
+    # a single quote is an object and no quote null, like yql did
+    r = quotes if len(quotes) > 1 else (quotes[0] if quotes else None)
+    body = {'query': {'count': len(quotes), 'created': datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'), 'lang': 'en-US',
+                      'results': {'quote': r} if r is not None else None}}
+    self.send(200, body, truncate=rnd.random() < options.truncate_rate)
+
+
+class Server(ThreadingMixIn, HTTPServer):
+  daemon_threads = True
+
+  def __init__(self, options):
+    HTTPServer.__init__(self, (options.host, options.port), Handler)
+    self.options = options
+    self.stats = Stats()
+    self.bucket = Bucket(options.rate, options.burst) if options.rate else None
+    self.random = random.Random(options.seed)
+
+  @property
+  def url(self):
+    return 'http://%s:%d%s' % (self.server_address[0], self.server_address[1], PATH)
+
+
+if __name__ == '__main__':
+  args = parser.parse_args()
+  server = Server(args)
+  print('serving yahoo.finance.historicaldata at ' + server.url + ', stats at /stats')
+  signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    print(json.dumps(server.stats.json(), sort_keys=True))
@@ -1,3 +1,5 @@
+const crypto = require('crypto');
+const zlib = require('zlib');
 const UseCaseSocketHandler = require('./UseCaseSocketHandler');
 const utils = require('./utils');
 const logger = require('./logger');
@@ -26,6 +28,9 @@ class UseCaseDBSocketHandler extends UseCaseSocketHandler {
         this.filter_in = [];
         this.filter_ex = [];
 
+        // table of precomputed messages per time bucket, see data/thermal_sp500/csv/cache.py
+        this.cache_table = null;
+
         this.socket.on('msg', (data) => {
             this.on_message(data);
         });
@@ -72,6 +77,33 @@ class UseCaseDBSocketHandler extends UseCaseSocketHandler {
         return [];
     }
 
+    filter_key() {
+        // same as filter_key of csv/cache.py
+        const canonical = JSON.stringify({
+            ex: [...(this.filter_ex || [])].sort(),
+            in: [...(this.filter_in || [])].sort()
+        });
+        return crypto.createHash('sha1').update(canonical, 'utf8').digest('hex').slice(0, 16);
+    }
+
+    read_cached_data(start, end, time_factor) {
+        if (!this.cache_table) {
+            return null;
+        }
+        const key = this.filter_key();
+        const extent = this.db.prepare(`select min(bucket) as first, max(bucket) as last from ${this.cache_table} where time_factor = ? and filter = ?`).get(time_factor, key);
+        // not cached or the range reaches outside of the cached buckets, query it
+        if (!extent || extent.last === null || start < extent.first || end - 1 > extent.last) {
+            return null;
+        }
+        const rows = this.db.prepare(`select payload from ${this.cache_table} where time_factor = ? and filter = ? and bucket >= ? and bucket < ? order by bucket`).all(time_factor, key, start, end);
+        const msgs = [];
+        rows.forEach((row) => {
+            msgs.push(...JSON.parse(zlib.inflateSync(row.payload).toString('utf8')));
+        });
+        return msgs;
+    }
+
     send_constant_data() {
         const msgs = this.read_constant_data();
         this.send_messages(msgs);
@@ -117,7 +149,7 @@ class UseCaseDBSocketHandler extends UseCaseSocketHandler {
     }
 
     send_data_impl(previous_time, act_time) {
-        const msgs = this.read_data(previous_time, act_time, this.timeFactor);
+        const msgs = this.read_cached_data(previous_time, act_time, this.timeFactor) || this.read_data(previous_time, act_time, this.timeFactor);
         const count = this.send_messages(msgs);
 
         logger.info('send %s - %s = %d messages', utils.ms(previous_time * this.timeFactor), utils.ms(act_time * this.timeFactor), count);